@@ -10,15 +10,33 @@ load_dotenv()
 import os
 import json
 import warnings
-from flask import Flask, render_template, request, jsonify
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
 from requests.auth import HTTPBasicAuth
-from confluence.api_client import ConfluenceAPI
-from confluence.service import extract_page_content, build_page_tree, build_descendants_tree
+from confluence.api_client import ConfluenceAPI, confluence_headers
+from confluence.service import extract_page_content, build_page_tree, build_descendants_tree, page_space
 from confluence.utils import extract_page_id_from_url
 from confluence.translator import translate_en_to_ja
+from confluence.crawler import get_descendants_tree
+from confluence.fields import TREE_FIELDS
+from confluence.governor import get_governor
+from confluence.http_cache import get_http_cache
+from confluence.http_pool import get_session_registry
+from confluence.jobs import JOB_KINDS, JobQueue
+from confluence.search_index import get_search_index
+from confluence.semantic_index import describe_embedder, get_semantic_index
+from confluence.singleflight import get_single_flight
+from confluence.snapshot_store import SnapshotMissError, get_snapshot_store
+from confluence.translation_cache import get_translation_cache
+from confluence.tree_index import get_tree_index
+from confluence.translation_memory import get_translation_memory
 import config
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, RequestException
 
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 
@@ -28,13 +46,192 @@ app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
 CORS(app)
 
+# /api/page_by_url の各ステージの待ち時間（秒、リクエスト開始からの経過時間）
+# 翻訳が間に合わない場合はページ・子ページのみ返し、翻訳はバックグラウンドで続ける
+PAGE_FETCH_TIMEOUT = float(os.getenv('PAGE_FETCH_TIMEOUT', '30'))
+CHILDREN_FETCH_TIMEOUT = float(os.getenv('CHILDREN_FETCH_TIMEOUT', '30'))
+TRANSLATION_WAIT_TIMEOUT = float(os.getenv('TRANSLATION_WAIT_TIMEOUT', '20'))
+PAGE_STAGE_WORKERS = int(os.getenv('PAGE_STAGE_WORKERS', '16'))
+_stage_executor = ThreadPoolExecutor(max_workers=PAGE_STAGE_WORKERS, thread_name_prefix='page-stage')
+# 取得したページをベクトルインデックス（意味検索）にも反映するかどうか（埋め込みはバックグラウンドで行う）
+SEMANTIC_INDEX_ON_FETCH = os.getenv('SEMANTIC_INDEX_ON_FETCH', '1') == '1'
+# 埋め込みはページ表示のステージとは別の小さなスレッドプールで行い、待ちが上限を超えた分は捨てる
+# （ジョブ・同期で大量のページを取得しても、画面からのリクエストが埋め込みの後ろで待たされないようにする）
+SEMANTIC_INDEX_WORKERS = int(os.getenv('SEMANTIC_INDEX_WORKERS', '1'))
+SEMANTIC_INDEX_QUEUE = int(os.getenv('SEMANTIC_INDEX_QUEUE', '32'))
+_semantic_executor = ThreadPoolExecutor(max_workers=SEMANTIC_INDEX_WORKERS, thread_name_prefix='semantic-index')
+_semantic_slots = threading.BoundedSemaphore(SEMANTIC_INDEX_WORKERS + SEMANTIC_INDEX_QUEUE)
+
 def get_confluence_client():
     base_url = config.CONFLUENCE_BASE_URL
     username = config.CONFLUENCE_USERNAME
     api_token = config.CONFLUENCE_API_TOKEN
     if not all([base_url, username, api_token]):
         return None
-    return ConfluenceAPI(base_url, username, api_token)
+    # セッション（コネクションプール）はワーカースレッド間で共有し、リクエストごとのTLSハンドシェイクを避ける
+    # 認証ヘッダーはセッションの作成時に1回だけ設定する（共有中のセッションのヘッダーは書き換えない）
+    session = get_session_registry().get(
+        f"confluence:{username}@{base_url}",
+        setup=lambda session: session.headers.update(confluence_headers(username, api_token))
+    )
+    # 本文付きで取得したページはスナップショットに保存し、障害時・オフライン時はそこから返す（CONFLUENCE_READ_MODE）
+    return ConfluenceAPI(base_url, username, api_token, session=session, http_cache=get_http_cache(),
+                         snapshot_store=get_snapshot_store())
+
+def fetch_page_data(confluence, page_id):
+    """
+    ページ本体を取得（まずv1、404ならv2で再取得）。v2でも404の場合はNoneを返す
+    同じページの取得が実行中の場合は、その結果を共有する
+    """
+    page_data, _ = get_single_flight().do(('page', page_id), _fetch_page_data, confluence, page_id)
+    return page_data
+
+def _fetch_page_data(confluence, page_id):
+    page_data = _fetch_page_data_v1_or_v2(confluence, page_id)
+    if page_data is not None:
+        # 取得したページはローカルの全文検索インデックスに反映（バージョンが進んだ場合のみ索引し直す）
+        try:
+            get_search_index().index_page(page_data)
+        except sqlite3.Error as e:
+            print('[検索インデックス更新エラー]', e)
+        if SEMANTIC_INDEX_ON_FETCH:
+            submit_semantic_index(page_data)
+    return page_data
+
+def submit_semantic_index(page_data):
+    """
+    ベクトルインデックスへの反映を予約する（待ちが上限に達している場合は捨て、次に取得した時点で反映する）
+    """
+    if not _semantic_slots.acquire(blocking=False):
+        print(f"[DEBUG] ベクトルインデックスの更新待ちが上限に達したため、スキップします: page_id={page_data.get('id')}")
+        return False
+    _semantic_executor.submit(_index_semantic, page_data)
+    return True
+
+def _index_semantic(page_data):
+    try:
+        # スペースは page_data から取る（space を展開していないv1・v2のページは extract_page_content に space_key がない）
+        get_semantic_index().index_page(extract_page_content(page_data), space=page_space(page_data))
+    except (sqlite3.Error, RequestException, ValueError) as e:
+        print('[ベクトルインデックス更新エラー]', e)
+    finally:
+        _semantic_slots.release()
+
+def _fetch_page_data_v1_or_v2(confluence, page_id):
+    try:
+        return confluence.get_page_content(page_id)
+    except HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+    # v2 APIで再取得
+    try:
+        return confluence.get_page_v2(page_id)
+    except HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+def fetch_children(confluence, page_id):
+    """
+    子ページ一覧を取得（子ページは必ずv2 APIで取得。実行中の取得があれば結果を共有）
+    """
+    children, _ = get_single_flight().do(('children', page_id), _fetch_children, confluence, page_id)
+    return children
+
+def _fetch_children(confluence, page_id):
+    children_data = confluence.get_page_children_v2(page_id)
+    children = []
+    for child in children_data.get('results', []):
+        children.append({
+            'id': child.get('id'),
+            'title': child.get('title'),
+            'status': child.get('status'),
+            'spaceId': child.get('spaceId'),
+            'childPosition': child.get('childPosition')
+        })
+    return children
+
+def translate_page_info(page_info, force=False, progress=None):
+    """
+    ページ本文を翻訳（ページID + バージョン + 本文ハッシュでキャッシュ）
+    戻り値: (翻訳結果, キャッシュから返したかどうか, 翻訳メモリのヒット数などの統計)
+    同じページ・バージョンの翻訳が実行中の場合は、新たに翻訳せずその結果を共有する
+    （共有した側には progress の通知は届かず、完了時の結果のみ返る）
+    """
+    if not page_info.get('content'):
+        return None, False, {}
+    key = ('translate', page_info.get('id'), page_info.get('version'), force)
+    result, _ = get_single_flight().do(key, _translate_page_info, page_info, force, progress)
+    return result
+
+def _translate_page_info(page_info, force, progress):
+    content = page_info.get('content')
+    cache = get_translation_cache()
+    if not force:
+        cached = cache.get(page_info.get('id'), page_info.get('version'), content)
+        if cached is not None:
+            print(f"[CACHE] 翻訳キャッシュヒット: page_id={page_info.get('id')} version={page_info.get('version')}")
+            return cached, True, {}
+    stats = {}
+    translated_body = translate_en_to_ja(content, stats=stats, progress=progress)
+    print(f"[DEBUG] 翻訳メモリ: hits={stats.get('tm_hits')} misses={stats.get('tm_misses')}")
+    if stats.get('failed_blocks') or stats.get('failed_segments'):
+        # 原文のまま残った段落がある翻訳はキャッシュしない（翻訳済みの段落は翻訳メモリから再利用される）
+        return translated_body, False, stats
+    cache.put(page_info.get('id'), page_info.get('version'), content, translated_body)
+    return translated_body, False, stats
+
+def _list_job_pages(kind, target):
+    """
+    ジョブの対象ページIDを列挙（'tree': ページ自身と子孫 / 'space': スペース内の全ページ）
+    """
+    confluence = get_confluence_client()
+    if not confluence:
+        raise ValueError('Confluence設定が不完全です')
+    if kind == 'tree':
+        result = get_descendants_tree(confluence, target, refresh=True)
+        if result['errors']:
+            # 子ページの取得に失敗した枝があると、その配下のページがジョブから漏れるため、ジョブを失敗にする
+            failed = ', '.join(f"{error['page_id']}: {error['error']}" for error in result['errors'][:5])
+            raise RuntimeError(f"{len(result['errors'])}ページの子ページ一覧を取得できませんでした（{failed}）")
+        return [target] + [page['id'] for page in result['flat_list']]
+    space_id = confluence.get_space_id_by_key_v2(target)
+    if not space_id:
+        raise ValueError(f"スペースが見つかりません: {target}")
+    return (page.get('id') for page in confluence.iter_all_pages_in_space_v2(space_id, fields=TREE_FIELDS))
+
+def _translate_job_page(page_id):
+    """
+    ジョブのタスクとして1ページを翻訳し、翻訳キャッシュに保存する
+    """
+    confluence = get_confluence_client()
+    if not confluence:
+        raise ValueError('Confluence設定が不完全です')
+    page_data = fetch_page_data(confluence, page_id)
+    if page_data is None:
+        return 'missing'
+    translated_body, translation_cached, translation_stats = translate_page_info(extract_page_content(page_data))
+    if translated_body is None:
+        return 'skipped'
+    if translation_stats.get('failed_blocks') or translation_stats.get('failed_segments'):
+        return 'failed'
+    return 'cached' if translation_cached else 'translated'
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue(start: bool = True):
+    """
+    事前翻訳のジョブキューを返す（start=True なら初回呼び出し時にワーカーを起動し、未完了のジョブを再開する）
+    閲覧の記録のみの場合は start=False で呼び、ページ表示のたびにワーカーを起動しない
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(_list_job_pages, _translate_job_page)
+        if start:
+            _job_queue.start()
+        return _job_queue
 
 @app.route('/')
 def index():
@@ -54,55 +251,66 @@ def get_page_by_url():
         confluence = get_confluence_client()
         if not confluence:
             return jsonify({'error': 'Confluence設定が不完全です'}), 400
+        # 閲覧されたページは事前翻訳ジョブで優先して処理する
+        get_job_queue(start=False).record_view(page_id)
 
-        # ページ本体（まずv1、404ならv2で再取得）
+        # ページ本体と子ページ一覧は互いに依存しないため同時に取得し、翻訳はページ本体の取得後に開始する
+        started = time.monotonic()
+        page_future = _stage_executor.submit(fetch_page_data, confluence, page_id)
+        children_future = _stage_executor.submit(fetch_children, confluence, page_id)
         try:
-            page_data = confluence.get_page_content(page_id)
-        except HTTPError as e:
-            if e.response is not None and e.response.status_code == 404:
-                # v2 APIで再取得
-                url = f"{confluence.base_url}/wiki/api/v2/pages/{page_id}?body-format=storage"
-                headers = {"Accept": "application/json"}
-                resp = confluence.session.get(url, headers=headers, verify=False)
-                if resp.status_code == 404:
-                    return jsonify({'error': 'ページが存在しないか、権限がありません（404）'}), 404
-                resp.raise_for_status()
-                page_data = resp.json()
-            else:
-                raise
+            # ページ本体（まずv1、404ならv2で再取得）
+            page_data = page_future.result(timeout=PAGE_FETCH_TIMEOUT)
+        except FutureTimeoutError:
+            return jsonify({'error': 'ページの取得がタイムアウトしました'}), 504
+        except SnapshotMissError as e:
+            return jsonify({'error': str(e)}), 503
+        if page_data is None:
+            return jsonify({'error': 'ページが存在しないか、権限がありません（404）'}), 404
 
         page_info = extract_page_content(page_data)
         # page_info['content'] には必ず原文（英語）のみをセットすること！
-        # 英語本文を日本語に翻訳
+        translation_future = None
+        if page_info.get('content'):
+            print(f"[DEBUG] 翻訳対象長: {len(page_info['content'])}")
+            # タイムアウトしても翻訳は続き、完了すると翻訳キャッシュに保存される（/api/translate で取得できる）
+            translation_future = _stage_executor.submit(translate_page_info, page_info)
+
+        children = None
+        children_error = None
+        try:
+            children = children_future.result(timeout=max(0, CHILDREN_FETCH_TIMEOUT - (time.monotonic() - started)))
+        except FutureTimeoutError:
+            print(f"[DEBUG] 子ページ一覧の取得がタイムアウトしました: page_id={page_id}")
+        except Exception as e:
+            # 子ページが取得できなくてもページ本体と翻訳は返す
+            print('[子ページ取得エラー]', e)
+            children_error = str(e)
+
         translated_body = None
-        print(f"[DEBUG] page_info: {page_info}")
-        content = page_info.get('content')
-        print(f"[DEBUG] 翻訳対象: {content}")
-        if page_info and content:
-            print(f"[DEBUG] 翻訳対象長: {len(content)}")
+        translation_cached = False
+        translation_stats = {}
+        translation_pending = False
+        if translation_future is not None:
             try:
-                translated_body = translate_en_to_ja(content)
-                print(f"[DEBUG] 翻訳結果: {translated_body}")
+                translated_body, translation_cached, translation_stats = translation_future.result(
+                    timeout=max(0, TRANSLATION_WAIT_TIMEOUT - (time.monotonic() - started)))
+            except FutureTimeoutError:
+                print(f"[DEBUG] 翻訳が時間内に終わらなかったため、翻訳なしで返します: page_id={page_id}")
+                translation_pending = True
             except Exception as e:
                 print('[翻訳エラー]', e)
-                translated_body = None
-
-        # 子ページは必ずv2 APIで取得
-        children_data = confluence.get_page_children_v2(page_id)
-        children = []
-        for child in children_data.get('results', []):
-            children.append({
-                'id': child.get('id'),
-                'title': child.get('title'),
-                'status': child.get('status'),
-                'spaceId': child.get('spaceId'),
-                'childPosition': child.get('childPosition')
-            })
 
         return jsonify({
             'page': page_info,
             'children': children,
-            'translated_body': translated_body
+            'children_pending': children is None and children_error is None,
+            'children_error': children_error,
+            'translated_body': translated_body,
+            'translation_cached': translation_cached,
+            'translation_stats': translation_stats,
+            'translation_pending': translation_pending,
+            'elapsed': round(time.monotonic() - started, 3)
         })
     except Exception as e:
         import traceback
@@ -121,41 +329,272 @@ def translate_page():
         if not confluence:
             return jsonify({'error': 'Confluence設定が不完全です'}), 400
         # ページ本体取得
-        try:
-            page_data = confluence.get_page_content(page_id)
-        except HTTPError as e:
-            if e.response is not None and e.response.status_code == 404:
-                url = f"{confluence.base_url}/wiki/api/v2/pages/{page_id}?body-format=storage"
-                headers = {"Accept": "application/json"}
-                resp = confluence.session.get(url, headers=headers, verify=False)
-                if resp.status_code == 404:
-                    return jsonify({'error': 'ページが存在しないか、権限がありません（404）'}), 404
-                resp.raise_for_status()
-                page_data = resp.json()
-            else:
-                raise
+        page_data = fetch_page_data(confluence, page_id)
+        if page_data is None:
+            return jsonify({'error': 'ページが存在しないか、権限がありません（404）'}), 404
         page_info = extract_page_content(page_data)
         translated_body = None
+        translation_cached = False
+        translation_stats = {}
         content = page_info.get('content')
         print(f"[DEBUG] 再翻訳対象: {content}")
         if page_info and content:
             print(f"[DEBUG] 再翻訳対象長: {len(content)}")
             try:
-                translated_body = translate_en_to_ja(content)
+                # force=true の場合はキャッシュを使わずに翻訳し直す
+                translated_body, translation_cached, translation_stats = translate_page_info(page_info, force=bool(data.get('force')))
                 print(f"[DEBUG] 再翻訳結果: {translated_body}")
             except Exception as e:
                 print('[翻訳エラー]', e)
                 translated_body = None
-        return jsonify({'translated_body': translated_body})
+        return jsonify({
+            'translated_body': translated_body,
+            'translation_cached': translation_cached,
+            'translation_stats': translation_stats
+        })
     except Exception as e:
         import traceback
         print(traceback.format_exc())
         print('[ERROR]', e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/descendants/<page_id>', methods=['GET'])
+def get_descendants(page_id):
+    try:
+        confluence = get_confluence_client()
+        if not confluence:
+            return jsonify({'error': 'Confluence設定が不完全です'}), 400
+        # ?depth=N の場合はN階層まで（画面は depth=1 で直下の子ページのみ取得する）
+        max_depth = None
+        if request.args.get('depth'):
+            try:
+                max_depth = int(request.args['depth'])
+            except ValueError:
+                return jsonify({'error': 'depthは数値で指定してください'}), 400
+            if max_depth < 1:
+                return jsonify({'error': 'depthは1以上を指定してください'}), 400
+        # ?refresh=1 の場合はキャッシュを使わずに取得し直す
+        result = get_descendants_tree(confluence, page_id, refresh=request.args.get('refresh') == '1',
+                                      max_depth=max_depth)
+        return jsonify(result)
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        print('[ERROR]', e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tree/<page_id>', methods=['GET'])
+def get_tree(page_id):
+    """
+    ツリーインデックスからページの祖先・深さ・子孫ツリーを返す（Confluence APIは呼ばない）
+    子孫ページの取得（/api/descendants）やスペース同期でインデックスに登録されたページのみ対象
+    """
+    started = time.monotonic()
+    result = get_tree_index().view(page_id)
+    if result is None:
+        return jsonify({'error': 'ツリーインデックスに登録されていないページです'}), 404
+    result['elapsed'] = round(time.monotonic() - started, 6)
+    return jsonify(result)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/page_by_url/stream', methods=['GET'])
+def stream_page_by_url():
+    """
+    Server-Sent Eventsでページ情報を返す
+    meta（ページ情報）→ plan（段落一覧）→ block（翻訳済みブロック）... → done の順に送信する
+    子ページ一覧は取得でき次第 children として送信する（done までに CHILDREN_FETCH_TIMEOUT 秒を超えた場合は送らない）
+    """
+    page_input = request.args.get('page_input', '').strip()
+
+    def generate():
+        try:
+            page_id = extract_page_id_from_url(page_input)
+            if not page_id:
+                yield sse_event('failure', {'error': 'ページIDが抽出できませんでした', 'status': 400})
+                return
+            confluence = get_confluence_client()
+            if not confluence:
+                yield sse_event('failure', {'error': 'Confluence設定が不完全です', 'status': 400})
+                return
+            get_job_queue(start=False).record_view(page_id)
+            # 子ページ一覧はページ本体の取得と並行して取得し、取得でき次第キュー経由で送信する
+            started = time.monotonic()
+            events = queue.Queue()
+            children_future = _stage_executor.submit(fetch_children, confluence, page_id)
+
+            def send_children(future):
+                try:
+                    events.put(('children', {'children': future.result()}))
+                except Exception as e:
+                    # オフライン時などで子ページが取得できなくてもページ本体と翻訳は返す
+                    print('[子ページ取得エラー]', e)
+                    events.put(('children', {'children': [], 'error': str(e)}))
+
+            page_data = fetch_page_data(confluence, page_id)
+            if page_data is None:
+                yield sse_event('failure', {'error': 'ページが存在しないか、権限がありません（404）', 'status': 404})
+                return
+            page_info = extract_page_content(page_data)
+            yield sse_event('meta', {'page': page_info})
+            children_future.add_done_callback(send_children)
+
+            # 翻訳は別スレッドで実行し、ブロックごとの完了通知をキュー経由で送信する
+            outcome = {}
+
+            def run_translation():
+                try:
+                    outcome['result'] = translate_page_info(
+                        page_info, progress=lambda event, data: events.put((event, data)))
+                except Exception as e:
+                    print('[翻訳エラー]', e)
+                    outcome['error'] = str(e)
+                finally:
+                    events.put(None)
+
+            threading.Thread(target=run_translation, daemon=True).start()
+            translation_done = False
+            children_sent = False
+            while not (translation_done and children_sent):
+                try:
+                    # 翻訳が終わった後は、子ページ一覧を CHILDREN_FETCH_TIMEOUT までしか待たない
+                    timeout = max(0, CHILDREN_FETCH_TIMEOUT - (time.monotonic() - started)) if translation_done else None
+                    item = events.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"[DEBUG] 子ページ一覧の取得がタイムアウトしました: page_id={page_id}")
+                    break
+                if item is None:
+                    translation_done = True
+                    continue
+                if item[0] == 'children':
+                    children_sent = True
+                yield sse_event(*item)
+            translated_body, translation_cached, translation_stats = outcome.get('result', (None, False, {}))
+            yield sse_event('done', {
+                'translated_body': translated_body,
+                'translation_cached': translation_cached,
+                'translation_stats': translation_stats,
+                'translation_error': outcome.get('error')
+            })
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            print('[ERROR]', e)
+            status = e.response.status_code if isinstance(e, HTTPError) and e.response is not None else 500
+            if isinstance(e, SnapshotMissError):
+                status = 503
+            yield sse_event('failure', {'error': str(e), 'status': status})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    事前翻訳ジョブを登録
+    {"type": "tree", "page_input": ページID/URL} または {"type": "space", "space_key": スペースキー}
+    """
+    data = request.json
+    if not data:
+        return jsonify({'error': 'リクエストボディが空です'}), 400
+    kind = data.get('type')
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f"type は {' / '.join(JOB_KINDS)} のいずれかを指定してください"}), 400
+    if kind == 'tree':
+        target = extract_page_id_from_url(str(data.get('page_input', '')).strip())
+        if not target:
+            return jsonify({'error': 'ページIDが抽出できませんでした'}), 400
+    else:
+        target = str(data.get('space_key', '')).strip()
+        if not target:
+            return jsonify({'error': 'space_keyが指定されていません'}), 400
+    job_id = get_job_queue().submit(kind, target)
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job)
+
+@app.route('/api/search', methods=['GET'])
+def search_pages():
+    """
+    取得済みページのローカル全文検索（?q=検索語&limit=件数&space=スペースキーまたはスペースID）
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '検索語（q）が指定されていません'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limitは数値で指定してください'}), 400
+    started = time.monotonic()
+    results = get_search_index().search(query, limit=limit, space=request.args.get('space') or None)
+    return jsonify({
+        'query': query,
+        'results': results,
+        'total': len(results),
+        'elapsed': round(time.monotonic() - started, 4),
+        # 意味検索（/api/semantic_search）の埋め込みの方式（stub=True は言語をまたいだ検索ができない代替）
+        'semantic_embedder': describe_embedder()
+    })
+
+@app.route('/api/semantic_search', methods=['GET'])
+def semantic_search():
+    """
+    取得済みページの意味検索（?q=検索語&k=件数&space=スペースキー&per_page=0 で同じページの複数チャンクも返す）
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '検索語（q）が指定されていません'}), 400
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'kは数値で指定してください'}), 400
+    started = time.monotonic()
+    try:
+        index = get_semantic_index()
+        results = index.search(query, k=k, space=request.args.get('space') or None,
+                               per_page=request.args.get('per_page', '1') != '0')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({
+        'query': query,
+        'results': results,
+        'total': len(results),
+        'elapsed': round(time.monotonic() - started, 4),
+        'embedder': {'name': index.embedder.name, 'stub': getattr(index.embedder, 'stub', False)}
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'translation_cache': get_translation_cache().stats(),
+        'translation_memory': get_translation_memory().stats(),
+        'http_cache': get_http_cache().stats(),
+        'single_flight': get_single_flight().stats(),
+        'search_index': get_search_index().stats(),
+        'tree_index': get_tree_index().stats(),
+        'snapshot_store': get_snapshot_store().stats()
+    })
+
+
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(get_session_registry().stats())
+
+@app.route('/api/governor/stats', methods=['GET'])
+def get_governor_stats():
+    return jsonify(get_governor().stats())
+
 
 if __name__ == "__main__":
     print("Confluence API Webアプリケーションを起動中...")
     print("http://localhost:5000 にアクセスしてください")
+    # 前回の未完了ジョブを再開
+    get_job_queue()
     print("Flaskサーバー起動: http://localhost:5000")
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
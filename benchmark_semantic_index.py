@@ -0,0 +1,62 @@
+"""
+ベクトルインデックス（confluence.semantic_index）の検索時間のベンチマーク
+
+例: python benchmark_semantic_index.py --chunks 100000 --dimensions 256
+埋め込みAPIは呼ばず、乱数のベクトルを返す埋め込みで指定件数のチャンクを索引してから検索時間を計測する
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from confluence.semantic_index import SemanticIndex
+
+PARAGRAPHS_PER_PAGE = 10
+
+
+class RandomEmbedder:
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.name = f'random:{dimensions}'
+        self._rng = np.random.default_rng(0)
+
+    def embed(self, texts):
+        vectors = self._rng.standard_normal((len(texts), self.dimensions)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベクトルインデックスの検索時間のベンチマーク')
+    parser.add_argument('--chunks', type=int, default=100000, help='索引するチャンク数')
+    parser.add_argument('--dimensions', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=32, help='search_many でまとめて検索する件数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 1段落が1チャンクになるようにチャンクの上限を小さくする
+        index = SemanticIndex(RandomEmbedder(args.dimensions), directory=directory, chunk_tokens=8)
+        started = time.perf_counter()
+        for page in range(args.chunks // PARAGRAPHS_PER_PAGE):
+            content = ''.join(f'<p>paragraph {i} of page {page} text</p>' for i in range(PARAGRAPHS_PER_PAGE))
+            index.index_page({'id': str(page), 'version': 1, 'title': f'Page {page}',
+                              'space_key': 'BENCH', 'content': content})
+        print(f"索引: {time.perf_counter() - started:.1f}秒 {index.stats()}")
+
+        timings = []
+        for i in range(args.queries):
+            started = time.perf_counter()
+            index.search(f'query {i}', k=10)
+            timings.append(time.perf_counter() - started)
+        print(f"search     : 中央値 {statistics.median(timings) * 1000:.2f}ms  最大 {max(timings) * 1000:.2f}ms")
+
+        started = time.perf_counter()
+        index.search_many([f'query {i}' for i in range(args.batch)], k=10)
+        elapsed = time.perf_counter() - started
+        print(f"search_many: {args.batch}件 {elapsed * 1000:.2f}ms（1件あたり {elapsed / args.batch * 1000:.2f}ms）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+翻訳対象の段落抽出・訳文の埋め込みのベンチマーク
+（BeautifulSoup html.parser による従来の処理と confluence.storage_format の比較）
+
+例: python benchmark_storage_format.py --size-kb 1500 --repeat 5
+BeautifulSoup がインストールされていない場合は storage_format のみ計測する
+"""
+import argparse
+import time
+
+from confluence.storage_format import apply_translations, extract_segments
+from confluence.translation_memory import normalize_segment
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+TRANSLATABLE_TAGS = ["p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "td", "th", "span", "div"]
+
+
+def build_document(size_kb: int) -> str:
+    """
+    表・マクロ・入れ子のdivを含むストレージ形式のページを指定サイズ程度まで生成
+    """
+    chunks = []
+    total = 0
+    i = 0
+    while total < size_kb * 1024:
+        chunk = (
+            f'<h2>Section {i} overview</h2>'
+            f'<div><p>This is paragraph {i} with <strong>bold</strong> text and '
+            f'<ac:link><ri:page ri:content-title="Page {i}" />'
+            f'<ac:plain-text-link-body><![CDATA[a link]]></ac:plain-text-link-body></ac:link>.</p></div>'
+            '<table><tbody>'
+            + ''.join(f'<tr><th>Key {i}-{r}</th><td><p>Value for row {r} of table {i}</p></td></tr>' for r in range(10))
+            + '</tbody></table>'
+            f'<ul><li>First item {i}<ul><li>Nested item {i}</li></ul></li><li>Second item {i}</li></ul>'
+            '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">python</ac:parameter>'
+            f'<ac:plain-text-body><![CDATA[def handler_{i}(event):\n    return "<p>{i}</p>"\n]]></ac:plain-text-body>'
+            '</ac:structured-macro>'
+        )
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+    return ''.join(chunks)
+
+
+def run_beautifulsoup(document: str) -> int:
+    # 変更前の translate_en_to_ja と同じ処理（訳文の代わりに原文の大文字を埋め込む）
+    soup = BeautifulSoup(document, "html.parser")
+    segments = []
+    for tag in soup.find_all(TRANSLATABLE_TAGS):
+        t = normalize_segment(tag.get_text(strip=True))
+        if t:
+            segments.append((tag, t))
+    for tag, t in segments:
+        tag.clear()
+        tag.append(t.upper())
+    str(soup)
+    return len(segments)
+
+
+def run_storage_format(document: str) -> int:
+    segments = extract_segments(document)
+    apply_translations(document, segments, {i: segment.text.upper() for i, segment in enumerate(segments)})
+    return len(segments)
+
+
+def measure(fn, document: str, repeat: int):
+    timings = []
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = fn(document)
+        timings.append(time.perf_counter() - started)
+    return min(timings), count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='段落抽出・訳文埋め込みのベンチマーク')
+    parser.add_argument('--size-kb', type=int, default=1500, help='生成するページのサイズ（KB）')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    document = build_document(args.size_kb)
+    print(f"ページサイズ: {len(document) / 1024:.0f}KB")
+    fast, fast_segments = measure(run_storage_format, document, args.repeat)
+    print(f"storage_format : {fast * 1000:8.1f}ms  段落数={fast_segments}")
+    if BeautifulSoup is None:
+        print("BeautifulSoup がインストールされていないため、従来の処理は計測しません")
+        return
+    slow, slow_segments = measure(run_beautifulsoup, document, args.repeat)
+    print(f"BeautifulSoup  : {slow * 1000:8.1f}ms  段落数={slow_segments}（親子で重複した段落を含む）")
+    print(f"速度比: {slow / fast:.1f}倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,130 +1,275 @@
 import requests
 import base64
+import sqlite3
 import warnings
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
+from confluence.fields import has_body, v1_expand, v2_params
+from confluence.governor import RequestGovernor, get_governor
+from confluence.http_cache import HTTPCache
+from confluence.pagination import V2_MAX_LIMIT, iter_cursor_pages, iter_cursor_results, next_cursor_url
+from confluence.snapshot_store import CONFLUENCE_READ_MODE, READ_MODES, SnapshotMissError, SnapshotStore, is_outage
+from confluence.utils import cql_quote
 
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 
+def confluence_headers(username: str, api_token: str) -> Dict[str, str]:
+    """
+    Confluence APIの認証ヘッダー（Basic認証）とJSONのContent-Type / Accept を返す
+    """
+    credentials = f"{username}:{api_token}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    return {
+        'Authorization': f'Basic {encoded_credentials}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
 class ConfluenceAPI:
     """
     Confluence APIを使用してコンテンツを取得するクラス
     （API通信・データ取得部分のみ）
     """
-    def __init__(self, base_url: str, username: str, api_token: str):
+    def __init__(self, base_url: str, username: str, api_token: str,
+                 session: Optional[requests.Session] = None,
+                 http_cache: Optional[HTTPCache] = None,
+                 governor: Optional[RequestGovernor] = None,
+                 snapshot_store: Optional[SnapshotStore] = None,
+                 read_mode: str = CONFLUENCE_READ_MODE):
+        if read_mode not in READ_MODES:
+            raise ValueError(f"未対応の読み込みモードです: {read_mode}（{', '.join(READ_MODES)}）")
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.api_token = api_token
-        self.session = requests.Session()
-        credentials = f"{username}:{api_token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        self.session.headers.update({
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        })
-
-    def get_space_content(self, space_key: str, limit: int = 25) -> Dict:
+        # session を渡すと、プロセス内で共有しているコネクションプールを使う
+        # （共有のセッションは変更しないため、認証ヘッダーは作成時に confluence_headers で設定しておくこと）
+        if session is None:
+            session = requests.Session()
+            session.headers.update(confluence_headers(username, api_token))
+        self.session = session
+        # http_cache を渡すと、GETレスポンスをキャッシュし条件付きGETで再検証する
+        self.http_cache = http_cache
+        # レート制限・再試行・サーキットブレーカー（既定はプロセス内で共有するガバナー）
+        self.governor = governor if governor is not None else get_governor()
+        # snapshot_store を渡すと、本文付きで取得したページを保存し、read_mode に応じてそこから返す
+        # （stale_ok: Confluenceの障害時は保存済みのページを返す / offline: Confluenceに接続しない）
+        self.snapshot_store = snapshot_store
+        self.read_mode = read_mode
+
+    def _send_get(self, url: str, **kwargs) -> requests.Response:
+        """
+        ガバナー経由でGETを送信（429はRetry-Afterに従い、5xx・接続エラーはバックオフして再試行）
+        """
+        if self.read_mode == 'offline':
+            raise SnapshotMissError(f"オフラインモードのためConfluenceに接続しません: {url}")
+        return self.governor.request(self.session, 'GET', url, verify=False, **kwargs)
+
+    def _get_json(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> Dict:
+        """
+        GETしてJSONを返す（全てのGETはここを通る。HTTPキャッシュがあればキャッシュ経由）
+        """
+        if self.http_cache is not None:
+            return self.http_cache.fetch_json(self._send_get, url, params=params, headers=headers)
+        response = self._send_get(url, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _read_page(self, kind: str, page_id: str, fetch, store: bool = True) -> Dict:
+        """
+        本文付きのページをスナップショットと組み合わせて読む
+        （スナップショットから返したページには '_snapshot' に保存時刻・バージョンが付く）
+        """
+        if self.snapshot_store is None:
+            return fetch()
+        if self.read_mode == 'offline':
+            page = self._snapshot(kind, page_id)
+            if page is None:
+                raise SnapshotMissError(f"オフラインモードでスナップショットにないページです: {page_id}")
+            return page
+        try:
+            page = fetch()
+        except requests.exceptions.RequestException as e:
+            if self.read_mode != 'stale_ok' or not is_outage(e):
+                raise
+            page = self._snapshot(kind, page_id)
+            if page is None:
+                raise
+            print(f"[DEBUG] Confluenceに接続できないため、スナップショットを返します: {page_id} ({e})")
+            return page
+        if store:
+            try:
+                self.snapshot_store.put(kind, page)
+            except (sqlite3.Error, OSError) as e:
+                print(f"[DEBUG] スナップショットの保存に失敗しました: {page_id} ({e})")
+        return page
+
+    def _snapshot(self, kind: str, page_id: str) -> Optional[Dict]:
+        # v1 / v2 のどちらかで保存されていれば返す（形式が違っても id・title・version・本文は共通）
+        # 両方ある場合は新しいバージョンを優先し、同じなら要求された形式を返す
+        other = 'v1' if kind == 'v2' else 'v2'
+        try:
+            pages = [page for page in (self.snapshot_store.get(kind, page_id), self.snapshot_store.get(other, page_id))
+                     if page is not None]
+        except (sqlite3.Error, OSError, ValueError) as e:
+            # スナップショットが読めない場合は、保存していない場合と同じく元のエラー・SnapshotMissError にする
+            print(f"[DEBUG] スナップショットの読み込みに失敗しました: {page_id} ({e})")
+            return None
+        return max(pages, key=lambda page: page['_snapshot']['version'], default=None)
+
+    def _expand(self, fields: Optional[Iterable[str]], default: str) -> Dict:
+        """
+        fields（取得するフィールドの集合）を最小限のexpandパラメーターに変換（未指定なら従来のexpand）
+        """
+        expand = default if fields is None else v1_expand(fields)
+        return {'expand': expand} if expand else {}
+
+    def get_space_content(self, space_key: str, limit: int = 25,
+                          fields: Optional[Iterable[str]] = None) -> Dict:
         url = f"{self.base_url}/rest/api/content"
         params = {
             'spaceKey': space_key,
             'limit': limit,
-            'expand': 'body.storage,version'
+            **self._expand(fields, 'body.storage,version')
         }
-        response = self.session.get(url, params=params, verify=False)
-        response.raise_for_status()
-        return response.json()
+        return self._get_json(url, params)
 
-    def get_page_content(self, page_id: str) -> Dict:
+    def get_page_content(self, page_id: str, fields: Optional[Iterable[str]] = None) -> Dict:
         url = f"{self.base_url}/rest/api/content/{page_id}"
-        params = {
-            'expand': 'body.storage,version,children.page'
-        }
-        response = self.session.get(url, params=params, verify=False)
-        response.raise_for_status()
-        return response.json()
+        params = self._expand(fields, 'body.storage,version,children.page')
+        if fields is not None and 'body' not in fields:
+            return self._get_json(url, params)
+        # 一部のフィールドだけを取得した場合は、スナップショットが欠けないよう保存しない
+        return self._read_page('v1', page_id, lambda: self._get_json(url, params), store=fields is None)
 
-    def search_content(self, query: str, cql: Optional[str] = None, limit: int = 25) -> Dict:
+    def search_content(self, query: str, cql: Optional[str] = None, limit: int = 25,
+                       start: int = 0, expand: Optional[str] = None) -> Dict:
         url = f"{self.base_url}/rest/api/content/search"
         params = {
             'limit': str(limit)
         }
+        if start:
+            params['start'] = str(start)
+        if expand:
+            params['expand'] = expand
         if cql:
             params['cql'] = cql
         else:
             params['query'] = query
-        response = self.session.get(url, params=params, verify=False)
-        response.raise_for_status()
-        return response.json()
+        return self._get_json(url, params)
 
-    def get_page_children(self, page_id: str, limit: int = 25) -> Dict:
+    def get_page_children(self, page_id: str, limit: int = 25,
+                          fields: Optional[Iterable[str]] = None) -> Dict:
         url = f"{self.base_url}/rest/api/content/{page_id}/child/page"
         params = {
             'limit': limit,
-            'expand': 'body.storage,version'
+            **self._expand(fields, 'body.storage,version')
         }
-        response = self.session.get(url, params=params, verify=False)
-        response.raise_for_status()
-        return response.json()
+        return self._get_json(url, params)
 
     def get_space_info(self, space_key: str) -> Dict:
         url = f"{self.base_url}/rest/api/space/{space_key}"
-        response = self.session.get(url, verify=False)
-        response.raise_for_status()
-        return response.json()
+        return self._get_json(url)
 
     # --- v2 API ---
     def get_space_id_by_key_v2(self, space_key: str) -> Optional[str]:
         url = f"{self.base_url}/wiki/api/v2/spaces?keys={space_key}"
-        resp = self.session.get(url, verify=False)
-        resp.raise_for_status()
-        data = resp.json()
+        data = self._get_json(url)
         if data and data.get('results'):
             return data['results'][0]['id']
         return None
 
     def get_space_pages_v2(self, space_id: str, limit: int = 25) -> dict:
         url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}"
-        resp = self.session.get(url, verify=False)
-        resp.raise_for_status()
-        return resp.json()
+        return self._get_json(url)
 
     def search_pages_v2(self, query: str, limit: int = 25) -> dict:
-        url = f"{self.base_url}/wiki/api/v2/pages?limit={limit}&q={query}"
-        resp = self.session.get(url, verify=False)
-        resp.raise_for_status()
-        return resp.json()
+        """
+        キーワードでページを検索（v2 APIには全文検索がないため、エスケープしたCQLでv1の検索APIを呼ぶ）
+        """
+        return self.search_content(query, cql=f"type = page AND text ~ {cql_quote(query)}", limit=limit)
+
+    def get_page_v2(self, page_id: str, body_format: str = 'storage') -> dict:
+        """
+        v2 APIでページ本体（本文付き）を取得
+        """
+        url = f"{self.base_url}/wiki/api/v2/pages/{page_id}?body-format={body_format}"
+        fetch = lambda: self._get_json(url, headers={'Accept': 'application/json'})
+        if body_format != 'storage':
+            return fetch()
+        return self._read_page('v2', page_id, fetch)
+
+    def load_body(self, page: dict) -> dict:
+        """
+        本文なしで取得したページデータに、必要になった時点で本文（storage形式）を取得して追加する
+        """
+        if not has_body(page):
+            full = self.get_page_v2(page['id'])
+            page['body'] = full.get('body', {})
+            page.setdefault('version', full.get('version'))
+        return page
 
     def get_page_children_v2(self, page_id: str, limit: int = 10) -> dict:
         url = f"{self.base_url}/wiki/api/v2/pages/{page_id}/children?limit={limit}"
-        resp = self.session.get(url, verify=False)
-        resp.raise_for_status()
-        return resp.json()
-
-    def get_all_pages_in_space_v2(self, space_id: str) -> list:
-        all_pages = []
-        start = 0
-        limit = 50
-        while True:
-            url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}&start={start}"
-            resp = self.session.get(url, verify=False)
-            resp.raise_for_status()
-            data = resp.json()
-            results = data.get('results', [])
-            all_pages.extend(results)
-            if not data.get('_links', {}).get('next'):
-                break
-            start += limit
-        return all_pages
-
-    def get_all_descendants_v2(self, page_id: str, limit: int = 50) -> list:
-        """
-        v2 APIで指定ページID配下の全子孫ページを再帰的に取得
-        """
-        descendants = []
-        def _fetch_children(pid):
-            children_data = self.get_page_children_v2(pid, limit=limit)
-            for child in children_data.get('results', []):
-                descendants.append(child)
-                _fetch_children(child.get('id'))
-        _fetch_children(page_id)
-        return descendants 
\ No newline at end of file
+        return self._get_json(url)
+
+    def _next_url(self, data: dict) -> Optional[str]:
+        """
+        v2 APIのレスポンスから次ページのURLを返す（なければNone）
+        """
+        return next_cursor_url(self.base_url, data)
+
+    def get_all_children_v2(self, page_id: str, limit: int = V2_MAX_LIMIT) -> list:
+        """
+        v2 APIで指定ページIDの直下の子ページを全件取得（_links.next のカーソルを辿る）
+        """
+        url = f"{self.base_url}/wiki/api/v2/pages/{page_id}/children?limit={limit}"
+        # 子ページは1〜2リクエストで終わることが多いため先読みはしない
+        return list(iter_cursor_results(self._get_json, url, self._next_url, prefetch=False))
+
+    def iter_space_page_batches_v2(self, space_id: str, limit: int = V2_MAX_LIMIT, start_url: Optional[str] = None):
+        """
+        v2 APIでスペース内のページ一覧を1リクエスト分ずつ返すジェネレーター（次ページは先読み）
+        （yield: (ページ一覧, 次ページのURL)。start_url を渡すと途中のカーソルから再開する）
+        """
+        url = start_url or f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}"
+        return iter_cursor_pages(self._get_json, url, self._next_url)
+
+    def iter_all_pages_in_space_v2(self, space_id: str, limit: int = V2_MAX_LIMIT,
+                                   fields: Optional[Iterable[str]] = None):
+        """
+        v2 APIでスペース内の全ページを1件ずつ返す遅延ジェネレーター（次ページは先読み）
+        fields に 'body' を含めた場合のみ本文も取得する
+        """
+        url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}"
+        if fields is not None:
+            url += ''.join(f"&{key}={value}" for key, value in v2_params(fields).items())
+        return iter_cursor_results(self._get_json, url, self._next_url)
+
+    def get_all_pages_in_space_v2(self, space_id: str, limit: int = V2_MAX_LIMIT,
+                                  fields: Optional[Iterable[str]] = None) -> list:
+        return list(self.iter_all_pages_in_space_v2(space_id, limit=limit, fields=fields))
+
+    def get_all_descendants_v2(self, page_id: str, limit: int = V2_MAX_LIMIT) -> list:
+        """
+        v2 APIで指定ページID配下の全子孫ページを取得
+        """
+        return list(self.iter_all_descendants_v2(page_id, limit=limit))
+
+    def iter_all_descendants_v2(self, page_id: str, limit: int = V2_MAX_LIMIT, max_depth: Optional[int] = None):
+        """
+        v2 APIで指定ページID配下の子孫ページを深さ優先（行きがけ順）で1件ずつ返すジェネレーター
+        （再帰せず明示的なスタックで辿るため深い階層でもスタックオーバーフローしない。
+          取得済みIDは再訪しないので、循環があっても停止する）
+        """
+        visited = {page_id}
+        # スタックには (子ページ, 深さ) を逆順に積み、先頭の子ページから取り出す
+        stack = [(child, 1) for child in reversed(self.get_all_children_v2(page_id, limit=limit))]
+        while stack:
+            child, depth = stack.pop()
+            child_id = child.get('id')
+            if not child_id or child_id in visited:
+                continue
+            visited.add(child_id)
+            yield child
+            if max_depth is None or depth < max_depth:
+                grandchildren = self.get_all_children_v2(child_id, limit=limit)
+                stack.extend((grandchild, depth + 1) for grandchild in reversed(grandchildren))
@@ -0,0 +1,243 @@
+import asyncio
+import base64
+import os
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+import httpx
+
+from confluence.fields import v1_expand, v2_params
+from confluence.governor import RequestGovernor, get_governor
+from confluence.http_cache import HTTPCache
+from confluence.pagination import V2_MAX_LIMIT, next_cursor_url
+from confluence.utils import cql_quote
+
+# コネクションプールの設定（.env で上書き可能）
+ASYNC_MAX_CONNECTIONS = int(os.getenv('CONFLUENCE_ASYNC_MAX_CONNECTIONS', '100'))
+ASYNC_MAX_KEEPALIVE = int(os.getenv('CONFLUENCE_ASYNC_MAX_KEEPALIVE', '20'))
+ASYNC_KEEPALIVE_EXPIRY = float(os.getenv('CONFLUENCE_ASYNC_KEEPALIVE_EXPIRY', '30'))
+ASYNC_TIMEOUT = float(os.getenv('CONFLUENCE_ASYNC_TIMEOUT', '30'))
+ASYNC_CONCURRENCY = int(os.getenv('CONFLUENCE_ASYNC_CONCURRENCY', '32'))
+
+try:
+    import h2  # noqa: F401  HTTP/2はh2パッケージがある場合のみ有効
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncConfluenceAPI:
+    """
+    Confluence APIを使用してコンテンツを取得する非同期クラス
+    （ConfluenceAPIと同じメソッド構成。1つのコネクションプールを共有し、大量のページ取得を並列に行う）
+    送信は ConfluenceAPI と同じガバナーを通すため、同じホストへの同期・非同期の送信でレート制限・
+    Retry-After による一時停止・サーキットブレーカーを共有する
+
+    使用例:
+        async with AsyncConfluenceAPI(base_url, username, api_token) as confluence:
+            pages = await confluence.get_pages(page_ids)
+    """
+    def __init__(self, base_url: str, username: str, api_token: str,
+                 max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = ASYNC_MAX_KEEPALIVE,
+                 keepalive_expiry: float = ASYNC_KEEPALIVE_EXPIRY,
+                 timeout: float = ASYNC_TIMEOUT,
+                 concurrency: int = ASYNC_CONCURRENCY,
+                 http2: bool = True,
+                 http_cache: Optional[HTTPCache] = None,
+                 governor: Optional[RequestGovernor] = None):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.api_token = api_token
+        credentials = f"{username}:{api_token}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        self.client = httpx.AsyncClient(
+            headers={
+                'Authorization': f'Basic {encoded_credentials}',
+                'Content-Type': 'application/json',
+                'Accept': 'application/json'
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=timeout,
+            http2=http2 and HTTP2_AVAILABLE,
+            verify=False
+        )
+        # 同時に送信するリクエスト数の上限（プールの接続数とは別に制御）
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # http_cache を渡すと、GETレスポンスをキャッシュし条件付きGETで再検証する
+        self.http_cache = http_cache
+        # レート制限・再試行・サーキットブレーカー（既定はプロセス内で共有するガバナー）
+        self.governor = governor if governor is not None else get_governor()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _send_get(self, url: str, **kwargs) -> httpx.Response:
+        """
+        ガバナー経由でGETを送信（429はRetry-Afterに従い、5xx・接続エラーはバックオフして再試行）
+        """
+        async with self._semaphore:
+            return await self.governor.request_async(self.client, 'GET', url, **kwargs)
+
+    async def _get_json(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> Dict:
+        """
+        GETしてJSONを返す（全てのGETはここを通る。HTTPキャッシュがあればキャッシュ経由）
+        """
+        if self.http_cache is not None:
+            return await self.http_cache.fetch_json_async(self._send_get, url, params=params, headers=headers)
+        response = await self._send_get(url, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _next_url(self, data: Dict) -> Optional[str]:
+        """
+        v2 APIのレスポンスから次ページのURLを返す（なければNone）
+        """
+        return next_cursor_url(self.base_url, data)
+
+    async def _get_all_v2(self, url: str) -> List[Dict]:
+        results = []
+        while url:
+            data = await self._get_json(url)
+            results.extend(data.get('results', []))
+            url = self._next_url(data)
+        return results
+
+    def _expand(self, fields: Optional[Iterable[str]], default: str) -> Dict:
+        """
+        fields（取得するフィールドの集合）を最小限のexpandパラメーターに変換（未指定なら従来のexpand）
+        """
+        expand = default if fields is None else v1_expand(fields)
+        return {'expand': expand} if expand else {}
+
+    async def get_space_content(self, space_key: str, limit: int = 25,
+                                fields: Optional[Iterable[str]] = None) -> Dict:
+        url = f"{self.base_url}/rest/api/content"
+        params = {
+            'spaceKey': space_key,
+            'limit': limit,
+            **self._expand(fields, 'body.storage,version')
+        }
+        return await self._get_json(url, params)
+
+    async def get_page_content(self, page_id: str, fields: Optional[Iterable[str]] = None) -> Dict:
+        url = f"{self.base_url}/rest/api/content/{page_id}"
+        params = self._expand(fields, 'body.storage,version,children.page')
+        return await self._get_json(url, params)
+
+    async def get_pages(self, page_ids: Iterable[str]) -> List[Dict]:
+        """
+        複数ページをまとめて並列取得（結果は入力順）
+        """
+        return await asyncio.gather(*(self.get_page_content(page_id) for page_id in page_ids))
+
+    async def search_content(self, query: str, cql: Optional[str] = None, limit: int = 25,
+                             start: int = 0, expand: Optional[str] = None) -> Dict:
+        url = f"{self.base_url}/rest/api/content/search"
+        params = {
+            'limit': str(limit)
+        }
+        if start:
+            params['start'] = str(start)
+        if expand:
+            params['expand'] = expand
+        if cql:
+            params['cql'] = cql
+        else:
+            params['query'] = query
+        return await self._get_json(url, params)
+
+    async def get_page_children(self, page_id: str, limit: int = 25,
+                                fields: Optional[Iterable[str]] = None) -> Dict:
+        url = f"{self.base_url}/rest/api/content/{page_id}/child/page"
+        params = {
+            'limit': limit,
+            **self._expand(fields, 'body.storage,version')
+        }
+        return await self._get_json(url, params)
+
+    async def get_space_info(self, space_key: str) -> Dict:
+        url = f"{self.base_url}/rest/api/space/{space_key}"
+        return await self._get_json(url)
+
+    # --- v2 API ---
+    async def get_space_id_by_key_v2(self, space_key: str) -> Optional[str]:
+        url = f"{self.base_url}/wiki/api/v2/spaces"
+        data = await self._get_json(url, {'keys': space_key})
+        if data and data.get('results'):
+            return data['results'][0]['id']
+        return None
+
+    async def get_space_pages_v2(self, space_id: str, limit: int = 25) -> Dict:
+        url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages"
+        return await self._get_json(url, {'limit': limit})
+
+    async def search_pages_v2(self, query: str, limit: int = 25) -> Dict:
+        # v2 APIには全文検索がないため、エスケープしたCQLでv1の検索APIを呼ぶ
+        return await self.search_content(query, cql=f"type = page AND text ~ {cql_quote(query)}", limit=limit)
+
+    async def get_page_children_v2(self, page_id: str, limit: int = 10) -> Dict:
+        url = f"{self.base_url}/wiki/api/v2/pages/{page_id}/children"
+        return await self._get_json(url, {'limit': limit})
+
+    async def get_all_children_v2(self, page_id: str, limit: int = V2_MAX_LIMIT) -> List[Dict]:
+        return await self._get_all_v2(f"{self.base_url}/wiki/api/v2/pages/{page_id}/children?limit={limit}")
+
+    async def get_all_pages_in_space_v2(self, space_id: str, limit: int = V2_MAX_LIMIT,
+                                        fields: Optional[Iterable[str]] = None) -> List[Dict]:
+        url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}"
+        if fields is not None:
+            url += ''.join(f"&{key}={value}" for key, value in v2_params(fields).items())
+        return await self._get_all_v2(url)
+
+    async def get_all_descendants_v2(self, page_id: str, limit: int = V2_MAX_LIMIT) -> List[Dict]:
+        """
+        v2 APIで指定ページID配下の全子孫ページを取得
+        """
+        return [child async for child in self.aiter_descendants_v2(page_id, limit=limit)]
+
+    async def aiter_children_v2(self, page_id: str, limit: int = V2_MAX_LIMIT) -> AsyncIterator[Dict]:
+        """
+        v2 APIで直下の子ページを1件ずつ返す非同期ジェネレーター（_links.next のカーソルを辿る）
+        """
+        url = f"{self.base_url}/wiki/api/v2/pages/{page_id}/children?limit={limit}"
+        while url:
+            data = await self._get_json(url)
+            for child in data.get('results', []):
+                yield child
+            url = self._next_url(data)
+
+    async def aiter_descendants_v2(self, page_id: str, limit: int = V2_MAX_LIMIT,
+                                   max_depth: Optional[int] = None) -> AsyncIterator[Dict]:
+        """
+        v2 APIで子孫ページを取得できた順に1件ずつ返す非同期ジェネレーター
+        （子ページの取得は並列に実行。取得済みIDは再訪しないので循環しても止まる。
+          途中でループを抜けると、実行中の取得タスクはキャンセルされる）
+        """
+        visited = {page_id}
+        pending = {asyncio.ensure_future(self.get_all_children_v2(page_id, limit=limit)): 1}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    depth = pending.pop(task)
+                    for child in task.result():
+                        child_id = child.get('id')
+                        if not child_id or child_id in visited:
+                            continue
+                        visited.add(child_id)
+                        if max_depth is None or depth < max_depth:
+                            pending[asyncio.ensure_future(self.get_all_children_v2(child_id, limit=limit))] = depth + 1
+                        yield child
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from confluence.records import PageRecord
+from confluence.service import build_level_tree
+from confluence.tree_index import get_tree_index
+
+# 子孫ページ取得の並列数とキャッシュの有効期間（秒）
+DESCENDANTS_CONCURRENCY = int(os.getenv('DESCENDANTS_CONCURRENCY', '8'))
+DESCENDANTS_CACHE_TTL = int(os.getenv('DESCENDANTS_CACHE_TTL', '300'))
+
+
+def crawl_descendants(confluence, root_id: str, max_workers: int = DESCENDANTS_CONCURRENCY,
+                      max_depth: Optional[int] = None) -> Tuple[List[PageRecord], List[Dict]]:
+    """
+    v2 APIで子孫ページを幅優先で取得（同じ階層の子ページ取得は並列に実行）
+    戻り値: (子孫ページのレコードのリスト, 取得に失敗したページの一覧)
+    """
+    descendants = []
+    errors = []
+    visited = {root_id}
+    frontier = [root_id]
+    level = 1
+
+    def fetch(parent_id):
+        try:
+            return confluence.get_all_children_v2(parent_id)
+        except Exception as e:
+            print(f"[DEBUG] 子ページ取得エラー - page_id: {parent_id}, error: {e}")
+            errors.append({'page_id': parent_id, 'error': str(e)})
+            return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier and (max_depth is None or level <= max_depth):
+            next_frontier = []
+            # executor.map は結果を入力順に返すため、兄弟ページの並び順が保たれる
+            for parent_id, children in zip(frontier, executor.map(fetch, frontier)):
+                for child in children:
+                    child_id = child.get('id')
+                    if not child_id or child_id in visited:
+                        continue
+                    visited.add(child_id)
+                    descendants.append(PageRecord.from_v2(child, parent_id=parent_id, level=level))
+                    next_frontier.append(child_id)
+            print(f"[DEBUG] 子孫ページ取得 - level: {level}, 件数: {len(next_frontier)}")
+            frontier = next_frontier
+            level += 1
+    return descendants, errors
+
+
+class DescendantsCache:
+    """
+    取得済みの子孫ページ（レコードのリスト）を有効期間付きでメモリに保持するキャッシュ
+    """
+    def __init__(self, ttl: int = DESCENDANTS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, root_id) -> Optional[Tuple[List[PageRecord], float]]:
+        with self._lock:
+            entry = self._entries.get(root_id)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires < time.monotonic():
+                del self._entries[root_id]
+                return None
+            return result
+
+    def put(self, root_id, result: Tuple[List[PageRecord], float]) -> None:
+        with self._lock:
+            self._entries[root_id] = (time.monotonic() + self.ttl, result)
+
+
+_descendants_cache = DescendantsCache()
+
+
+def get_descendants_tree(confluence, root_id: str, refresh: bool = False, max_depth: Optional[int] = None) -> Dict:
+    """
+    子孫ページのツリー（tree）とフラットリスト（flat_list）を返す（TTL付きキャッシュ）
+    キャッシュにはレコードのみを保持し、応答用の辞書は呼び出しごとに組み立てる
+    max_depth を指定するとその階層までしか取得しない（画面では1階層ずつ取得し、展開した時点で次の階層を取得する）
+    """
+    key = (root_id, max_depth)
+    if not refresh:
+        cached = _descendants_cache.get(key)
+        if cached is not None:
+            descendants, elapsed = cached
+            return dict(build_level_tree(descendants, root_id), errors=[], elapsed=elapsed, cached=True)
+    started = time.monotonic()
+    descendants, errors = crawl_descendants(confluence, root_id, max_depth=max_depth)
+    elapsed = round(time.monotonic() - started, 3)
+    # 一部取得に失敗した結果はキャッシュしない
+    if not errors:
+        _descendants_cache.put(key, (descendants, elapsed))
+        if max_depth is None:
+            # 途中の階層までの結果で部分木を置き換えると、より深いページが削除されるため、全階層の取得時のみ反映する
+            _update_tree_index(root_id, descendants)
+    return dict(build_level_tree(descendants, root_id), errors=errors, elapsed=elapsed, cached=False)
+
+
+def _update_tree_index(root_id: str, descendants: List[PageRecord]) -> None:
+    """
+    取得し直した子孫ページでツリーインデックスの部分木を置き換える（スペースIDが分からない場合は何もしない）
+    """
+    index = get_tree_index()
+    space_id = next((page.space_id for page in descendants if page.space_id), None) or index.space_of(root_id)
+    if space_id is None:
+        return
+    try:
+        index.replace_subtree(space_id, root_id, descendants)
+    except sqlite3.Error as e:
+        print(f"[DEBUG] ツリーインデックス更新エラー - page_id: {root_id}, error: {e}")
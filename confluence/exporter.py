@@ -0,0 +1,192 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from confluence.records import PageRecord
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 本文取得の並列数（.env で上書き可能）
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', '8'))
+
+
+def export_record(page: PageRecord, space_key: str) -> Dict:
+    """
+    ページのレコードからエクスポート用の1行分を作成
+    """
+    return {
+        'id': page.id,
+        'title': page.title,
+        'status': page.status,
+        'space_key': space_key,
+        'space_id': page.space_id,
+        'parent_id': page.parent_id,
+        'version': page.version,
+        'created': page.created,
+        'updated': page.updated,
+        'url': page.webui or '',
+        'content': page.body or ''
+    }
+
+
+class SpaceExporter:
+    """
+    スペース内の全ページをNDJSON（1ページ1行）でストリーミング出力するエクスポーター
+
+    - ページ一覧はv2 APIのカーソル（_links.next）で1リクエスト分（最大250件）ずつ取得
+    - 本文はスレッドプールで並列取得
+    - 1リクエスト分を書き込むごとにチェックポイントを保存し、中断しても続きから再開できる
+    - compression='gzip' / 'zstd' の場合は、1リクエスト分を独立したgzipメンバー / zstdフレームとして追記する
+      （連結されたメンバー / フレームは通常のgzip / zstdツールでそのまま展開できる）
+    """
+    def __init__(self, confluence, space_key: str, output_path: str,
+                 checkpoint_path: Optional[str] = None, compression: Optional[str] = None,
+                 concurrency: int = EXPORT_CONCURRENCY):
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f"未対応の圧縮形式です: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd圧縮には zstandard パッケージが必要です")
+        self.confluence = confluence
+        self.space_key = space_key
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint.json"
+        self.compression = compression
+        self.concurrency = concurrency
+
+    def _load_checkpoint(self) -> Optional[Dict]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('space_key') != self.space_key or checkpoint.get('completed'):
+            return None
+        if checkpoint.get('compression', self.compression) != self.compression:
+            print("[DEBUG] チェックポイントと圧縮形式が異なるため、最初からエクスポートします")
+            return None
+        # 出力ファイルが移動・削除された、またはチェックポイントの位置より短い場合は続きを書けないため最初からやり直す
+        offset = checkpoint.get('offset', 0)
+        if not os.path.exists(self.output_path):
+            print(f"[DEBUG] 出力ファイル {self.output_path} がないため、最初からエクスポートします")
+            return None
+        size = os.path.getsize(self.output_path)
+        if size < offset:
+            print(f"[DEBUG] 出力ファイル {self.output_path} がチェックポイントより短いため"
+                  f"（{size}バイト < {offset}バイト）、最初からエクスポートします")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Dict) -> None:
+        # 書き込み途中で落ちても壊れないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _encode(self, lines: bytes) -> bytes:
+        if self.compression == 'gzip':
+            return gzip.compress(lines)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(lines)
+        return lines
+
+    def _fetch_page(self, page: Dict) -> PageRecord:
+        # 本文付きのJSONはレコードに変換した時点で手放す（本文はすぐに書き出すためメモリ上に置く）
+        full = self.confluence.get_page_v2(page['id'])
+        record = PageRecord.from_v2(full, links=True)
+        record.set_body(full.get('body', {}).get('storage', {}).get('value', ''))
+        return record
+
+    def run(self) -> Dict:
+        """
+        エクスポートを実行（チェックポイントがあれば続きから再開）し、件数などを返す
+        """
+        started = time.monotonic()
+        checkpoint = self._load_checkpoint()
+        if checkpoint:
+            print(f"[DEBUG] チェックポイントから再開: {checkpoint['exported']}件出力済み")
+            output = open(self.output_path, 'r+b')
+            # 最後のチェックポイント以降に書きかけた分を切り捨てる
+            output.truncate(checkpoint['offset'])
+            output.seek(checkpoint['offset'])
+        else:
+            space_id = self.confluence.get_space_id_by_key_v2(self.space_key)
+            if not space_id:
+                raise ValueError(f"スペースが見つかりません: {self.space_key}")
+            checkpoint = {
+                'space_key': self.space_key,
+                'space_id': space_id,
+                'next_url': None,
+                'offset': 0,
+                'exported': 0,
+                'compression': self.compression,
+                'completed': False
+            }
+            output = open(self.output_path, 'wb')
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                batches = self.confluence.iter_space_page_batches_v2(
+                    checkpoint['space_id'], start_url=checkpoint['next_url'])
+                for batch, next_url in batches:
+                    # executor.map は入力順に結果を返すため、出力順は一覧の順序と同じになる
+                    lines = b''.join(
+                        json.dumps(export_record(page, self.space_key), ensure_ascii=False).encode('utf-8') + b'\n'
+                        for page in executor.map(self._fetch_page, batch)
+                    )
+                    output.write(self._encode(lines))
+                    output.flush()
+                    os.fsync(output.fileno())
+                    checkpoint.update({
+                        'next_url': next_url,
+                        'offset': output.tell(),
+                        'exported': checkpoint['exported'] + len(batch),
+                        'completed': next_url is None
+                    })
+                    self._save_checkpoint(checkpoint)
+                    print(f"[DEBUG] エクスポート済み: {checkpoint['exported']}件")
+        finally:
+            output.close()
+        checkpoint['completed'] = True
+        self._save_checkpoint(checkpoint)
+        return {
+            'space_key': self.space_key,
+            'exported': checkpoint['exported'],
+            'output_path': self.output_path,
+            'elapsed': round(time.monotonic() - started, 3)
+        }
+
+
+def main():
+    """
+    コマンドラインからスペースをエクスポート
+    例: python -m confluence.exporter DEMO demo.ndjson.gz --compression gzip
+    """
+    from dotenv import load_dotenv
+    from confluence.api_client import ConfluenceAPI
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='ConfluenceスペースをNDJSONでエクスポート')
+    parser.add_argument('space_key')
+    parser.add_argument('output_path')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'])
+    parser.add_argument('--concurrency', type=int, default=EXPORT_CONCURRENCY)
+    args = parser.parse_args()
+
+    confluence = ConfluenceAPI(
+        os.getenv('CONFLUENCE_BASE_URL', ''),
+        os.getenv('CONFLUENCE_USERNAME', ''),
+        os.getenv('CONFLUENCE_API_TOKEN', '')
+    )
+    result = SpaceExporter(confluence, args.space_key, args.output_path,
+                           compression=args.compression, concurrency=args.concurrency).run()
+    print(f"✅ {result['exported']}ページを {result['output_path']} にエクスポートしました（{result['elapsed']}秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from typing import Dict, Iterable, Optional
+
+# 取得するフィールドの宣言的な指定
+# （id / title / status / type などの基本項目は v1・v2 とも常に返るため、expand などは不要）
+BASIC_FIELDS = frozenset({'id', 'title', 'status', 'type', 'spaceId'})
+# ツリー表示用（本文は取得しない）
+TREE_FIELDS = frozenset({'id', 'title', 'status', 'parentId'})
+# 一覧表示用（バージョン・更新日時まで）
+SUMMARY_FIELDS = frozenset({'id', 'title', 'status', 'version'})
+# 本文まで含めた全項目
+FULL_FIELDS = frozenset({'id', 'title', 'status', 'version', 'body', 'space', 'ancestors', 'children'})
+
+# v1 APIのexpand指定（parentIdはv1ではancestorsの末尾から求める）
+_V1_EXPAND = {
+    'body': 'body.storage',
+    'version': 'version',
+    'space': 'space',
+    'ancestors': 'ancestors',
+    'parentId': 'ancestors',
+    'children': 'children.page',
+    'history': 'history'
+}
+# v2 APIで取得できる追加項目（version と parentId は既定で返る。本文は body-format 指定時のみ）
+_V2_FIELDS = {'body', 'version', 'parentId'}
+
+
+def _validate(fields: Iterable[str]) -> frozenset:
+    fields = frozenset(fields)
+    unknown = fields - BASIC_FIELDS - set(_V1_EXPAND)
+    if unknown:
+        raise ValueError(f"未対応のフィールドです: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def v1_expand(fields: Iterable[str]) -> Optional[str]:
+    """
+    フィールド指定をv1 APIの最小限のexpandパラメーターに変換（不要ならNone）
+    """
+    expands = sorted({_V1_EXPAND[field] for field in _validate(fields) if field in _V1_EXPAND})
+    return ','.join(expands) or None
+
+
+def v2_params(fields: Iterable[str]) -> Dict[str, str]:
+    """
+    フィールド指定をv2 APIのクエリパラメーターに変換（本文が必要な場合のみ body-format を付ける）
+    """
+    fields = _validate(fields)
+    unsupported = fields - BASIC_FIELDS - _V2_FIELDS
+    if unsupported:
+        raise ValueError(f"v2 APIでは取得できないフィールドです: {', '.join(sorted(unsupported))}")
+    return {'body-format': 'storage'} if 'body' in fields else {}
+
+
+def has_body(page: Dict) -> bool:
+    """
+    ページデータに本文（storage形式）が含まれているかどうか
+    """
+    return 'value' in (page.get('body') or {}).get('storage', {})
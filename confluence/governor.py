@@ -0,0 +1,341 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlparse
+
+import httpx
+import requests
+
+# ホストごとの送信レート（リクエスト/秒）。GOVERNOR_HOST_RATES は "host=rate,host=rate" 形式
+GOVERNOR_DEFAULT_RATE = float(os.getenv('GOVERNOR_DEFAULT_RATE', '10'))
+GOVERNOR_BURST = float(os.getenv('GOVERNOR_BURST', '20'))
+GOVERNOR_HOST_RATES = os.getenv('GOVERNOR_HOST_RATES', '')
+# 再試行回数とバックオフ（秒）
+GOVERNOR_MAX_RETRIES = int(os.getenv('GOVERNOR_MAX_RETRIES', '4'))
+GOVERNOR_BACKOFF_BASE = float(os.getenv('GOVERNOR_BACKOFF_BASE', '0.5'))
+GOVERNOR_BACKOFF_MAX = float(os.getenv('GOVERNOR_BACKOFF_MAX', '30'))
+# サーキットブレーカー: 連続失敗回数と、遮断してから試行を再開するまでの秒数
+GOVERNOR_FAILURE_THRESHOLD = int(os.getenv('GOVERNOR_FAILURE_THRESHOLD', '5'))
+GOVERNOR_RESET_TIMEOUT = float(os.getenv('GOVERNOR_RESET_TIMEOUT', '30'))
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    バックエンドの障害でサーキットが開いている（送信を遮断している）場合の例外
+    """
+
+
+class TokenBucket:
+    """
+    ホストごとの送信レートを制限するトークンバケット（Retry-After受信時は一時停止）
+    rate が0以下の場合はレートを制限しない（Retry-Afterによる一時停止のみ行う）
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """
+        トークンを1つ取る（取れた場合は0、取れない場合は次に試すまでの待ち時間を返す）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = self._paused_until - now
+            if wait <= 0:
+                if self.rate <= 0:
+                    return 0
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return 0
+                wait = (1 - self._tokens) / self.rate
+            return wait
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        # 非同期クライアント用（イベントループを止めずに待つ）
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    連続して失敗したバックエンドへの送信を一定時間遮断するサーキットブレーカー
+    （遮断後 reset_timeout 秒経過すると1リクエストだけ試行し、成功すれば復帰する）
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self, host: str) -> bool:
+        """
+        送信してよいか確認する（遮断中は CircuitOpenError）。戻り値は復旧確認のための試行かどうか
+        """
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{host} は障害のため一時的に遮断しています")
+                self.state = 'half_open'
+                return True
+            elif self.state == 'half_open':
+                # 試行中のリクエストの結果が出るまでは他のリクエストを通さない
+                raise CircuitOpenError(f"{host} の復旧を確認中です")
+            return False
+
+    def is_open(self) -> bool:
+        return self.state == 'open'
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def settle_trial(self) -> None:
+        """
+        復旧確認の試行が成功・失敗のどちらも記録せずに終わった場合（429が続いた・想定外の例外など）は
+        失敗として遮断し直す（half_open のまま残ると、以降の送信が全て拒否され続けるため）
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class _HostState:
+    def __init__(self, rate: float, burst: float, failure_threshold: int, reset_timeout: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+
+
+def _parse_host_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            host, rate = item.split('=', 1)
+            rates[host.strip()] = float(rate)
+    return rates
+
+
+class RequestGovernor:
+    """
+    ConfluenceとAzure OpenAIへのHTTPリクエストを共通で制御するガバナー
+
+    - ホストごとのトークンバケットで送信レートを制限
+    - 429 / 503 は Retry-After（retry-after-ms）に従い、同じホストへの送信全体を一時停止して再試行
+    - 接続エラー・5xxはジッター付き指数バックオフで再試行（冪等なリクエストのみ）
+    - 連続して失敗したホストはサーキットブレーカーで一定時間遮断
+    - requests（request）と httpx の非同期クライアント（request_async）で、ホストごとの状態を共有する
+    """
+    def __init__(self, default_rate: float = GOVERNOR_DEFAULT_RATE, burst: float = GOVERNOR_BURST,
+                 host_rates: Optional[Dict[str, float]] = None,
+                 max_retries: int = GOVERNOR_MAX_RETRIES,
+                 backoff_base: float = GOVERNOR_BACKOFF_BASE, backoff_max: float = GOVERNOR_BACKOFF_MAX,
+                 failure_threshold: int = GOVERNOR_FAILURE_THRESHOLD,
+                 reset_timeout: float = GOVERNOR_RESET_TIMEOUT):
+        self.default_rate = default_rate
+        self.burst = burst
+        self.host_rates = host_rates if host_rates is not None else _parse_host_rates(GOVERNOR_HOST_RATES)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> _HostState:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                rate = self.host_rates.get(host, self.default_rate)
+                state = _HostState(rate, max(1.0, self.burst), self.failure_threshold, self.reset_timeout)
+                self._hosts[host] = state
+            return state
+
+    def _backoff(self, attempt: int) -> float:
+        # フルジッター: 0〜上限の範囲でランダムに待つことで、再試行の集中を避ける
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        for header, scale in (('retry-after-ms', 0.001), ('Retry-After', 1.0)):
+            value = headers.get(header)
+            if value:
+                try:
+                    return float(value) * scale
+                except ValueError:
+                    continue
+        return None
+
+    def _retry_error(self, state: _HostState, host: str, attempt: int, idempotent: bool,
+                     error: Exception) -> Optional[float]:
+        """
+        接続エラー・タイムアウト後に再試行するまでの待ち時間を返す（再試行しない場合はNone）
+        """
+        # サーキットブレーカーには再試行を含めた1リクエストを1回の失敗として数える
+        # （他のリクエストで再試行の途中にサーキットが開いた場合も、それ以上は送信しない）
+        if not idempotent or attempt == self.max_retries or state.breaker.is_open():
+            state.breaker.record_failure()
+            return None
+        delay = self._backoff(attempt)
+        print(f"[GOVERNOR] {host} 接続エラー、{delay:.1f}秒後に再試行します: {error}")
+        state.retries += 1
+        return delay
+
+    def _retry_response(self, state: _HostState, host: str, attempt: int, idempotent: bool,
+                        status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        レスポンスを受け取った後に再試行するまでの待ち時間を返す（そのレスポンスを返す場合はNone）
+        """
+        if status_code in (429, 503):
+            state.throttled += 1
+            delay = self._retry_after(headers)
+            if delay is None:
+                delay = self._backoff(attempt)
+            # 同じホストへの他スレッドからの送信も止める（待つのは次のトークンの取得時）
+            state.bucket.pause(delay)
+            # 429は障害ではないためサーキットブレーカーには数えない
+            # （処理されずに拒否されているため、冪等でないリクエストも再送してよい）
+            if (attempt == self.max_retries or state.breaker.is_open()
+                    or (status_code == 503 and not idempotent)):
+                if status_code == 503:
+                    state.breaker.record_failure()
+                return None
+            print(f"[GOVERNOR] {host} status={status_code} {delay:.1f}秒後に再試行します")
+            state.retries += 1
+            return 0
+        if status_code >= 500:
+            if idempotent and attempt < self.max_retries and not state.breaker.is_open():
+                state.retries += 1
+                return self._backoff(attempt)
+            state.breaker.record_failure()
+            return None
+        state.breaker.record_success()
+        return None
+
+    def request(self, session: requests.Session, method: str, url: str,
+                idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """
+        ガバナー経由でリクエストを送信（最終的なレスポンスを返す。raise_for_status は呼び出し側で行う）
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        host = urlparse(url).netloc
+        state = self._host(host)
+        trial = state.breaker.before_request(host)
+        try:
+            for attempt in range(self.max_retries + 1):
+                state.bucket.acquire()
+                state.requests += 1
+                try:
+                    response = session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    delay = self._retry_error(state, host, attempt, idempotent, e)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                delay = self._retry_response(state, host, attempt, idempotent, response.status_code, response.headers)
+                if delay is None:
+                    return response
+                # 再試行するレスポンスは閉じて接続をプールに返す
+                response.close()
+                time.sleep(delay)
+        finally:
+            if trial:
+                state.breaker.settle_trial()
+
+    async def request_async(self, client: httpx.AsyncClient, method: str, url: str,
+                            idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+        """
+        request の httpx.AsyncClient 版（同じホストへの同期・非同期の送信でレート制限・サーキットブレーカーを共有する）
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        host = urlparse(url).netloc
+        state = self._host(host)
+        trial = state.breaker.before_request(host)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await state.bucket.acquire_async()
+                state.requests += 1
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except (httpx.NetworkError, httpx.TimeoutException) as e:
+                    delay = self._retry_error(state, host, attempt, idempotent, e)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                delay = self._retry_response(state, host, attempt, idempotent, response.status_code, response.headers)
+                if delay is None:
+                    return response
+                await response.aclose()
+                await asyncio.sleep(delay)
+        finally:
+            if trial:
+                state.breaker.settle_trial()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {
+            host: {
+                'rate': state.bucket.rate,
+                'breaker': state.breaker.state,
+                'consecutive_failures': state.breaker.failures,
+                'requests': state.requests,
+                'retries': state.retries,
+                'throttled': state.throttled
+            }
+            for host, state in hosts.items()
+        }
+
+
+_governor = RequestGovernor()
+
+
+def get_governor() -> RequestGovernor:
+    """
+    プロセス内で共有するリクエストガバナーを返す
+    """
+    return _governor
@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+# HTTPキャッシュの設定（.env で上書き可能。ディスク層はパスを指定した場合のみ有効）
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv('HTTP_CACHE_MAX_ENTRIES', '2048'))
+HTTP_CACHE_DISK_PATH = os.getenv('HTTP_CACHE_DISK_PATH', '')
+HTTP_CACHE_DISK_MAX_ENTRIES = int(os.getenv('HTTP_CACHE_DISK_MAX_ENTRIES', '50000'))
+
+# エンドポイントごとのTTL（秒）。先に一致したものを使う
+# TTL内は問い合わせずに返し、TTL切れ後は ETag / Last-Modified があれば条件付きGETで再検証する
+DEFAULT_TTL_POLICIES: List[Tuple[str, int]] = [
+    (r'/wiki/api/v2/spaces\?keys=', 6 * 3600),     # スペースキー → スペースID
+    (r'/rest/api/space/[^/?]+(\?|$)', 3600),       # スペース情報
+    (r'/children(\?|$)', 60),                       # 子ページ一覧
+    (r'/rest/api/content/search', 30),              # 検索結果
+    (r'.*', 0),                                     # ページ本体など: 毎回再検証
+]
+
+
+class _Entry:
+    __slots__ = ('body', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str], expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+
+class HTTPCache:
+    """
+    ConfluenceAPIのGETレスポンスをキャッシュするHTTPキャッシュ層
+    （メモリ上のLRU + 任意のSQLiteディスク層。ETag / Last-Modified による条件付きGETに対応）
+    """
+    def __init__(self, max_entries: int = HTTP_CACHE_MAX_ENTRIES,
+                 disk_path: Optional[str] = HTTP_CACHE_DISK_PATH or None,
+                 disk_max_entries: int = HTTP_CACHE_DISK_MAX_ENTRIES,
+                 policies: Optional[List[Tuple[str, int]]] = None):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.policies = [(re.compile(pattern), ttl) for pattern, ttl in (policies or DEFAULT_TTL_POLICIES)]
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._disk.commit()
+
+    def ttl_for(self, url: str) -> int:
+        for pattern, ttl in self.policies:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def _lookup(self, url: str) -> Optional[_Entry]:
+        entry = self._memory.get(url)
+        if entry is not None:
+            self._memory.move_to_end(url)
+            return entry
+        if self._disk is None:
+            return None
+        row = self._disk.execute(
+            'SELECT body, etag, last_modified, expires_at FROM responses WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = _Entry(*row)
+        self._remember(url, entry, persist=False)
+        return entry
+
+    def _remember(self, url: str, entry: _Entry, persist: bool = True) -> None:
+        self._memory[url] = entry
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+        if self._disk is not None and persist:
+            self._disk.execute(
+                'INSERT OR REPLACE INTO responses (url, body, etag, last_modified, expires_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, entry.body, entry.etag, entry.last_modified, entry.expires_at, time.time())
+            )
+            count = self._disk.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.disk_max_entries:
+                self._disk.execute(
+                    'DELETE FROM responses WHERE url IN '
+                    '(SELECT url FROM responses ORDER BY last_access LIMIT ?)',
+                    (count - self.disk_max_entries,)
+                )
+            self._disk.commit()
+
+    def _begin(self, url: str, params: Optional[Dict],
+               headers: Optional[Dict]) -> Tuple[str, Optional[_Entry], bool, Dict]:
+        """
+        キャッシュを引き、(パラメーター込みのURL, キャッシュ, TTL内かどうか, 条件付きGETのヘッダー) を返す
+        """
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        with self._lock:
+            entry = self._lookup(full_url)
+            fresh = entry is not None and time.time() < entry.expires_at
+            if fresh:
+                self.hits += 1
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag:
+                request_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                request_headers['If-Modified-Since'] = entry.last_modified
+        return full_url, entry, fresh, request_headers
+
+    def _complete(self, full_url: str, entry: Optional[_Entry], response) -> Dict:
+        """
+        レスポンス（requests / httpx）をキャッシュに反映してJSONを返す（304ならキャッシュの本文を返す）
+        """
+        ttl = self.ttl_for(full_url)
+        now = time.time()
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+                entry.expires_at = now + ttl
+                self._remember(full_url, entry)
+            return json.loads(entry.body)
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._lock:
+            self.misses += 1
+            # TTLも検証子もない場合は保存しても再利用できないため保存しない
+            if ttl > 0 or etag or last_modified:
+                self._remember(full_url, _Entry(response.content, etag, last_modified, now + ttl))
+        return response.json()
+
+    def fetch_json(self, send: Callable[..., requests.Response], url: str, params: Optional[Dict] = None,
+                   headers: Optional[Dict] = None, **kwargs) -> Dict:
+        """
+        キャッシュを使ってGETし、JSONを返す（エラー時は raise_for_status の例外をそのまま送出）
+        send は send(url, headers=...) でGETを送信する関数（ConfluenceAPI._send_get や session.get）
+        """
+        full_url, entry, fresh, request_headers = self._begin(url, params, headers)
+        if fresh:
+            return json.loads(entry.body)
+        return self._complete(full_url, entry, send(full_url, headers=request_headers, **kwargs))
+
+    async def fetch_json_async(self, send: Callable[..., Awaitable], url: str, params: Optional[Dict] = None,
+                               headers: Optional[Dict] = None, **kwargs) -> Dict:
+        """
+        fetch_json の非同期版（send は httpx.Response を返すコルーチン関数。AsyncConfluenceAPI._send_get など）
+        """
+        full_url, entry, fresh, request_headers = self._begin(url, params, headers)
+        if fresh:
+            return json.loads(entry.body)
+        return self._complete(full_url, entry, await send(full_url, headers=request_headers, **kwargs))
+
+    def invalidate(self, url_prefix: str) -> None:
+        """
+        指定したURLで始まるキャッシュを削除（更新が分かっている場合に使う）
+        """
+        with self._lock:
+            for url in [url for url in self._memory if url.startswith(url_prefix)]:
+                del self._memory[url]
+            if self._disk is not None:
+                self._disk.execute('DELETE FROM responses WHERE substr(url, 1, ?) = ?',
+                                   (len(url_prefix), url_prefix))
+                self._disk.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            disk_entries = self._disk.execute('SELECT COUNT(*) FROM responses').fetchone()[0] if self._disk else None
+            return {
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'disk_entries': disk_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions
+            }
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> HTTPCache:
+    """
+    プロセス内で共有するHTTPキャッシュを返す
+    """
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HTTPCache()
+        return _http_cache
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# コネクションプールの設定（.env で上書き可能）
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))  # 保持するホスト別プール数
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '32'))  # ホストあたりの最大接続数
+HTTP_POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', 'false').lower() == 'true'  # 上限到達時に空きを待つか
+HTTP_SESSION_IDLE_TIMEOUT = float(os.getenv('HTTP_SESSION_IDLE_TIMEOUT', '300'))  # 未使用で破棄するまでの秒数
+HTTP_SESSION_MAX_FAILURES = int(os.getenv('HTTP_SESSION_MAX_FAILURES', '5'))  # 連続接続エラーで作り直す回数
+
+
+class _SessionEntry:
+    def __init__(self, session: requests.Session):
+        self.session = session
+        self.created = time.time()
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+
+
+class SessionRegistry:
+    """
+    名前ごとに requests.Session を1つだけ作成し、Flaskのワーカースレッド間で共有するレジストリ
+    （一定時間使われていないセッションや、接続エラーが続いたセッションはレジストリから外して作り直す）
+    """
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 pool_block: bool = HTTP_POOL_BLOCK,
+                 idle_timeout: float = HTTP_SESSION_IDLE_TIMEOUT,
+                 max_failures: int = HTTP_SESSION_MAX_FAILURES):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.idle_timeout = idle_timeout
+        self.max_failures = max_failures
+        self.evictions = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self, name: str, setup: Optional[Callable[[requests.Session], None]]) -> _SessionEntry:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        entry = _SessionEntry(session)
+
+        def count_request(response, *args, **kwargs):
+            entry.requests += 1
+            entry.failures = 0
+        session.hooks['response'].append(count_request)
+        if setup:
+            setup(session)
+        print(f"[DEBUG] HTTPセッション作成: {name}")
+        return entry
+
+    def get(self, name: str, setup: Optional[Callable[[requests.Session], None]] = None) -> requests.Session:
+        """
+        名前に対応する共有セッションを返す（初回のみ setup でヘッダーなどを設定）
+        """
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._create_session(name, setup)
+                self._entries[name] = entry
+            entry.last_used = time.monotonic()
+            return entry.session
+
+    def report_failure(self, name: str) -> None:
+        """
+        接続エラーを記録し、連続して失敗したセッションは次回取得時に作り直す
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return
+            entry.failures += 1
+            if entry.failures >= self.max_failures:
+                print(f"[DEBUG] HTTPセッション破棄（接続エラー{entry.failures}回）: {name}")
+                self._drop(name)
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for name, entry in list(self._entries.items()):
+            if now - entry.last_used > self.idle_timeout:
+                print(f"[DEBUG] HTTPセッション破棄（アイドル）: {name}")
+                self._drop(name)
+
+    def _drop(self, name: str) -> None:
+        # 他のスレッドが取得済みのセッションで送信中の場合があるため、ここでは閉じない
+        # （レジストリから外すだけで、最後の参照がなくなった時点でGCにより接続が閉じられる）
+        self._entries.pop(name)
+        self.evictions += 1
+
+    def stats(self) -> Dict:
+        """
+        セッションごとのリクエスト数と、ホスト別コネクションプールの状態を返す
+        """
+        with self._lock:
+            sessions = {}
+            for name, entry in self._entries.items():
+                pools = []
+                for adapter in {id(a): a for a in entry.session.adapters.values()}.values():
+                    manager = getattr(adapter, 'poolmanager', None)
+                    if manager is None:
+                        continue
+                    for key in list(manager.pools.keys()):
+                        pool = manager.pools.get(key)
+                        if pool is None:
+                            continue
+                        pools.append({
+                            'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                            'maxsize': pool.pool.maxsize if pool.pool else 0,
+                            'available_slots': pool.pool.qsize() if pool.pool else 0,
+                            'connections_opened': pool.num_connections,
+                            'requests': pool.num_requests
+                        })
+                sessions[name] = {
+                    'created': entry.created,
+                    'idle_seconds': round(time.monotonic() - entry.last_used, 1),
+                    'requests': entry.requests,
+                    'consecutive_failures': entry.failures,
+                    'pools': pools
+                }
+        return {
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'idle_timeout': self.idle_timeout,
+            'evictions': self.evictions,
+            'sessions': sessions
+        }
+
+
+_registry = SessionRegistry()
+
+
+def get_session_registry() -> SessionRegistry:
+    """
+    プロセス内で共有するセッションレジストリを返す
+    """
+    return _registry
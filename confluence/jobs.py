@@ -0,0 +1,325 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# ジョブキューのDBと、翻訳を実行するワーカースレッド数・空き時の確認間隔（秒）
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'cache/jobs.sqlite3')
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', '2'))
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '5'))
+# タスク・ジョブの分解を取得したワーカーの期限（秒）。処理中は期限の1/3ごとに延長し、
+# プロセスが止まって延長されなくなったものだけを他のワーカー（再起動後を含む）がやり直す
+JOBS_LEASE_SECONDS = float(os.getenv('JOBS_LEASE_SECONDS', '300'))
+# DBへの書き込み前にメモリに溜めておく閲覧履歴のページ数の上限（超えた場合は最も古い閲覧を捨てる）
+JOBS_VIEW_BUFFER_MAX = int(os.getenv('JOBS_VIEW_BUFFER_MAX', '10000'))
+
+JOB_KINDS = ('tree', 'space')
+
+
+class JobQueue:
+    """
+    ページツリー・スペース全体の事前翻訳を行うバックグラウンドジョブキュー（SQLite）
+
+    - ジョブ（'tree': ページとその子孫 / 'space': スペース内の全ページ）を登録すると、
+      ワーカーが対象ページを列挙してページ単位のタスクに分解する
+    - タスクは最近閲覧されたページから順に処理する（閲覧履歴は record_view でメモリに溜め、ワーカーがタスクの取得前にDBへ書き込む）
+    - キューはDBに保存されるため、再起動後は未完了のタスクから再開する
+    - 複数プロセス（gunicornのワーカーなど）で同じDBを共有できる。タスクは取得したプロセスと期限（リース）を記録して
+      1つのトランザクションで取得し、期限切れになったもの（止まったプロセスのタスク）だけを取り直す
+
+    list_pages(kind, target) は対象ページIDの一覧を、process_page(page_id) はページを翻訳して
+    'translated' / 'cached' / 'skipped' / 'missing' / 'failed' のいずれかを返す関数（翻訳結果は呼び出し側で翻訳キャッシュに保存する）
+    """
+    def __init__(self, list_pages: Callable[[str, str], Iterable[str]],
+                 process_page: Callable[[str], str],
+                 db_path: str = JOBS_DB_PATH, workers: int = JOBS_WORKERS):
+        self.list_pages = list_pages
+        self.process_page = process_page
+        self.workers = workers
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        # _lock は共有の接続、_wakeup はワーカーの待機・起床、_views_lock は閲覧履歴のバッファを守る
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._generation = 0
+        self._views_lock = threading.Lock()
+        self._views: Dict[str, Tuple[float, int]] = {}
+        # タスクの取得に使うスレッドごとの接続（他のプロセスの書き込み待ちの間も共有の接続を止めない）
+        self._local = threading.local()
+        self._threads: List[threading.Thread] = []
+        # このプロセス（キュー）を表す名前。取得したタスクに記録する
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # 他のプロセスが書き込み中の場合は待つ
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                target TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_pages (
+                job_id TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (job_id, page_id)
+            );
+            CREATE INDEX IF NOT EXISTS job_pages_status ON job_pages (status);
+            CREATE TABLE IF NOT EXISTS page_views (
+                page_id TEXT PRIMARY KEY,
+                last_viewed REAL NOT NULL,
+                views INTEGER NOT NULL
+            );
+        ''')
+        # 取得したプロセスと期限の列を追加（以前のDBで期限のない実行中のタスクは、期限切れとしてやり直す）
+        for table in ('jobs', 'job_pages'):
+            columns = {row['name'] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            if 'owner' not in columns:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN owner TEXT')
+            if 'lease_until' not in columns:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN lease_until REAL')
+        self._conn.commit()
+
+    def start(self) -> None:
+        """
+        ワーカースレッドを起動（複数回呼んでも1回だけ起動する）
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._renew_leases, name='job-lease', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind: str, target: str) -> str:
+        """
+        ジョブを登録してジョブIDを返す
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未対応のジョブ種別です: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, target, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, target, time.time())
+            )
+            self._conn.commit()
+        self._notify()
+        return job_id
+
+    def record_view(self, page_id: str) -> None:
+        """
+        ページの閲覧を記録（キュー内の同じページのタスクが優先される）
+        ページ表示のたびにDBへ書き込まないよう、メモリに溜めてワーカーがタスクの取得前にまとめて書き込む
+        """
+        with self._views_lock:
+            _, views = self._views.pop(page_id, (0.0, 0))
+            if len(self._views) >= JOBS_VIEW_BUFFER_MAX:
+                del self._views[next(iter(self._views))]
+            self._views[page_id] = (time.time(), views + 1)
+
+    def _flush_views(self, conn: sqlite3.Connection) -> None:
+        """
+        溜めた閲覧履歴をDBに書き込む（失敗した場合はバッファに戻す）
+        """
+        with self._views_lock:
+            views, self._views = self._views, {}
+        if not views:
+            return
+        try:
+            conn.executemany(
+                'INSERT INTO page_views (page_id, last_viewed, views) VALUES (?, ?, ?) '
+                'ON CONFLICT(page_id) DO UPDATE SET last_viewed = MAX(last_viewed, excluded.last_viewed), '
+                'views = views + excluded.views',
+                [(page_id, last_viewed, count) for page_id, (last_viewed, count) in views.items()]
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            with self._views_lock:
+                for page_id, (last_viewed, count) in views.items():
+                    newer = self._views.get(page_id)
+                    self._views[page_id] = (max(last_viewed, newer[0]), count + newer[1]) if newer else (last_viewed, count)
+            raise
+
+    def _notify(self) -> None:
+        # 待機中のワーカーを起こす（取得を試みてから待機するまでの間の通知も取りこぼさないよう世代を進める）
+        with self._wakeup:
+            self._generation += 1
+            self._wakeup.notify_all()
+
+    def _claim_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 他のプロセスが書き込み中の場合は待つ（待つのはこのスレッドだけ）
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        ジョブの状態と進捗（状態ごとのページ数）を返す（存在しない場合はNone）
+        """
+        with self._lock:
+            job = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                'SELECT status, COUNT(*) FROM job_pages WHERE job_id = ? GROUP BY status', (job_id,)
+            ).fetchall())
+        result = dict(job)
+        finished = sum(counts.get(status, 0) for status in ('translated', 'cached', 'skipped', 'missing', 'failed'))
+        result['progress'] = {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'translated': counts.get('translated', 0),
+            'cached': counts.get('cached', 0),
+            'skipped': counts.get('skipped', 0),
+            'missing': counts.get('missing', 0),
+            'failed': counts.get('failed', 0),
+            'percent': round(100 * finished / job['total'], 1) if job['total'] else None
+        }
+        return result
+
+    def _claim(self, select: str, update: str,
+               params: Callable[[sqlite3.Row, float, float], tuple]) -> Optional[sqlite3.Row]:
+        """
+        取得できる行を1件選び、取得したプロセスと期限を書き込む（BEGIN IMMEDIATE で書き込みロックを取ってから
+        選ぶため、他のプロセスと同じ行を取り合わない。念のため更新件数でも取得できたことを確かめる）
+        params(row, now, lease_until) は update のパラメーターを返す。スレッドごとの接続で行い、ロックは持たない
+        """
+        conn = self._claim_conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(select, (now,)).fetchone()
+            if row is not None:
+                cursor = conn.execute(update, params(row, now, now + JOBS_LEASE_SECONDS))
+                if cursor.rowcount != 1:
+                    row = None
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return row
+
+    def _claim_listing(self) -> Optional[sqlite3.Row]:
+        # 未着手のジョブと、分解中に期限切れになった（止まったプロセスの）ジョブ
+        return self._claim(
+            "SELECT id, kind, target FROM jobs "
+            "WHERE status = 'queued' OR (status = 'listing' AND COALESCE(lease_until, 0) < ?) "
+            "ORDER BY created LIMIT 1",
+            "UPDATE jobs SET status = 'listing', owner = ?, lease_until = ?, started = ? "
+            "WHERE id = ? AND (status = 'queued' OR (status = 'listing' AND COALESCE(lease_until, 0) < ?))",
+            lambda job, now, lease_until: (self.owner, lease_until, now, job['id'], now)
+        )
+
+    def _claim_page(self) -> Optional[sqlite3.Row]:
+        # 最近閲覧されたページを優先し、それ以外は登録順に処理する（期限切れの実行中タスクも取り直す）
+        self._flush_views(self._claim_conn())
+        return self._claim(
+            '''
+            SELECT jp.job_id, jp.page_id FROM job_pages jp
+            LEFT JOIN page_views v ON v.page_id = jp.page_id
+            WHERE jp.status = 'queued' OR (jp.status = 'running' AND COALESCE(jp.lease_until, 0) < ?)
+            ORDER BY COALESCE(v.last_viewed, 0) DESC, jp.rowid
+            LIMIT 1
+            ''',
+            "UPDATE job_pages SET status = 'running', owner = ?, lease_until = ? "
+            "WHERE job_id = ? AND page_id = ? "
+            "AND (status = 'queued' OR (status = 'running' AND COALESCE(lease_until, 0) < ?))",
+            lambda task, now, lease_until: (self.owner, lease_until, task['job_id'], task['page_id'], now)
+        )
+
+    def _renew_leases(self) -> None:
+        # 処理中のタスク・分解中のジョブの期限を延長する（プロセスが止まると延長されず、期限切れで他が取り直す）
+        while True:
+            time.sleep(JOBS_LEASE_SECONDS / 3)
+            with self._lock:
+                lease_until = time.time() + JOBS_LEASE_SECONDS
+                self._conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'listing'",
+                                   (lease_until, self.owner))
+                self._conn.execute("UPDATE job_pages SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                                   (lease_until, self.owner))
+                self._conn.commit()
+
+    def _list(self, job: sqlite3.Row) -> None:
+        try:
+            page_ids = list(dict.fromkeys(self.list_pages(job['kind'], job['target'])))
+        except Exception as e:
+            print(f"[JOB] ページ一覧の取得に失敗しました: job={job['id']} error={e}")
+            with self._lock:
+                self._conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                                   (str(e), time.time(), job['id']))
+                self._conn.commit()
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO job_pages (job_id, page_id, status) VALUES (?, ?, 'queued')",
+                [(job['id'], page_id) for page_id in page_ids]
+            )
+            self._conn.execute("UPDATE jobs SET status = 'running', total = ?, lease_until = NULL "
+                               "WHERE id = ? AND owner = ?", (len(page_ids), job['id'], self.owner))
+            self._finish_if_done(job['id'])
+            self._conn.commit()
+        self._notify()
+        print(f"[JOB] ジョブ開始: job={job['id']} {job['kind']}={job['target']} ページ数={len(page_ids)}")
+
+    def _process(self, task: sqlite3.Row) -> None:
+        try:
+            status = self.process_page(task['page_id'])
+        except Exception as e:
+            print(f"[JOB] 翻訳に失敗しました: page_id={task['page_id']} error={e}")
+            status = 'failed'
+        with self._lock:
+            # 期限切れで他のワーカーが取り直した場合は、そちらの結果を記録する
+            cursor = self._conn.execute(
+                "UPDATE job_pages SET status = ?, lease_until = NULL "
+                "WHERE job_id = ? AND page_id = ? AND owner = ? AND status = 'running'",
+                (status, task['job_id'], task['page_id'], self.owner)
+            )
+            if cursor.rowcount != 1:
+                print(f"[JOB] 期限切れで他のワーカーが処理しているため、結果を記録しません: page_id={task['page_id']}")
+            self._finish_if_done(task['job_id'])
+            self._conn.commit()
+
+    def _finish_if_done(self, job_id: str) -> None:
+        remaining = self._conn.execute(
+            "SELECT COUNT(*) FROM job_pages WHERE job_id = ? AND status IN ('queued', 'running')", (job_id,)
+        ).fetchone()[0]
+        if not remaining:
+            self._conn.execute("UPDATE jobs SET status = 'completed', finished = ? WHERE id = ?",
+                               (time.time(), job_id))
+            print(f"[JOB] ジョブ完了: job={job_id}")
+
+    def _work(self) -> None:
+        while True:
+            with self._wakeup:
+                generation = self._generation
+            # ページ一覧の取得（ジョブの分解）を先に行い、タスクを早く積む（取得中は _wakeup を持たない）
+            job = self._claim_listing()
+            task = self._claim_page() if job is None else None
+            if job is None and task is None:
+                with self._wakeup:
+                    self._wakeup.wait_for(lambda: self._generation != generation, timeout=JOBS_POLL_INTERVAL)
+                continue
+            if job is not None:
+                self._list(job)
+            else:
+                self._process(task)
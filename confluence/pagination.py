@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# v2 APIの1リクエストあたりの最大取得件数
+V2_MAX_LIMIT = 250
+
+
+def next_cursor_url(base_url: str, data: Dict) -> Optional[str]:
+    """
+    v2 APIのレスポンスの _links.next から次ページの絶対URLを返す（なければNone）
+    """
+    next_link = data.get('_links', {}).get('next')
+    if not next_link:
+        return None
+    if next_link.startswith('http'):
+        return next_link
+    # _links.next は /wiki/api/v2/...?cursor=... の相対パスで返る
+    return base_url.rstrip('/') + next_link
+
+
+def iter_cursor_pages(fetch_json: Callable[[str], Dict], first_url: str,
+                      resolve_next: Callable[[Dict], Optional[str]],
+                      prefetch: bool = True) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+    """
+    カーソル（_links.next）を辿って1リクエスト分ずつ (結果一覧, 次ページのURL) を返すジェネレーター
+
+    prefetch=True の場合、呼び出し側が現在のページを処理している間に次のページを別スレッドで取得しておく。
+    途中でループを抜けた場合は、先読み中のリクエストの結果は捨てられる。
+    """
+    if not prefetch:
+        url = first_url
+        while url:
+            data = fetch_json(url)
+            url = resolve_next(data)
+            yield data.get('results', []), url
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(fetch_json, first_url)
+        while future is not None:
+            data = future.result()
+            url = resolve_next(data)
+            # 次ページの取得を先に開始してから、現在のページを呼び出し側に渡す
+            future = executor.submit(fetch_json, url) if url else None
+            yield data.get('results', []), url
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_cursor_results(fetch_json: Callable[[str], Dict], first_url: str,
+                        resolve_next: Callable[[Dict], Optional[str]],
+                        prefetch: bool = True) -> Iterator[Dict]:
+    """
+    カーソルを辿って結果を1件ずつ返す遅延ジェネレーター
+    """
+    for results, _ in iter_cursor_pages(fetch_json, first_url, resolve_next, prefetch=prefetch):
+        yield from results
@@ -0,0 +1,192 @@
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple, Union
+
+# ページ一覧・子孫ページの取得結果を、APIのJSON（_links・入れ子の version など）のままではなく
+# 必要な項目だけを持つ小さなレコードで保持する（本文はディスクに書き出し、必要になった時点で読み込む）
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # スペースID・状態・種別、親ページID（兄弟ページで共有）のように繰り返し現れる文字列は1つのオブジェクトを共有する
+    # （ページIDのように重複しない文字列は、インターン表の分だけ大きくなるため対象にしない）
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _parse_time(value: Optional[str]) -> Union[int, str, None]:
+    # ISO 8601の日時文字列（約70バイト）はUNIX時間のミリ秒（整数）で保持する（解釈できない形式は文字列のまま）
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+    except ValueError:
+        return value
+
+
+def _format_time(value: Union[int, str, None]) -> Optional[str]:
+    if not isinstance(value, int):
+        return value
+    moment = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{value % 1000:03d}Z"
+
+
+class BodyStore:
+    """
+    ページ本文を一時ファイルに追記し、(位置, 長さ) で読み出すストア
+    レコードには本文の代わりに位置を持たせ、数万ページ分の本文をメモリに載せないようにする
+    """
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def put(self, body: str) -> Tuple[int, int]:
+        data = body.encode('utf-8')
+        with self._lock:
+            offset = self._size
+            self._file.seek(offset)
+            self._file.write(data)
+            self._size += len(data)
+        return offset, len(data)
+
+    def get(self, offset: int, length: int) -> str:
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length).decode('utf-8')
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class PageRecord:
+    """
+    1ページ分のメタデータ（__slots__ で属性辞書を持たない）
+    本文は BodyStore に置いた場合は body を参照した時点でディスクから読み込む
+    """
+    __slots__ = ('id', 'title', 'type', 'status', 'space_id', 'parent_id', 'position', 'level',
+                 'version', '_created', '_updated', 'webui', '_body')
+
+    def __init__(self, id: str, title: Optional[str] = None, type: Optional[str] = 'page',
+                 status: Optional[str] = None, space_id: Optional[str] = None, parent_id: Optional[str] = None,
+                 position: Optional[int] = None, level: Optional[int] = None, version: Optional[int] = None,
+                 created: Optional[str] = None, updated: Optional[str] = None, webui: Optional[str] = None):
+        self.id = id
+        self.title = title
+        self.type = _intern(type)
+        self.status = _intern(status)
+        self.space_id = _intern(space_id)
+        self.parent_id = _intern(parent_id)
+        self.position = position
+        self.level = level
+        self.version = version
+        self._created = _parse_time(created)
+        self._updated = _parse_time(updated)
+        self.webui = webui
+        self._body = None
+
+    @classmethod
+    def from_v2(cls, page: Dict, parent_id: Optional[str] = None, level: Optional[int] = None,
+                body_store: Optional[BodyStore] = None, links: bool = False) -> 'PageRecord':
+        """
+        v2 APIのページデータ（一覧・子ページ・本文付きのいずれも可）からレコードを作る
+        body_store を渡すと本文はストアに書き出し、渡さない場合は本文を持たない
+        画面のURL（_links.webui）は links=True の場合のみ保持する
+        """
+        version = page.get('version') or {}
+        record = cls(
+            page.get('id'),
+            title=page.get('title'),
+            type=page.get('type', 'page'),
+            status=page.get('status'),
+            space_id=page.get('spaceId'),
+            parent_id=parent_id or page.get('parentId'),
+            position=page.get('childPosition', page.get('position')),
+            level=level,
+            version=version.get('number'),
+            created=page.get('createdAt'),
+            updated=version.get('createdAt'),
+            webui=(page.get('_links') or {}).get('webui') if links else None
+        )
+        body = (page.get('body') or {}).get('storage', {}).get('value')
+        if body is not None and body_store is not None:
+            record.set_body(body, body_store)
+        return record
+
+    @classmethod
+    def from_v1(cls, page: Dict, level: Optional[int] = None,
+                body_store: Optional[BodyStore] = None, links: bool = False) -> 'PageRecord':
+        """
+        v1 APIのページデータからレコードを作る（親は ancestors の末尾）
+        """
+        version = page.get('version') or {}
+        ancestors = page.get('ancestors') or []
+        record = cls(
+            page.get('id'),
+            title=page.get('title'),
+            type=page.get('type', 'page'),
+            status=page.get('status'),
+            parent_id=ancestors[-1].get('id') if ancestors else None,
+            level=level,
+            version=version.get('number'),
+            updated=version.get('when'),
+            webui=(page.get('_links') or {}).get('webui') if links else None
+        )
+        body = (page.get('body') or {}).get('storage', {}).get('value')
+        if body is not None and body_store is not None:
+            record.set_body(body, body_store)
+        return record
+
+    @property
+    def created(self) -> Optional[str]:
+        return _format_time(self._created)
+
+    @property
+    def updated(self) -> Optional[str]:
+        return _format_time(self._updated)
+
+    def set_body(self, body: str, body_store: Optional[BodyStore] = None) -> None:
+        self._body = (body_store.get, *body_store.put(body)) if body_store is not None else body
+
+    def set_body_loader(self, loader: Callable[..., Optional[str]], *args) -> None:
+        """
+        本文を読み込む関数を登録する（body を参照した時点で loader(*args) を呼ぶ）
+        """
+        self._body = (loader, *args)
+
+    @property
+    def has_body(self) -> bool:
+        return self._body is not None
+
+    @property
+    def body(self) -> Optional[str]:
+        """
+        本文（BodyStore・読み込み関数から参照のたびに読み込み、レコードには保持しない）
+        """
+        if isinstance(self._body, tuple):
+            loader, *args = self._body
+            return loader(*args)
+        return self._body
+
+    def to_dict(self) -> Dict:
+        """
+        画面・APIに返す辞書（crawl_descendants の従来の形式と同じ項目。値のない追加項目は含めない）
+        """
+        item = {
+            'id': self.id,
+            'title': self.title,
+            'type': self.type,
+            'status': self.status,
+            'spaceId': self.space_id,
+            'childPosition': self.position,
+            'parent_id': self.parent_id,
+            'level': self.level
+        }
+        for key, value in (('version', self.version), ('created', self.created),
+                           ('updated', self.updated), ('url', self.webui)):
+            if value is not None:
+                item[key] = value
+        return item
+
+    def __repr__(self) -> str:
+        return f"PageRecord(id={self.id!r}, title={self.title!r}, parent_id={self.parent_id!r})"
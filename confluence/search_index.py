@@ -0,0 +1,202 @@
+import html
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from confluence.storage_format import extract_segments
+
+# 検索インデックスのDBとスニペットの長さ（文字数）
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'cache/search_index.sqlite3')
+SEARCH_SNIPPET_CHARS = int(os.getenv('SEARCH_SNIPPET_CHARS', '160'))
+# bm25 の列ごとの重み（タイトル・本文）
+TITLE_WEIGHT = 5.0
+BODY_WEIGHT = 1.0
+
+# 日本語・中国語の文字の連なり（単語の区切りがないため2文字ずつ重ねたbi-gramで索引する）
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]+')
+# to_index_text の結果を語（FTS5 unicode61 のトークン）に分ける。ベクトルインデックスの特徴ハッシュでも使う
+WORD = re.compile(r'\w+')
+
+
+def to_index_text(text: str) -> str:
+    """
+    FTS5（unicode61）に渡すテキストに変換（日本語部分をbi-gramに分割し、英数字はそのまま）
+    """
+    def bigrams(match):
+        run = match.group(0)
+        if len(run) == 1:
+            return f' {run} '
+        return ' ' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + ' '
+    return _CJK.sub(bigrams, text)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    検索語をFTS5のMATCH式に変換（空白区切りの語をANDで結合。各語は bi-gram のフレーズとして検索）
+    1トークンだけの語（英単語・日本語1文字）は前方一致で検索する
+    """
+    terms = []
+    for term in query.split():
+        tokens = WORD.findall(to_index_text(term))
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        terms.append(phrase + '*' if len(tokens) == 1 else phrase)
+    return ' AND '.join(terms) or None
+
+
+def plain_text(xhtml: str) -> str:
+    """
+    ストレージ形式の本文から、索引・スニペット用のプレーンテキストを取り出す（コードマクロなどは除く）
+    """
+    return '\n'.join(segment.text for segment in extract_segments(xhtml))
+
+
+def _snippet(body: str, query: str) -> str:
+    """
+    本文から最初に検索語が現れる付近を切り出し、検索語を <mark> で囲んだHTMLを返す
+    （FTS5の snippet() は bi-gram に分割したテキストを返すため使わない）
+    """
+    terms = [re.escape(term) for term in query.split() if term]
+    pattern = re.compile('|'.join(terms), re.IGNORECASE) if terms else None
+    first = pattern.search(body) if pattern else None
+    start = max(0, first.start() - SEARCH_SNIPPET_CHARS // 3) if first else 0
+    window = body[start:start + SEARCH_SNIPPET_CHARS]
+    pieces = ['…' if start > 0 else '']
+    pos = 0
+    for match in pattern.finditer(window) if pattern else ():
+        pieces.append(html.escape(window[pos:match.start()]))
+        pieces.append(f'<mark>{html.escape(match.group(0))}</mark>')
+        pos = match.end()
+    pieces.append(html.escape(window[pos:]))
+    if start + SEARCH_SNIPPET_CHARS < len(body):
+        pieces.append('…')
+    return ''.join(pieces).replace('\n', ' ')
+
+
+class SearchIndex:
+    """
+    取得済みのページ本文を全文検索するローカルインデックス（SQLite FTS5）
+    ページIDごとにバージョンを記録し、バージョンが進んだページのみ索引し直す
+    """
+    def __init__(self, db_path: str = SEARCH_INDEX_PATH):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS docs (
+                rowid INTEGER PRIMARY KEY,
+                page_id TEXT NOT NULL UNIQUE,
+                title TEXT,
+                space TEXT,
+                version INTEGER NOT NULL,
+                body TEXT NOT NULL,
+                indexed REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                title, body, tokenize = 'unicode61 remove_diacritics 2'
+            );
+        ''')
+        self._conn.commit()
+
+    def index_page(self, page: Dict) -> bool:
+        """
+        ページデータ（v1 / v2、本文付き）を索引する。索引済みのバージョン以下の場合は何もしない
+        戻り値: 索引を更新したかどうか
+        """
+        body = (page.get('body') or {}).get('storage', {}).get('value')
+        page_id = page.get('id')
+        if body is None or not page_id:
+            return False
+        version = (page.get('version') or {}).get('number') or 0
+        space = (page.get('space') or {}).get('key') or page.get('spaceId')
+        title = page.get('title') or ''
+        with self._lock:
+            row = self._conn.execute('SELECT rowid, version FROM docs WHERE page_id = ?', (page_id,)).fetchone()
+            if row is not None and row[1] >= version:
+                return False
+        # 本文の走査はロックの外で行う（その間に他のスレッドが索引した場合に備えて書き込み前に確認し直す）
+        text = plain_text(body)
+        with self._lock:
+            row = self._conn.execute('SELECT rowid, version FROM docs WHERE page_id = ?', (page_id,)).fetchone()
+            if row is not None and row[1] >= version:
+                return False
+            if row is not None:
+                self._conn.execute('DELETE FROM docs_fts WHERE rowid = ?', (row[0],))
+                self._conn.execute(
+                    'UPDATE docs SET title = ?, space = ?, version = ?, body = ?, indexed = ? WHERE rowid = ?',
+                    (title, space, version, text, time.time(), row[0])
+                )
+                rowid = row[0]
+            else:
+                rowid = self._conn.execute(
+                    'INSERT INTO docs (page_id, title, space, version, body, indexed) VALUES (?, ?, ?, ?, ?, ?)',
+                    (page_id, title, space, version, text, time.time())
+                ).lastrowid
+            self._conn.execute('INSERT INTO docs_fts (rowid, title, body) VALUES (?, ?, ?)',
+                               (rowid, to_index_text(title), to_index_text(text)))
+            self._conn.commit()
+        return True
+
+    def remove(self, page_id: str) -> None:
+        with self._lock:
+            row = self._conn.execute('SELECT rowid FROM docs WHERE page_id = ?', (page_id,)).fetchone()
+            if row is not None:
+                self._conn.execute('DELETE FROM docs_fts WHERE rowid = ?', (row[0],))
+                self._conn.execute('DELETE FROM docs WHERE rowid = ?', (row[0],))
+                self._conn.commit()
+
+    def search(self, query: str, limit: int = 20, space: Optional[str] = None) -> List[Dict]:
+        """
+        bm25（タイトルを重み付け）の順に検索結果を返す
+        """
+        match = build_match_query(query)
+        if match is None:
+            return []
+        sql = ('SELECT d.page_id, d.title, d.space, d.version, d.body, '
+               f'bm25(docs_fts, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS score '
+               'FROM docs_fts JOIN docs d ON d.rowid = docs_fts.rowid WHERE docs_fts MATCH ?')
+        params = [match]
+        if space:
+            sql += ' AND d.space = ?'
+            params.append(space)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {
+                'id': page_id,
+                'title': title,
+                'space': space,
+                'version': version,
+                # bm25 は小さいほど関連度が高いため、符号を反転して返す
+                'score': round(-score, 6),
+                'snippet': _snippet(body, query)
+            }
+            for page_id, title, space, version, body, score in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'documents': self._conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0]}
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """
+    プロセス内で共有する検索インデックスを返す
+    """
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = SearchIndex()
+        return _search_index
@@ -0,0 +1,523 @@
+import argparse
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import requests
+
+from config import AZURE_OPENAI_KEY, AZURE_OPENAI_BASE, API_VERSION
+from confluence.governor import get_governor
+from confluence.http_pool import get_session_registry
+from confluence.search_index import WORD, to_index_text
+from confluence.storage_format import extract_segments
+from confluence.tokenizer import count_tokens
+from confluence.translator import AZURE_OPENAI_SESSION
+
+# ベクトルインデックスの保存先ディレクトリ（メタデータのSQLiteとベクトルのファイルを置く）
+SEMANTIC_INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR', 'cache/semantic_index')
+# 埋め込みの方式と次元数
+#   auto   : Azure OpenAIの埋め込みデプロイが設定されていれば azure、なければ hashing
+#   azure  : Azure OpenAIの埋め込みデプロイ（英語の質問で日本語のページも検索できる）
+#   hashing: オフラインで動く特徴ハッシュ（テスト・オフライン用の代替。言語をまたいだ検索はできない）
+SEMANTIC_EMBEDDER = os.getenv('SEMANTIC_EMBEDDER', 'auto')
+SEMANTIC_DIMENSIONS = int(os.getenv('SEMANTIC_DIMENSIONS', '256'))
+# Azure OpenAIの埋め込みデプロイ名（dimensions を指定できる text-embedding-3 系）と1リクエストの件数
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT', '')
+SEMANTIC_EMBED_BATCH = int(os.getenv('SEMANTIC_EMBED_BATCH', '64'))
+# 1チャンクの目安トークン数
+SEMANTIC_CHUNK_TOKENS = int(os.getenv('SEMANTIC_CHUNK_TOKENS', '400'))
+
+# ベクトルファイルの初期の行数と、一度に内積を計算する行数（メモリ使用量の上限）
+INITIAL_CAPACITY = 1024
+SEARCH_BLOCK_ROWS = 65536
+# 削除済みの行がこの割合を超えたらベクトルファイルを詰め直す
+COMPACT_DEAD_RATIO = 0.5
+
+
+def chunk_page(content: str, max_tokens: int = SEMANTIC_CHUNK_TOKENS) -> List[str]:
+    """
+    ストレージ形式の本文を段落単位でまとめ、max_tokens 程度のチャンクに分割する
+    チャンクの境界をまたぐ文脈を残すため、短い直前の段落は次のチャンクの先頭にも含める。
+    1段落で max_tokens を超える場合は文字数で按分して分割する
+    """
+    pieces = []
+    for segment in extract_segments(content or ''):
+        tokens = count_tokens(segment.text)
+        if tokens <= max_tokens:
+            pieces.append((segment.text, tokens))
+            continue
+        step = max(1, len(segment.text) * max_tokens // tokens)
+        for i in range(0, len(segment.text), step):
+            part = segment.text[i:i + step]
+            pieces.append((part, count_tokens(part)))
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    last = None
+    for text, tokens in pieces:
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+            if last is not None and last[1] <= max_tokens // 4 and last[1] + tokens <= max_tokens:
+                current, current_tokens = [last[0]], last[1]
+        current.append(text)
+        current_tokens += tokens
+        last = (text, tokens)
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    単語・日本語のbi-gramを特徴ハッシュで固定長のベクトルにする埋め込み（ネットワーク不要）
+    語彙の重なりに基づく類似度のため言語をまたいだ検索はできないが、オフライン環境やテストで
+    埋め込みAPIの代わりに使う（stub=True として検索結果に表示する）
+    """
+    stub = True
+
+    def __init__(self, dimensions: int = SEMANTIC_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f'hashing:{dimensions}'
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for token in WORD.findall(to_index_text(text.lower())):
+                h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                # 上位ビットで符号を決め、衝突による偏りを打ち消す
+                index = h % self.dimensions
+                counts[index] = counts.get(index, 0.0) + (1.0 if h >> 63 else -1.0)
+            for index, value in counts.items():
+                vectors[i, index] = math.copysign(math.log1p(abs(value)), value)
+        return _normalize(vectors)
+
+
+class AzureOpenAIEmbedder:
+    """
+    Azure OpenAIの埋め込みデプロイでベクトル化する（SEMANTIC_EMBED_BATCH 件ずつまとめて送信）
+    """
+    stub = False
+
+    def __init__(self, deployment: str = AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+                 dimensions: int = SEMANTIC_DIMENSIONS):
+        if not AZURE_OPENAI_KEY or not AZURE_OPENAI_BASE or not API_VERSION or not deployment:
+            raise ValueError("Azure OpenAIの埋め込みの設定が不足しています")
+        self.dimensions = dimensions
+        self.name = f'azure:{deployment}:{dimensions}'
+        self.url = f"{AZURE_OPENAI_BASE}openai/deployments/{deployment}/embeddings?api-version={API_VERSION}"
+        self.headers = {
+            "Content-Type": "application/json",
+            "api-key": AZURE_OPENAI_KEY
+        }
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        registry = get_session_registry()
+        vectors = []
+        for start in range(0, len(texts), SEMANTIC_EMBED_BATCH):
+            batch = list(texts[start:start + SEMANTIC_EMBED_BATCH])
+            payload = {"input": batch, "dimensions": self.dimensions}
+            try:
+                response = get_governor().request(registry.get(AZURE_OPENAI_SESSION), 'POST', self.url,
+                                                  idempotent=True, headers=self.headers, json=payload)
+            except requests.ConnectionError:
+                registry.report_failure(AZURE_OPENAI_SESSION)
+                raise
+            response.raise_for_status()
+            data = sorted(response.json()['data'], key=lambda item: item['index'])
+            vectors.extend(item['embedding'] for item in data)
+        return _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimensions))
+
+
+def azure_embedding_configured() -> bool:
+    return bool(AZURE_OPENAI_KEY and AZURE_OPENAI_BASE and API_VERSION and AZURE_OPENAI_EMBEDDING_DEPLOYMENT)
+
+
+def describe_embedder() -> Dict:
+    """
+    設定から使われる埋め込みの方式を返す（インデックスを開かずに、検索APIの応答に含めるため）
+    """
+    azure = SEMANTIC_EMBEDDER == 'azure' or (SEMANTIC_EMBEDDER == 'auto' and azure_embedding_configured())
+    if azure:
+        return {'name': f'azure:{AZURE_OPENAI_EMBEDDING_DEPLOYMENT}:{SEMANTIC_DIMENSIONS}', 'stub': False}
+    return {'name': f'hashing:{SEMANTIC_DIMENSIONS}', 'stub': True}
+
+
+def get_embedder():
+    """
+    SEMANTIC_EMBEDDER の設定に従って埋め込みを作る（auto はAzure OpenAIの埋め込みが設定されていればそれを使う）
+    """
+    if SEMANTIC_EMBEDDER == 'azure' or (SEMANTIC_EMBEDDER == 'auto' and azure_embedding_configured()):
+        return AzureOpenAIEmbedder()
+    if SEMANTIC_EMBEDDER in ('auto', 'hashing'):
+        print("[DEBUG] Azure OpenAIの埋め込みが設定されていないため、特徴ハッシュの埋め込み（テスト・オフライン用）を使います")
+        return HashingEmbedder()
+    raise ValueError(f"未対応の埋め込み方式です: {SEMANTIC_EMBEDDER}")
+
+
+class SemanticIndex:
+    """
+    ページ本文のチャンクを埋め込んだベクトルインデックス
+
+    - ベクトルは float32 の行列としてファイルに保存し、numpy.memmap で読み書きする（正規化済みのため内積がコサイン類似度）
+    - チャンクの本文・ページID・バージョンはSQLiteに保存し、バージョンが進んだページのみ埋め込み直す
+      （埋め込み直すときも、本文が変わっていないチャンクは以前のベクトルを再利用する）
+    - 更新・削除された行は無効にしておき、一定の割合を超えたら新しい世代のファイルに詰め直す
+    """
+    def __init__(self, embedder=None, directory: str = SEMANTIC_INDEX_DIR,
+                 chunk_tokens: int = SEMANTIC_CHUNK_TOKENS):
+        self.embedder = embedder or get_embedder()
+        self.dimensions = self.embedder.dimensions
+        self.chunk_tokens = chunk_tokens
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'meta.sqlite3'), check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                title TEXT,
+                space TEXT,
+                indexed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                page_id TEXT NOT NULL,
+                chunk_no INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                text TEXT NOT NULL,
+                alive INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_page ON chunks (page_id);
+        ''')
+        meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+        if meta and meta['embedder'] != self.embedder.name:
+            raise ValueError(
+                f"インデックスは埋め込み {meta['embedder']} で作成されています"
+                f"（{self.embedder.name} で使う場合は {directory} を削除して作り直してください）"
+            )
+        if not meta:
+            meta = {'embedder': self.embedder.name, 'count': '0', 'generation': '0'}
+            self._conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', meta.items())
+            self._conn.commit()
+        self._count = int(meta['count'])
+        self._generation = int(meta['generation'])
+        self._remove_stale_files()
+        self._vectors = None
+        self._capacity = 0
+        self._open_vectors(max(INITIAL_CAPACITY, self._count))
+        # 行ごとの有効フラグとスペース（検索時の絞り込みに使う）はメモリ上に持つ
+        self._spaces: Dict[Optional[str], int] = {}
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._row_space = np.zeros(self._capacity, dtype=np.int32)
+        for row, space in self._conn.execute(
+            'SELECT c.row, p.space FROM chunks c JOIN pages p ON p.page_id = c.page_id WHERE c.alive = 1'
+        ):
+            if row < self._count:
+                self._alive[row] = True
+                self._row_space[row] = self._space_code(space)
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'vectors-{generation}.f32')
+
+    def _remove_stale_files(self) -> None:
+        # 詰め直しの途中で止まった場合などに残った、現在の世代以外のファイルを消す
+        current = os.path.basename(self._vectors_path(self._generation))
+        for name in os.listdir(self.directory):
+            if name.startswith('vectors-') and name.endswith('.f32') and name != current:
+                os.remove(os.path.join(self.directory, name))
+
+    def _open_vectors(self, rows: int) -> None:
+        path = self._vectors_path(self._generation)
+        row_bytes = self.dimensions * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        capacity = max(rows, size // row_bytes)
+        if size < capacity * row_bytes:
+            with open(path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        self._vectors = np.memmap(path, dtype=np.float32, mode='r+', shape=(capacity, self.dimensions))
+        self._capacity = capacity
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self._capacity:
+            return
+        self._vectors.flush()
+        self._vectors = None
+        self._open_vectors(max(rows, self._capacity * 2))
+        self._alive = np.concatenate([self._alive, np.zeros(self._capacity - len(self._alive), dtype=bool)])
+        self._row_space = np.concatenate(
+            [self._row_space, np.zeros(self._capacity - len(self._row_space), dtype=np.int32)]
+        )
+
+    def _space_code(self, space: Optional[str]) -> int:
+        return self._spaces.setdefault(space, len(self._spaces))
+
+    def index_page(self, page_info: Dict, space: Optional[str] = None) -> bool:
+        """
+        extract_page_content の結果を索引する。索引済みのバージョン以下の場合は何もしない
+        space を省略した場合は page_info の space_key で絞り込めるようにする
+        戻り値: 索引を更新したかどうか
+        """
+        page_id = page_info.get('id')
+        if not page_id or page_info.get('content') is None:
+            return False
+        version = page_info.get('version') or 0
+        title = page_info.get('title') or ''
+        space = space or page_info.get('space_key')
+        with self._lock:
+            row = self._conn.execute('SELECT version FROM pages WHERE page_id = ?', (page_id,)).fetchone()
+            if row is not None and row[0] >= version:
+                return False
+            known = self._page_digests(page_id)
+        # チャンク分割と埋め込みはロックの外で行う（タイトルを含めて埋め込み、検索時の手がかりにする）
+        chunks = chunk_page(page_info['content'], self.chunk_tokens)
+        texts = [f'{title}\n{chunk}' for chunk in chunks]
+        digests = [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+        missing = [i for i, digest in enumerate(digests) if digest not in known]
+        embedded = dict(zip(missing, self.embedder.embed([texts[i] for i in missing]))) if missing else {}
+        with self._lock:
+            row = self._conn.execute('SELECT version FROM pages WHERE page_id = ?', (page_id,)).fetchone()
+            if row is not None and row[0] >= version:
+                return False
+            known = self._page_digests(page_id)
+            # 待っている間に以前のチャンクが消えた場合は、ここで埋め込む
+            late = [i for i, digest in enumerate(digests) if i not in embedded and digest not in known]
+            if late:
+                embedded.update(zip(late, self.embedder.embed([texts[i] for i in late])))
+            start = self._count
+            self._ensure_capacity(start + len(texts))
+            for i, digest in enumerate(digests):
+                self._vectors[start + i] = embedded[i] if i in embedded else self._vectors[known[digest]]
+            self._vectors.flush()
+            self._kill_rows(page_id)
+            code = self._space_code(space)
+            self._conn.executemany(
+                'INSERT INTO chunks (row, page_id, chunk_no, digest, text, alive) VALUES (?, ?, ?, ?, ?, 1)',
+                [(start + i, page_id, i, digest, chunks[i]) for i, digest in enumerate(digests)]
+            )
+            self._conn.execute(
+                'INSERT INTO pages (page_id, version, title, space, indexed) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(page_id) DO UPDATE SET version = excluded.version, title = excluded.title, '
+                'space = excluded.space, indexed = excluded.indexed',
+                (page_id, version, title, space, time.time())
+            )
+            self._count = start + len(texts)
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'count'", (str(self._count),))
+            self._conn.commit()
+            self._alive[start:self._count] = True
+            self._row_space[start:self._count] = code
+            self._compact_if_needed()
+        return True
+
+    def indexed_version(self, page_id: str) -> int:
+        """
+        索引済みのバージョン（未索引の場合は0）
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT version FROM pages WHERE page_id = ?', (page_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _page_digests(self, page_id: str) -> Dict[str, int]:
+        return dict(self._conn.execute(
+            'SELECT digest, row FROM chunks WHERE page_id = ? AND alive = 1', (page_id,)
+        ).fetchall())
+
+    def _kill_rows(self, page_id: str) -> None:
+        rows = [row for (row,) in self._conn.execute(
+            'SELECT row FROM chunks WHERE page_id = ? AND alive = 1', (page_id,)
+        )]
+        self._conn.execute('UPDATE chunks SET alive = 0 WHERE page_id = ?', (page_id,))
+        self._alive[rows] = False
+
+    def remove(self, page_id: str) -> None:
+        with self._lock:
+            self._kill_rows(page_id)
+            self._conn.execute('DELETE FROM pages WHERE page_id = ?', (page_id,))
+            self._conn.commit()
+            self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        dead = self._count - int(self._alive[:self._count].sum())
+        if self._count >= INITIAL_CAPACITY and dead > self._count * COMPACT_DEAD_RATIO:
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        有効な行だけを次の世代のファイルに詰め直す（メタデータを更新してから古いファイルを消すため、
+        途中で止まっても前の世代のまま使える）
+        """
+        rows = np.flatnonzero(self._alive[:self._count])
+        generation = self._generation + 1
+        path = self._vectors_path(generation)
+        capacity = max(INITIAL_CAPACITY, len(rows))
+        compacted = np.memmap(path, dtype=np.float32, mode='w+', shape=(capacity, self.dimensions))
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = rows[start:start + SEARCH_BLOCK_ROWS]
+            compacted[start:start + len(block)] = self._vectors[block]
+        compacted.flush()
+        del compacted
+        self._conn.execute('DELETE FROM chunks WHERE alive = 0')
+        # 行番号は昇順に詰めるため、移動先が他の有効な行と重なることはない
+        self._conn.executemany('UPDATE chunks SET row = ? WHERE row = ?',
+                               [(new, int(old)) for new, old in enumerate(rows) if new != old])
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'count'", (str(len(rows)),))
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(generation),))
+        self._conn.commit()
+        old_path = self._vectors_path(self._generation)
+        self._vectors = None
+        self._generation = generation
+        self._open_vectors(capacity)
+        os.remove(old_path)
+        self._count = len(rows)
+        row_space = self._row_space[rows]
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._alive[:self._count] = True
+        self._row_space = np.zeros(self._capacity, dtype=np.int32)
+        self._row_space[:self._count] = row_space
+        print(f"[DEBUG] ベクトルインデックスを詰め直しました: 行数={self._count} 世代={generation}")
+
+    def search(self, query: str, k: int = 10, space: Optional[str] = None, per_page: bool = True) -> List[Dict]:
+        return self.search_many([query], k=k, space=space, per_page=per_page)[0]
+
+    def search_many(self, queries: Sequence[str], k: int = 10, space: Optional[str] = None,
+                    per_page: bool = True) -> List[List[Dict]]:
+        """
+        複数の検索語をまとめて埋め込み、類似度の高い順に k 件ずつ返す
+        per_page=True の場合は、同じページのチャンクのうち最も類似度の高いものだけを返す
+        """
+        if not queries:
+            return []
+        vectors = self.embedder.embed(list(queries))
+        # 同じページのチャンクを除いた後に k 件残るよう、多めに候補を取る
+        candidates = k * 4 if per_page else k
+        with self._lock:
+            n = self._count
+            if n == 0 or (space is not None and space not in self._spaces):
+                return [[] for _ in queries]
+            excluded = ~self._alive[:n]
+            if space is not None:
+                excluded |= self._row_space[:n] != self._spaces[space]
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            for start in range(0, n, SEARCH_BLOCK_ROWS):
+                end = min(n, start + SEARCH_BLOCK_ROWS)
+                scores = np.asarray(vectors @ self._vectors[start:end].T)
+                scores[:, excluded[start:end]] = -np.inf
+                take = min(candidates, end - start)
+                top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+                best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_rows = np.concatenate([best_rows, top + start], axis=1)
+                if best_scores.shape[1] > candidates:
+                    keep = np.argpartition(-best_scores, candidates - 1, axis=1)[:, :candidates]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            best_rows = np.take_along_axis(best_rows, order, axis=1)
+            wanted = {int(row) for row, score in zip(best_rows.ravel(), best_scores.ravel()) if score > -np.inf}
+            details = {}
+            if wanted:
+                marks = ','.join('?' * len(wanted))
+                for row, page_id, chunk_no, text, title, page_space, version in self._conn.execute(
+                    'SELECT c.row, c.page_id, c.chunk_no, c.text, p.title, p.space, p.version FROM chunks c '
+                    f'JOIN pages p ON p.page_id = c.page_id WHERE c.row IN ({marks})', list(wanted)
+                ):
+                    details[row] = {'id': page_id, 'title': title, 'space': page_space, 'version': version,
+                                    'chunk': chunk_no, 'text': text}
+        results = []
+        for rows, scores in zip(best_rows, best_scores):
+            hits = []
+            seen = set()
+            for row, score in zip(rows, scores):
+                detail = details.get(int(row))
+                if score == -np.inf or detail is None or (per_page and detail['id'] in seen):
+                    continue
+                seen.add(detail['id'])
+                hits.append(dict(detail, score=round(float(score), 6)))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            alive = int(self._alive[:self._count].sum())
+            pages = self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            return {
+                'embedder': self.embedder.name,
+                'embedder_stub': getattr(self.embedder, 'stub', False),
+                'pages': pages,
+                'chunks': alive,
+                'dead_rows': self._count - alive,
+                'vector_bytes': self._capacity * self.dimensions * 4
+            }
+
+
+_semantic_index = None
+_semantic_index_lock = threading.Lock()
+
+
+def get_semantic_index() -> SemanticIndex:
+    """
+    プロセス内で共有するベクトルインデックスを返す
+    """
+    global _semantic_index
+    with _semantic_index_lock:
+        if _semantic_index is None:
+            _semantic_index = SemanticIndex()
+        return _semantic_index
+
+
+def main():
+    """
+    スペース同期（confluence.sync）のローカルコピーからインデックスを作成・更新し、検索を試す
+    例: python -m confluence.semantic_index --space ECL2SOP --query "フェイルオーバーの手順"
+    """
+    from confluence.sync import SYNC_DB_PATH, SpaceSync
+
+    parser = argparse.ArgumentParser(description='ページ本文のベクトルインデックスの作成・検索')
+    parser.add_argument('--space', help='索引するスペースキー（スペース同期済みのもの）')
+    parser.add_argument('--sync-db', default=SYNC_DB_PATH, help='スペース同期のDBのパス')
+    parser.add_argument('--query', help='検索語')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    index = get_semantic_index()
+    if args.space:
+        started = time.monotonic()
+        updated = 0
+        # 本文は索引するページの分だけ読み込む（索引済みのバージョンのページは本文を読まない）
+        for record in SpaceSync(None, args.space, db_path=args.sync_db).records():
+            if (record.version or 0) <= index.indexed_version(record.id):
+                continue
+            updated += index.index_page({'id': record.id, 'version': record.version, 'title': record.title,
+                                         'space_key': args.space, 'content': record.body})
+        print(f"索引を更新したページ数: {updated}（{time.monotonic() - started:.1f}秒）")
+    print(index.stats())
+    if args.query:
+        started = time.perf_counter()
+        hits = index.search(args.query, k=args.k, space=args.space)
+        print(f"検索時間: {(time.perf_counter() - started) * 1000:.1f}ms")
+        for hit in hits:
+            print(f"{hit['score']:.3f}  {hit['id']}  {hit['title']}  {hit['text'][:80]!r}")
+
+
+if __name__ == '__main__':
+    main()
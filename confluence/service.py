@@ -1,4 +1,6 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
+
+from confluence.records import PageRecord
 
 # ページデータからコンテンツを抽出
 
@@ -14,34 +16,71 @@ def extract_page_content(page_data: Dict) -> Dict:
         'version': page_data.get('version', {}).get('number'),
         'created': page_data.get('created'),
         'updated': page_data.get('version', {}).get('when'),
-        'url': page_data.get('_links', {}).get('webui', '')
+        'url': page_data.get('_links', {}).get('webui', ''),
+        # スナップショットから返したページの場合は保存時刻・バージョン（Confluenceから取得した場合はNone）
+        'snapshot': page_data.get('_snapshot')
     }
 
+# ページデータのスペース（v1はスペースキー、v2はスペースID）
+
+def page_space(page_data: Dict) -> Optional[str]:
+    # v1で space を展開していない場合は _expandable.space（/rest/api/space/KEY）からキーを取り出す
+    space_key = (page_data.get('space') or {}).get('key')
+    if space_key:
+        return space_key
+    link = (page_data.get('_expandable') or {}).get('space')
+    if link:
+        return link.rstrip('/').rsplit('/', 1)[-1]
+    return page_data.get('spaceId')
+
 # ページリストから階層構造（ツリー）を構築
 
 def build_page_tree(pages: List[Dict]) -> List[Dict]:
-    page_dict = {page['id']: page for page in pages}
+    # 入力のページ辞書は変更せず、コピーに children を追加する
+    page_dict = {page['id']: dict(page) for page in pages}
     tree = []
     for page in pages:
+        node = page_dict[page['id']]
         parent_id = page.get('parentId')
         if parent_id and parent_id in page_dict:
-            parent = page_dict[parent_id]
-            if 'children' not in parent:
-                parent['children'] = []
-            parent['children'].append(page)
+            page_dict[parent_id].setdefault('children', []).append(node)
         else:
-            tree.append(page)
+            tree.append(node)
     return tree
 
 # descendantsリストから階層ツリーを構築
 
 def build_descendants_tree(descendants: List[Dict], ancestor_id: str) -> Dict:
-    id_to_node = {item['id']: item for item in descendants}
-    tree = []
-    flat_list = []
+    # v1 APIの ancestors（ルートから順）の末尾が親。深さは ancestor_id から数える
+    records = []
     for item in descendants:
-        ancestors = item.get('ancestors', [])
-        if ancestors and ancestors[-1].get('id') == ancestor_id:
-            tree.append(item)
-        flat_list.append(item)
-    return {'tree': tree, 'flat_list': flat_list, 'total_count': len(flat_list)} 
\ No newline at end of file
+        ancestors = [ancestor.get('id') for ancestor in item.get('ancestors', [])]
+        level = len(ancestors) - ancestors.index(ancestor_id) if ancestor_id in ancestors else len(ancestors)
+        records.append(PageRecord.from_v1(item, level=level))
+    return build_level_tree(records, ancestor_id)
+
+
+# 親子関係（parent_id）とレベルを持つフラットリストから階層ツリーを構築
+
+def build_level_tree(flat_list: List[Union[Dict, PageRecord]], ancestor_id: str) -> Dict:
+    # PageRecord は応答用の辞書に変換する（辞書の場合は入力を変更しないようコピーする）
+    nodes = {}
+    for item in flat_list:
+        node = item.to_dict() if isinstance(item, PageRecord) else dict(item)
+        node['children'] = []
+        nodes[node['id']] = node
+    tree = []
+    for node in nodes.values():
+        parent = nodes.get(node.get('parent_id'))
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            tree.append(node)
+    # flat_list は画面で字下げ表示できるよう深さ優先（行きがけ順）に並べる
+    ordered = []
+    stack = list(reversed(tree))
+    while stack:
+        node = stack.pop()
+        ordered.append({key: value for key, value in node.items() if key != 'children'})
+        stack.extend(reversed(node['children']))
+    return {'ancestor_id': ancestor_id, 'total_count': len(ordered), 'tree': tree, 'flat_list': ordered}
@@ -0,0 +1,77 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同じキーの処理が実行中の場合は新たに実行せず、実行中の処理の結果を共有する（single-flight）
+
+    同じページへのリクエストが同時に集中した場合に、ConfluenceやAzure OpenAIへの呼び出しを1回にまとめる。
+    結果は呼び出し元の間で共有されるため、受け取った側で変更しないこと。
+    """
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        key の処理を実行し (結果, 他のリクエストの結果を共有したかどうか) を返す
+        実行中の処理が例外で終わった場合は、待っていた全員に同じ例外を送出する
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # 完了後に届いたリクエストは新たに実行する（結果の再利用はキャッシュ側の役割）
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(call.waiters for call in self._calls.values()),
+                'calls': self.calls,
+                'shared': self.shared
+            }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    プロセス内（Flaskのワーカースレッド間）で共有するsingle-flightを返す
+    """
+    return _single_flight
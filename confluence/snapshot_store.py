@@ -0,0 +1,338 @@
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ページのスナップショット（取得済みの本文付きページ）の保存先ディレクトリ
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'cache/snapshots')
+# ConfluenceAPI の読み込みモード
+#   online  : 常にConfluenceから取得し、取得した本文付きページをスナップショットに保存する
+#   stale_ok: Confluenceに接続できない・5xx/429が続く場合は、古くてもスナップショットを返す
+#   offline : Confluenceに接続せず、スナップショットのみを返す
+CONFLUENCE_READ_MODE = os.getenv('CONFLUENCE_READ_MODE', 'stale_ok')
+READ_MODES = ('online', 'stale_ok', 'offline')
+# 無効になった（古いバージョンの）本文がこの割合・サイズを超えたらセグメントを詰め直す
+SNAPSHOT_COMPACT_RATIO = float(os.getenv('SNAPSHOT_COMPACT_RATIO', '0.5'))
+SNAPSHOT_COMPACT_MIN_BYTES = int(os.getenv('SNAPSHOT_COMPACT_MIN_BYTES', str(64 * 1024 * 1024)))
+
+
+class SnapshotMissError(requests.exceptions.RequestException):
+    """
+    オフラインモードで、スナップショットにないページを読もうとした
+    """
+
+
+def is_outage(error: requests.exceptions.RequestException) -> bool:
+    """
+    Confluence側の障害・過負荷によるエラーかどうか（404・403などページ自体の問題は含めない）
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status == 429 or status >= 500
+    return True
+
+
+class _ProcessLock:
+    """
+    同じディレクトリを使う複数プロセス（gunicornのワーカーなど）とスレッドの間で排他するロック
+    （POSIXは fcntl.flock、Windowsは msvcrt.locking でロックファイルをロックする）
+    """
+    def __init__(self, path: str):
+        self._file = open(path, 'a+b')
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._file.seek(0)
+                    while True:
+                        try:
+                            # LK_LOCK は約10秒でタイムアウトするため、取れるまで繰り返す
+                            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue
+            except BaseException:
+                self._depth -= 1
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._lock.release()
+
+
+class SnapshotStore:
+    """
+    取得済みページの本文を保存するローカルのスナップショット
+
+    - 本文は追記専用のセグメントファイルに書き、ID → (位置, 長さ, バージョン) の索引と本文以外の項目はSQLiteに保存する
+    - 本文は mmap したセグメントから読み出す（バイト列にコピーせず、memoryview から直接文字列にデコードする）
+    - 同じページの新しいバージョンを書くと古い本文は無効になり、一定の割合を超えたら次の世代のセグメントに詰め直す
+    - v1 / v2 APIでページデータの形式が異なるため、kind（'v1' / 'v2'）ごとに保存する
+    - 複数プロセスで同じディレクトリを共有できる。追記・詰め直し・読み出しはロックファイルで排他し、
+      追記位置はファイルの実際の末尾、使用中のセグメントの世代はSQLiteの索引から毎回読む
+    """
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = _ProcessLock(os.path.join(directory, 'lock'))
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                kind TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                page TEXT NOT NULL,
+                stored REAL NOT NULL,
+                PRIMARY KEY (kind, page_id)
+            );
+        ''')
+        self._segment = None
+        self._map = None
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+            self._conn.commit()
+            self._sync_generation()
+            self._remove_stale_segments()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _segment_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'segment-{generation}.dat')
+
+    def _remove_stale_segments(self) -> None:
+        # 詰め直しの途中で止まった場合・他のプロセスが開いていて消せなかった場合などに残った、
+        # 現在の世代以外のセグメントを消す（ロック中に呼ぶため、他のプロセスの詰め直しとは重ならない）
+        current = os.path.basename(self._segment_path(self._generation))
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.dat') and name != current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Windowsでは他のプロセスが開いているファイルは消せないため、次の機会に消す
+                    pass
+
+    def _sync_generation(self) -> None:
+        # 他のプロセスが詰め直した場合は、新しい世代のセグメントを開き直す（ロック中に呼ぶ）
+        generation = int(self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+        if self._segment is not None and generation == self._generation:
+            return
+        self._close_map()
+        if self._segment is not None:
+            self._segment.close()
+        self._generation = generation
+        self._segment = open(self._segment_path(generation), 'a+b')
+
+    @property
+    def _size(self) -> int:
+        # 他のプロセスも追記するため、プロセス内で数えた大きさではなくファイルの実際の末尾を使う
+        return self._segment.seek(0, os.SEEK_END)
+
+    def _view(self, offset: int, length: int) -> memoryview:
+        if length == 0:
+            # 空のファイルは mmap できないため、空の本文は mmap を使わずに返す
+            return memoryview(b'')
+        # 追記でファイルが伸びた場合は、読み出す範囲を含むよう mmap し直す
+        if self._map is None or offset + length > len(self._map):
+            self._close_map()
+            self._map = mmap.mmap(self._segment.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def _close_map(self) -> None:
+        # body_view の戻り値が使われている間は閉じられないため、参照がなくなった時点で解放されるよう手放す
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+    def put(self, kind: str, page: Dict) -> bool:
+        """
+        本文付きのページデータを保存する（保存済みのバージョン以下の場合は本文を書かない）
+        戻り値: 本文を書き込んだかどうか
+        """
+        storage = (page.get('body') or {}).get('storage') or {}
+        body = storage.get('value')
+        page_id = page.get('id')
+        if body is None or not page_id:
+            return False
+        version = (page.get('version') or {}).get('number') or 0
+        # 本文以外の項目（ページ情報・version・子ページなど）はJSONで索引に持つ
+        meta = dict(page, body=dict(page['body'], storage={k: v for k, v in storage.items() if k != 'value'}))
+        with self._lock:
+            self._sync_generation()
+            row = self._conn.execute('SELECT version FROM snapshots WHERE kind = ? AND page_id = ?',
+                                     (kind, page_id)).fetchone()
+            if row is not None and row[0] >= version:
+                self._conn.execute('UPDATE snapshots SET stored = ? WHERE kind = ? AND page_id = ?',
+                                   (time.time(), kind, page_id))
+                self._conn.commit()
+                return False
+            data = body.encode('utf-8')
+            offset = self._size
+            self._segment.write(data)
+            self._segment.flush()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO snapshots (kind, page_id, version, offset, length, page, stored) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, page_id, version, offset, len(data), json.dumps(meta, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+            self.writes += 1
+            self._compact_if_needed()
+        return True
+
+    def body_view(self, kind: str, page_id: str) -> Optional[memoryview]:
+        """
+        本文のUTF-8バイト列を mmap 上の memoryview で返す（コピーしない。次の詰め直しまで有効）
+        """
+        with self._lock:
+            self._sync_generation()
+            row = self._conn.execute('SELECT offset, length FROM snapshots WHERE kind = ? AND page_id = ?',
+                                     (kind, page_id)).fetchone()
+            if row is None:
+                return None
+            return self._view(*row)
+
+    def get(self, kind: str, page_id: str) -> Optional[Dict]:
+        """
+        保存したページデータ（本文付き）を返す。'_snapshot' に保存時刻とバージョンを付ける
+        """
+        with self._lock:
+            self._sync_generation()
+            row = self._conn.execute(
+                'SELECT version, offset, length, page, stored FROM snapshots WHERE kind = ? AND page_id = ?',
+                (kind, page_id)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            version, offset, length, meta, stored = row
+            body = str(self._view(offset, length), 'utf-8')
+            self.hits += 1
+        page = json.loads(meta)
+        page['body']['storage']['value'] = body
+        page['_snapshot'] = {
+            'kind': kind,
+            'version': version,
+            'stored_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(stored))
+        }
+        return page
+
+    def _compact_if_needed(self) -> None:
+        live = self._conn.execute('SELECT COALESCE(SUM(length), 0) FROM snapshots').fetchone()[0]
+        if self._size >= SNAPSHOT_COMPACT_MIN_BYTES and self._size - live > self._size * SNAPSHOT_COMPACT_RATIO:
+            self._compact()
+
+    def compact(self) -> Dict:
+        with self._lock:
+            self._sync_generation()
+            return self._compact()
+
+    def _compact(self) -> Dict:
+        """
+        有効な本文だけを次の世代のセグメントに書き写す（索引を更新してから古いセグメントを消すため、
+        途中で止まっても前の世代のまま読める）
+        """
+        before = self._size
+        generation = self._generation + 1
+        rows = self._conn.execute('SELECT kind, page_id, offset, length FROM snapshots ORDER BY offset').fetchall()
+        moved = []
+        offset = 0
+        with open(self._segment_path(generation), 'wb') as output:
+            for kind, page_id, old_offset, length in rows:
+                output.write(self._view(old_offset, length))
+                moved.append((offset, kind, page_id))
+                offset += length
+            output.flush()
+            os.fsync(output.fileno())
+        self._conn.executemany('UPDATE snapshots SET offset = ? WHERE kind = ? AND page_id = ?', moved)
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(generation),))
+        self._conn.commit()
+        self._sync_generation()
+        # 他のプロセスは次にロックを取った時点で新しい世代に切り替える（開いたままで消せない場合は次の起動時に消す）
+        self._remove_stale_segments()
+        print(f"[DEBUG] スナップショットを詰め直しました: {before}バイト → {self._size}バイト（世代={generation}）")
+        return {'before': before, 'after': self._size, 'generation': generation}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._sync_generation()
+            count, live = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(length), 0) FROM snapshots').fetchone()
+            return {
+                'pages': count,
+                'segment_bytes': self._size,
+                'live_bytes': live,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes
+            }
+
+
+_snapshot_store = None
+_snapshot_store_lock = threading.Lock()
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """
+    プロセス内で共有するスナップショットを返す
+    """
+    global _snapshot_store
+    with _snapshot_store_lock:
+        if _snapshot_store is None:
+            _snapshot_store = SnapshotStore()
+        return _snapshot_store
+
+
+def main():
+    """
+    スナップショットの状態の表示・詰め直し
+    例: python -m confluence.snapshot_store --compact
+    """
+    parser = argparse.ArgumentParser(description='ページのスナップショットの管理')
+    parser.add_argument('--compact', action='store_true', help='古いバージョンの本文を取り除いてセグメントを詰め直す')
+    args = parser.parse_args()
+
+    store = get_snapshot_store()
+    if args.compact:
+        print(store.compact())
+    print(store.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Confluenceのストレージ形式（XHTML + ac: / ri: 要素）から翻訳対象の段落を1回の走査で取り出し、
+# 訳文を埋め込んだ文書を組み立て直す（BeautifulSoupでの木構造の構築・再シリアライズを行わない）
+
+# コメント・CDATA・タグのいずれかに一致するトークン（タグ以外の部分はテキスト）
+_TOKEN = re.compile(
+    r'<!--.*?-->'
+    r'|<!\[CDATA\[(?P<cdata>.*?)\]\]>'
+    r'|<(?P<close>/?)(?P<name>[A-Za-z][\w:.-]*)(?:[^>"\']|"[^"]*"|\'[^\']*\')*?(?P<selfclose>/?)>',
+    re.S
+)
+_SPACES = re.compile(r'\s+')
+# 翻訳APIに送る原文でインライン要素を表すプレースホルダー（<g1>...</g1> は中にテキストを持つ要素、
+# <x2/> はリンク・画像・改行などテキストを持たない要素全体）
+_PLACEHOLDER = re.compile(r'<(/?)([gx]\d+)(/?)>')
+
+# 段落の途中に現れても段落を区切らない要素（それ以外の要素は段落の境界になる）
+INLINE_ELEMENTS = frozenset({
+    'a', 'abbr', 'b', 'big', 'br', 'cite', 'code', 'del', 'em', 'font', 'i', 'ins', 'kbd', 'mark',
+    'q', 's', 'samp', 'small', 'span', 'strike', 'strong', 'sub', 'sup', 'time', 'u', 'var',
+    'ac:emoticon', 'ac:image', 'ac:inline-comment-marker', 'ac:link', 'ac:link-body',
+    'ac:plain-text-link-body', 'ac:placeholder'
+})
+# 中身を翻訳しない要素（コードマクロの本文・マクロのパラメーター・整形済みテキストなど）
+OPAQUE_ELEMENTS = frozenset({
+    'ac:plain-text-body', 'ac:parameter', 'pre', 'script', 'style'
+})
+
+
+class Segment:
+    """
+    翻訳対象の段落（正規化した原文と、文書内の置き換え範囲）
+
+    text はタグを除いたテキスト（検索・表示用）、source は翻訳APIに送る原文で、インライン要素を
+    プレースホルダーに置き換えたもの（tags にプレースホルダー → 元のタグを持つ）。
+    訳文のプレースホルダーが揃っていれば span（段落全体）を訳文とタグで置き換える。
+    インライン要素がない・開始と終了のタグが揃っていない・訳文のプレースホルダーが欠けた場合は
+    edits（テキスト部分の範囲のリスト）の最初の範囲に訳文を入れ、残りの範囲は空にしてタグを残す。
+    """
+    __slots__ = ('text', 'edits', 'source', 'span', 'tags')
+
+    def __init__(self, text: str, edits: List[Tuple[int, int]], source: Optional[str] = None,
+                 span: Optional[Tuple[int, int]] = None, tags: Optional[Dict[str, str]] = None):
+        self.text = text
+        self.edits = edits
+        self.source = source if source is not None else text
+        self.span = span
+        self.tags = tags or {}
+
+
+def _is_inline(name: str) -> bool:
+    return name in INLINE_ELEMENTS or name.startswith('ri:')
+
+
+def extract_segments(xhtml: str) -> List[Segment]:
+    """
+    ストレージ形式の文書から翻訳対象の段落を文書順に返す
+    段落はブロック要素の境界で区切ったテキストとインライン要素の連なりで、入れ子のブロック要素の
+    テキストが親の段落にも重複して含まれることはない
+    """
+    segments: List[Segment] = []
+    # 現在の段落: 範囲・テキスト・テキストトークンの位置・インライン要素の入れ子の深さ
+    run_start: Optional[int] = None
+    run_end = 0
+    parts: List[str] = []
+    text_spans: List[Tuple[int, int]] = []
+    depth = 0
+    balanced = True
+    has_text = False
+    # 翻訳APIに送る原文の部品: ['text', テキスト] / ['open', タグ] / ['close', タグ, 対応する'open'の位置] / ['atom', タグ]
+    items: List[list] = []
+    # 開いているインライン要素: (要素名, items内の位置, 開始タグの位置, その時点のテキストトークン数)
+    stack: List[Tuple[str, int, int, int]] = []
+    text_count = 0
+    # 翻訳しない要素の中にいる間は、その要素名と入れ子の深さ
+    opaque: Optional[str] = None
+    opaque_depth = 0
+
+    def flush():
+        nonlocal run_start, parts, text_spans, depth, balanced, has_text, items, stack, text_count
+        if run_start is not None and has_text:
+            text = _SPACES.sub(' ', ''.join(parts)).strip()
+            if text:
+                segment = Segment(text, text_spans)
+                if balanced and depth == 0 and any(item[0] != 'text' for item in items):
+                    segment.source, segment.tags = _to_placeholders(items)
+                    segment.span = (run_start, run_end)
+                segments.append(segment)
+        run_start = None
+        parts = []
+        text_spans = []
+        depth = 0
+        balanced = True
+        has_text = False
+        items = []
+        stack = []
+        text_count = 0
+
+    def add_text(start: int, end: int, raw: str):
+        nonlocal run_start, run_end, has_text, text_count
+        if run_start is None:
+            run_start = start
+        run_end = end
+        if raw.strip():
+            has_text = True
+            text_count += 1
+        text = html.unescape(raw) if '&' in raw else raw
+        parts.append(text)
+        items.append(['text', text])
+        text_spans.append((start, end))
+
+    pos = 0
+    for match in _TOKEN.finditer(xhtml):
+        start, end = match.span()
+        name = match.group('name')
+        if opaque is not None:
+            if name == opaque and not match.group('selfclose'):
+                opaque_depth += -1 if match.group('close') else 1
+                if opaque_depth == 0:
+                    opaque = None
+            pos = end
+            continue
+        if start > pos:
+            raw = xhtml[pos:start]
+            if run_start is not None or raw.strip():
+                # 段落の先頭の空白は置き換え範囲に含めない
+                offset = len(raw) - len(raw.lstrip()) if run_start is None else 0
+                add_text(pos + offset, start, raw[offset:])
+        pos = end
+        if name is None:
+            cdata = match.group('cdata')
+            if cdata is not None:
+                # ac:plain-text-link-body などのCDATAはリンク文字列として段落の原文に含める
+                # （リンクだけの段落はページ名などのため翻訳しない。翻訳APIにはリンク全体を1つのプレースホルダーで送る）
+                if run_start is None:
+                    run_start = start
+                run_end = end
+                parts.append(cdata)
+                items.append(['atom', match.group()])
+            continue
+        lowered = name.lower()
+        if _is_inline(lowered):
+            if run_start is None:
+                run_start = start
+            run_end = end
+            if lowered == 'br':
+                parts.append(' ')
+                items.append(['atom', match.group()])
+            elif match.group('selfclose'):
+                items.append(['atom', match.group()])
+            elif match.group('close'):
+                depth -= 1
+                if depth < 0 or not stack or stack[-1][0] != lowered:
+                    balanced = False
+                    continue
+                _, index, open_start, count = stack.pop()
+                if count == text_count:
+                    # テキストを持たない要素（画像・リンク文字列がCDATAのリンクなど）は要素全体を1つにまとめる
+                    del items[index:]
+                    items.append(['atom', xhtml[open_start:end]])
+                else:
+                    items.append(['close', match.group(), index])
+            else:
+                depth += 1
+                stack.append((lowered, len(items), start, text_count))
+                items.append(['open', match.group()])
+            continue
+        # ブロック要素の境界で段落を区切る
+        flush()
+        if lowered in OPAQUE_ELEMENTS and not match.group('close') and not match.group('selfclose'):
+            opaque = name
+            opaque_depth = 1
+    if opaque is None and pos < len(xhtml):
+        raw = xhtml[pos:]
+        if run_start is not None or raw.strip():
+            offset = len(raw) - len(raw.lstrip()) if run_start is None else 0
+            add_text(pos + offset, len(xhtml), raw[offset:])
+    flush()
+    # 段落末尾の空白は置き換え範囲に含めない
+    for segment in segments:
+        start, end = segment.edits[-1]
+        segment.edits[-1] = (start, start + len(xhtml[start:end].rstrip()))
+        if segment.span is not None:
+            start, end = segment.span
+            segment.span = (start, start + len(xhtml[start:end].rstrip()))
+    return segments
+
+
+def _to_placeholders(items: List[list]) -> Tuple[str, Dict[str, str]]:
+    """
+    段落の部品から、インライン要素をプレースホルダーにした原文と プレースホルダー → 元のタグ を返す
+    """
+    pieces = []
+    tags: Dict[str, str] = {}
+    names: Dict[int, str] = {}
+    for index, item in enumerate(items):
+        kind = item[0]
+        if kind == 'text':
+            pieces.append(item[1])
+        elif kind == 'open':
+            names[index] = f'g{len(names) + 1}'
+            tags[names[index]] = item[1]
+            pieces.append(f'<{names[index]}>')
+        elif kind == 'close':
+            tags['/' + names[item[2]]] = item[1]
+            pieces.append(f'</{names[item[2]]}>')
+        else:
+            names[index] = f'x{len(names) + 1}'
+            tags[names[index]] = item[1]
+            pieces.append(f'<{names[index]}/>')
+    return _SPACES.sub(' ', ''.join(pieces)).strip(), tags
+
+
+def _restore_placeholders(translated: str, tags: Dict[str, str]) -> Optional[str]:
+    """
+    訳文のプレースホルダーを元のタグに戻したマークアップを返す（テキスト部分はエスケープする）
+    すべてのプレースホルダーがちょうど1回ずつ、正しい入れ子で現れない場合はNone
+    """
+    pieces = []
+    seen = set()
+    stack = []
+    pos = 0
+    for match in _PLACEHOLDER.finditer(translated):
+        close, name, selfclose = match.groups()
+        key = '/' + name if close else name
+        if key in seen or key not in tags or (name[0] == 'x') != (bool(selfclose) and not close):
+            return None
+        if name[0] == 'g':
+            if close:
+                if not stack or stack.pop() != name:
+                    return None
+            else:
+                stack.append(name)
+        seen.add(key)
+        pieces.append(html.escape(translated[pos:match.start()], quote=False))
+        pieces.append(tags[key])
+        pos = match.end()
+    if stack or len(seen) != len(tags):
+        return None
+    pieces.append(html.escape(translated[pos:], quote=False))
+    return ''.join(pieces)
+
+
+def placeholders_match(source: str, translated: str) -> bool:
+    """
+    訳文が原文のプレースホルダーをすべて、ちょうど1回ずつ正しい入れ子で含むかどうか（順序の入れ替えは可）
+    """
+    tags = {('/' if close else '') + name: '' for close, name, _ in _PLACEHOLDER.findall(source)}
+    return _restore_placeholders(translated, tags) is not None
+
+
+def strip_placeholders(text: str) -> str:
+    """
+    プレースホルダーを取り除いたテキストを返す（途中経過の表示や、タグを残して訳文を入れる場合に使う）
+    """
+    return _SPACES.sub(' ', _PLACEHOLDER.sub('', text)).strip()
+
+
+def apply_translations(xhtml: str, segments: List[Segment], translations: Dict[int, str]) -> str:
+    """
+    段落番号 → 訳文 に従って訳文を埋め込んだ文書を返す（訳文のない段落は原文のまま）
+    訳文は Segment.source と同じプレースホルダーを含むものとし、元のインライン要素のタグに戻して埋め込む
+    """
+    pieces = []
+    pos = 0
+    for index, segment in enumerate(segments):
+        translated = translations.get(index)
+        if translated is None:
+            continue
+        if segment.tags:
+            markup = _restore_placeholders(translated, segment.tags)
+            if markup is not None:
+                start, end = segment.span
+                pieces.append(xhtml[pos:start])
+                pieces.append(markup)
+                pos = end
+                continue
+            # プレースホルダーが欠けた訳文はテキスト部分に入れ、インライン要素のタグはそのまま残す
+            translated = strip_placeholders(translated)
+        for i, (start, end) in enumerate(segment.edits):
+            pieces.append(xhtml[pos:start])
+            if i == 0:
+                pieces.append(html.escape(translated, quote=False))
+            pos = end
+    pieces.append(xhtml[pos:])
+    return ''.join(pieces)
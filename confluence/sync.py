@@ -0,0 +1,263 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+from confluence.records import PageRecord
+from confluence.utils import cql_quote
+
+# 同期先DBと、本文取得の並列数・ウォーターマークの重なり（時間）
+SYNC_DB_PATH = os.getenv('SYNC_DB_PATH', 'cache/space_sync.sqlite3')
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '8'))
+# CQLの lastmodified はConfluence側ユーザーのタイムゾーンで解釈されるため、前回同期時刻より余裕を持って遡る
+SYNC_WATERMARK_OVERLAP_HOURS = int(os.getenv('SYNC_WATERMARK_OVERLAP_HOURS', '24'))
+# 取得した本文をこの件数ごとにコミットする（途中で止まっても取得済みのページはやり直さない）
+SYNC_COMMIT_BATCH = int(os.getenv('SYNC_COMMIT_BATCH', '100'))
+
+
+class SpaceSync:
+    """
+    スペースのローカルコピー（SQLite）を差分同期するクラス
+
+    - 前回同期以降に更新されたページのみをCQL（lastmodified >= ウォーターマーク）で検索
+    - ローカルのマニフェストと version.number を比較し、バージョンが進んだページのみ本文を再取得
+    - v2 APIのページ一覧（本文なし）と突き合わせて削除されたページと、バージョンが変わらずに移動したページを検出
+    """
+    def __init__(self, confluence, space_key: str, db_path: str = SYNC_DB_PATH,
+                 concurrency: int = SYNC_CONCURRENCY, search_index=None, tree_index=None):
+        self.confluence = confluence
+        self.space_key = space_key
+        self.concurrency = concurrency
+        # search_index（confluence.search_index.SearchIndex）を渡すと、更新・削除されたページを検索インデックスにも反映する
+        self.search_index = search_index
+        # tree_index（confluence.tree_index.TreeIndex）を渡すと、ページの親子関係をツリーインデックスにも反映する
+        self.tree_index = tree_index
+        self._space_id = None
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                space_key TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                title TEXT,
+                parent_id TEXT,
+                updated TEXT,
+                body TEXT,
+                synced REAL NOT NULL,
+                PRIMARY KEY (space_key, page_id)
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                space_key TEXT PRIMARY KEY,
+                space_id TEXT,
+                watermark TEXT
+            )
+        ''')
+        self._conn.commit()
+
+    def _manifest(self) -> Dict[str, int]:
+        rows = self._conn.execute(
+            'SELECT page_id, version FROM pages WHERE space_key = ?', (self.space_key,)
+        ).fetchall()
+        return dict(rows)
+
+    def _parents(self) -> Dict[str, Optional[str]]:
+        rows = self._conn.execute(
+            'SELECT page_id, parent_id FROM pages WHERE space_key = ?', (self.space_key,)
+        ).fetchall()
+        return dict(rows)
+
+    def _state(self) -> Optional[tuple]:
+        return self._conn.execute(
+            'SELECT space_id, watermark FROM sync_state WHERE space_key = ?', (self.space_key,)
+        ).fetchone()
+
+    def _modified_since(self, watermark: str) -> Iterator[PageRecord]:
+        """
+        CQLで前回同期以降に更新されたページを検索（バージョン番号のみ取得）
+        """
+        cql = f'space = {cql_quote(self.space_key)} AND type = page AND lastmodified >= "{watermark}"'
+        start = 0
+        while True:
+            data = self.confluence.search_content('', cql=cql, limit=100, start=start, expand='version')
+            results = data.get('results', [])
+            for page in results:
+                yield PageRecord(page.get('id'), version=page.get('version', {}).get('number'))
+            if not results or not data.get('_links', {}).get('next'):
+                break
+            start += len(results)
+
+    def records(self) -> Iterator[PageRecord]:
+        """
+        ローカルコピーのページをレコードで返す（本文は body を参照した時点でDBから読み込む）
+        """
+        rows = self._conn.execute(
+            'SELECT page_id, version, title, parent_id, updated FROM pages WHERE space_key = ?', (self.space_key,)
+        ).fetchall()
+        for page_id, version, title, parent_id, updated in rows:
+            record = PageRecord(page_id, title=title, parent_id=parent_id, version=version, updated=updated)
+            record.set_body_loader(self._load_body, page_id)
+            yield record
+
+    def _load_body(self, page_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body FROM pages WHERE space_key = ? AND page_id = ?', (self.space_key, page_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, page: Dict) -> None:
+        version = page.get('version') or {}
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages '
+                '(space_key, page_id, version, title, parent_id, updated, body, synced) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.space_key, page.get('id'), version.get('number') or 0, page.get('title'),
+                 page.get('parentId'), version.get('createdAt'),
+                 page.get('body', {}).get('storage', {}).get('value', ''), time.time())
+            )
+
+    def _fetch_and_store(self, page_id: str) -> None:
+        page = self.confluence.get_page_v2(page_id)
+        self._store(page)
+        if self.search_index is not None:
+            self.search_index.index_page(page)
+        if self.tree_index is not None:
+            self.tree_index.upsert_pages(self._space_id, [page])
+
+    def run(self, full: bool = False, detect_deletions: bool = True) -> Dict:
+        """
+        同期を実行し、確認件数・更新件数・削除件数などを返す
+        full=True または初回は、スペース内の全ページのバージョンを確認する
+        """
+        started = time.monotonic()
+        sync_started = datetime.now(timezone.utc)
+        state = self._state()
+        space_id = state[0] if state else None
+        if not space_id:
+            space_id = self.confluence.get_space_id_by_key_v2(self.space_key)
+            if not space_id:
+                raise ValueError(f"スペースが見つかりません: {self.space_key}")
+        self._space_id = space_id
+        watermark = None if full or not state else state[1]
+        manifest = self._manifest()
+
+        listing = None
+        if watermark is None or detect_deletions:
+            # v2のページ一覧は本文を含まないため、全件でもリクエスト数・転送量は小さい
+            # （一覧のJSONは1リクエスト分ずつレコードに変換し、全件分のJSONを保持しない）
+            listing = [PageRecord.from_v2(page) for page in self.confluence.iter_all_pages_in_space_v2(space_id)]
+        candidates = listing if watermark is None else list(self._modified_since(watermark))
+        if watermark is not None and listing is not None:
+            # 他スペースから移動してきたページなど、CQLで拾えない未取得ページも対象にする
+            seen = {page.id for page in candidates}
+            candidates.extend(page for page in listing if page.id not in manifest and page.id not in seen)
+
+        changed = [page.id for page in candidates
+                   if page.id and (page.id not in manifest or (page.version or 0) > manifest[page.id])]
+        added = sum(1 for page_id in changed if page_id not in manifest)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for start in range(0, len(changed), SYNC_COMMIT_BATCH):
+                list(executor.map(self._fetch_and_store, changed[start:start + SYNC_COMMIT_BATCH]))
+                with self._lock:
+                    self._conn.commit()
+
+        deleted: List[str] = []
+        moved: List[PageRecord] = []
+        if listing is not None:
+            # 移動ではバージョンが上がらないため、一覧の parentId とローカルの親を比べて親子関係だけを更新する
+            parents = self._parents()
+            fetched = set(changed)
+            moved = [page for page in listing
+                     if page.id in parents and page.id not in fetched and page.parent_id != parents[page.id]]
+            self._conn.executemany(
+                'UPDATE pages SET parent_id = ? WHERE space_key = ? AND page_id = ?',
+                [(page.parent_id, self.space_key, page.id) for page in moved]
+            )
+            if self.tree_index is not None and moved:
+                self.tree_index.upsert_pages(space_id, moved)
+
+            alive = {page.id for page in listing}
+            deleted = [page_id for page_id in manifest if page_id not in alive]
+            self._conn.executemany(
+                'DELETE FROM pages WHERE space_key = ? AND page_id = ?',
+                [(self.space_key, page_id) for page_id in deleted]
+            )
+            if self.search_index is not None:
+                for page_id in deleted:
+                    self.search_index.remove(page_id)
+            if self.tree_index is not None:
+                self.tree_index.remove_pages(space_id, deleted)
+
+        new_watermark = (sync_started - timedelta(hours=SYNC_WATERMARK_OVERLAP_HOURS)).strftime('%Y/%m/%d %H:%M')
+        self._conn.execute(
+            'INSERT OR REPLACE INTO sync_state (space_key, space_id, watermark) VALUES (?, ?, ?)',
+            (self.space_key, space_id, new_watermark)
+        )
+        self._conn.commit()
+        result = {
+            'space_key': self.space_key,
+            'mode': 'full' if watermark is None else 'incremental',
+            'checked': len(candidates),
+            'updated': len(changed) - added,
+            'added': added,
+            'deleted': len(deleted),
+            'moved': len(moved),
+            'unchanged': len(candidates) - len(changed),
+            'watermark': new_watermark,
+            'elapsed': round(time.monotonic() - started, 3)
+        }
+        print(f"[DEBUG] 同期結果: {result}")
+        return result
+
+
+def main():
+    """
+    コマンドラインからスペースを差分同期
+    例: python -m confluence.sync DEMO [--full] [--no-deletions]
+    """
+    from dotenv import load_dotenv
+    from confluence.api_client import ConfluenceAPI
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Confluenceスペースをローカルに差分同期')
+    parser.add_argument('space_key')
+    parser.add_argument('--db', default=SYNC_DB_PATH)
+    parser.add_argument('--full', action='store_true', help='全ページのバージョンを確認する')
+    parser.add_argument('--no-deletions', action='store_true', help='削除されたページの検出を行わない')
+    parser.add_argument('--index', action='store_true', help='取得したページを全文検索インデックスにも反映する')
+    parser.add_argument('--tree', action='store_true', help='ページの親子関係をツリーインデックスにも反映する')
+    args = parser.parse_args()
+
+    confluence = ConfluenceAPI(
+        os.getenv('CONFLUENCE_BASE_URL', ''),
+        os.getenv('CONFLUENCE_USERNAME', ''),
+        os.getenv('CONFLUENCE_API_TOKEN', '')
+    )
+    search_index = None
+    if args.index:
+        from confluence.search_index import get_search_index
+        search_index = get_search_index()
+    tree_index = None
+    if args.tree:
+        from confluence.tree_index import get_tree_index
+        tree_index = get_tree_index()
+    result = SpaceSync(confluence, args.space_key, db_path=args.db, search_index=search_index,
+                       tree_index=tree_index).run(
+        full=args.full, detect_deletions=not args.no_deletions)
+    print(f"✅ {result['space_key']}: 更新{result['updated']}件 / 追加{result['added']}件 / "
+          f"削除{result['deleted']}件（{result['elapsed']}秒）")
+
+
+if __name__ == "__main__":
+    main()
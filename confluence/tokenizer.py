@@ -0,0 +1,136 @@
+import math
+import os
+import threading
+from typing import Iterable, List
+
+import requests
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken がない環境では文字種から概算する（requirements.txt には含めている）
+    tiktoken = None
+
+# tiktokenのエンコーディング名（gpt-4o 系は o200k_base、gpt-4 / gpt-35-turbo は cl100k_base）
+# 語彙ファイルは初回にダウンロードし、TIKTOKEN_CACHE_DIR に保存する（未指定なら cache/tiktoken。
+# tiktoken 既定の一時ディレクトリは再起動などで消えるため、アプリのキャッシュと同じ場所に固定する）。
+# インターネットに接続できないサーバーでは、接続できる環境で
+#   TIKTOKEN_CACHE_DIR=cache/tiktoken python -c "import tiktoken; tiktoken.get_encoding('o200k_base')"
+# を実行し、作成された cache/tiktoken の中身をサーバーの同じ場所にコピーしておく
+# （読み込めない場合は文字種からの概算になり、ブロックが max_tokens を超えやすくなるため、起動後最初の計数時に警告を出す。
+#  tokenizer_name() でも確認できる）
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')
+TIKTOKEN_CACHE_DIR = os.getenv('TIKTOKEN_CACHE_DIR', 'cache/tiktoken')
+# 1リクエストの出力上限（max_tokens）とモデルのコンテキスト長
+TRANSLATION_MAX_OUTPUT_TOKENS = int(os.getenv('TRANSLATION_MAX_OUTPUT_TOKENS', '4096'))
+TRANSLATION_CONTEXT_TOKENS = int(os.getenv('TRANSLATION_CONTEXT_TOKENS', '128000'))
+# 英→日の出力/入力トークン比の初期値（実測値の指数移動平均で更新）と、出力見積もりに掛ける余裕
+TRANSLATION_EXPANSION_RATIO = float(os.getenv('TRANSLATION_EXPANSION_RATIO', '1.5'))
+TRANSLATION_OUTPUT_MARGIN = float(os.getenv('TRANSLATION_OUTPUT_MARGIN', '1.25'))
+
+# システムプロンプトやメッセージの区切りなど、本文以外に消費するトークン数の見込み
+PROMPT_OVERHEAD_TOKENS = 64
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            if tiktoken is None:
+                print("[警告] tiktokenがインストールされていないため、トークン数を文字種から概算します"
+                      "（翻訳ブロックが max_tokens を超えやすくなります）")
+                return None
+            # tiktoken は読み込みのたびに環境変数 TIKTOKEN_CACHE_DIR を見るため、ここで保存先を固定する
+            os.environ.setdefault('TIKTOKEN_CACHE_DIR', TIKTOKEN_CACHE_DIR)
+            try:
+                os.makedirs(os.environ['TIKTOKEN_CACHE_DIR'], exist_ok=True)
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except (ValueError, OSError, requests.RequestException) as e:
+                # 語彙ファイルがダウンロードできない・キャッシュが壊れている（ハッシュ不一致）・未知のエンコーディングなど
+                print(f"[警告] tiktokenのエンコーディング {TOKENIZER_ENCODING} を読み込めないため、トークン数を文字種から"
+                      f"概算します（語彙ファイルを {os.environ['TIKTOKEN_CACHE_DIR']} に置いてください）: {e}")
+        return _encoding
+
+
+def tokenizer_name() -> str:
+    return f"tiktoken:{TOKENIZER_ENCODING}" if _get_encoding() is not None else 'heuristic'
+
+
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数を返す（tiktokenがなければ文字種から概算）
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 英数字・記号は約4文字で1トークン、日本語などASCII以外は1文字で約1トークン
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return max(1, math.ceil(ascii_chars / 4) + (len(text) - ascii_chars))
+
+
+class ExpansionRatio:
+    """
+    訳文/原文のトークン数の比を実測値の指数移動平均で保持する（出力トークン数の見積もりに使う）
+    """
+    def __init__(self, initial: float = TRANSLATION_EXPANSION_RATIO, alpha: float = 0.2):
+        self.value = initial
+        self.alpha = alpha
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def update(self, source_tokens: int, output_tokens: int) -> None:
+        if source_tokens <= 0 or output_tokens <= 0:
+            return
+        with self._lock:
+            self.value += self.alpha * (output_tokens / source_tokens - self.value)
+            self.samples += 1
+
+
+_expansion = ExpansionRatio()
+
+
+def get_expansion_ratio() -> ExpansionRatio:
+    return _expansion
+
+
+def output_tokens_for(source_tokens: int) -> int:
+    """
+    原文のトークン数から、訳文に必要な max_tokens を見積もる
+    """
+    estimate = math.ceil(source_tokens * _expansion.value * TRANSLATION_OUTPUT_MARGIN) + 16
+    return min(TRANSLATION_MAX_OUTPUT_TOKENS, estimate)
+
+
+def input_budget() -> int:
+    """
+    1ブロックに詰め込める原文のトークン数（出力が max_tokens に収まる範囲で最大）
+    """
+    by_output = int((TRANSLATION_MAX_OUTPUT_TOKENS - 16) / (_expansion.value * TRANSLATION_OUTPUT_MARGIN))
+    by_context = TRANSLATION_CONTEXT_TOKENS - TRANSLATION_MAX_OUTPUT_TOKENS - PROMPT_OVERHEAD_TOKENS
+    return max(1, min(by_output, by_context))
+
+
+def pack_blocks(texts: Iterable[str], item_overhead: int = 1) -> List[List[str]]:
+    """
+    段落を順に、1ブロックの原文トークン数が input_budget() を超えないようにまとめる
+    （段落ごとの区切り・構造に item_overhead トークンを加えて数える。上限を超える段落は単独のブロックにする）
+    """
+    budget = input_budget()
+    blocks = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text) + item_overhead
+        if current and current_tokens + tokens > budget:
+            blocks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        blocks.append(current)
+    return blocks
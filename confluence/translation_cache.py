@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+# 翻訳結果キャッシュの保存先と上限（.env で上書き可能）
+TRANSLATION_CACHE_PATH = os.getenv('TRANSLATION_CACHE_PATH', 'cache/translation_cache.sqlite3')
+TRANSLATION_CACHE_MAX_BYTES = int(os.getenv('TRANSLATION_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+TRANSLATION_CACHE_MAX_ENTRIES = int(os.getenv('TRANSLATION_CACHE_MAX_ENTRIES', '10000'))
+
+
+def hash_body(body: str) -> str:
+    """
+    本文（storage形式）のハッシュ値を返す
+    """
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+class TranslationCache:
+    """
+    ページ単位の翻訳結果をSQLiteに保存するキャッシュ
+    （キー: ページID + バージョン番号 + 本文ハッシュ、サイズ上限付きLRUで追い出し）
+    """
+    def __init__(self, path: str = TRANSLATION_CACHE_PATH,
+                 max_bytes: int = TRANSLATION_CACHE_MAX_BYTES,
+                 max_entries: int = TRANSLATION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS translations (
+                page_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                body_hash TEXT NOT NULL,
+                translated TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (page_id, version, body_hash)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_translations_last_access ON translations (last_access)')
+        self._conn.commit()
+
+    def get(self, page_id: str, version: Optional[int], body: str) -> Optional[str]:
+        key = (str(page_id), version or 0, hash_body(body))
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT translated FROM translations WHERE page_id = ? AND version = ? AND body_hash = ?',
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE translations SET last_access = ?, hits = hits + 1 '
+                'WHERE page_id = ? AND version = ? AND body_hash = ?',
+                (time.time(),) + key
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, page_id: str, version: Optional[int], body: str, translated: str) -> None:
+        now = time.time()
+        size = len(translated.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO translations '
+                '(page_id, version, body_hash, translated, size, created, last_access, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+                (str(page_id), version or 0, hash_body(body), translated, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # 最終アクセスが古いものから、件数・サイズの上限内に収まるまで削除
+        count, total = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations'
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        victims = []
+        for rowid, size in self._conn.execute('SELECT rowid, size FROM translations ORDER BY last_access'):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((rowid,))
+            count -= 1
+            total -= size
+        self._conn.executemany('DELETE FROM translations WHERE rowid = ?', victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations'
+            ).fetchone()
+        return {
+            'entries': count,
+            'bytes': total,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_translation_cache() -> TranslationCache:
+    """
+    プロセス内で共有する翻訳キャッシュを返す
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranslationCache()
+        return _cache
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable
+
+# 翻訳メモリ（段落単位）の保存先と上限（.env で上書き可能）
+TRANSLATION_MEMORY_PATH = os.getenv('TRANSLATION_MEMORY_PATH', 'cache/translation_memory.sqlite3')
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.getenv('TRANSLATION_MEMORY_MAX_ENTRIES', '200000'))
+
+
+def normalize_segment(text: str) -> str:
+    """
+    翻訳メモリのキーにするため、空白を正規化したテキストを返す
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _segment_key(text: str) -> str:
+    return hashlib.sha256(normalize_segment(text).encode('utf-8')).hexdigest()
+
+
+class TranslationMemory:
+    """
+    翻訳対象タグ単位（段落・見出し・セルなど）の原文→訳文をSQLiteに保存する翻訳メモリ
+    """
+    def __init__(self, path: str = TRANSLATION_MEMORY_PATH,
+                 max_entries: int = TRANSLATION_MEMORY_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS segments (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                translated TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_segments_last_access ON segments (last_access)')
+        self._conn.commit()
+
+    def lookup_many(self, texts: Iterable[str]) -> Dict[str, str]:
+        """
+        原文のリストを受け取り、翻訳メモリに存在するもののみ {原文: 訳文} で返す
+        """
+        keys = {}
+        for text in texts:
+            keys.setdefault(_segment_key(text), text)
+        found = {}
+        if not keys:
+            return found
+        key_list = list(keys)
+        with self._lock:
+            # SQLiteのパラメータ数上限を超えないよう分割して検索
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, translated FROM segments WHERE key IN ({placeholders})', chunk
+                ).fetchall()
+                for key, translated in rows:
+                    found[keys[key]] = translated
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE segments SET last_access = ? WHERE key = ?',
+                    [(now, _segment_key(text)) for text in found]
+                )
+                self._conn.commit()
+        return found
+
+    def store_many(self, pairs: Dict[str, str]) -> None:
+        """
+        {原文: 訳文} を翻訳メモリに保存
+        """
+        if not pairs:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO segments (key, source, translated, last_access) VALUES (?, ?, ?, ?)',
+                [(_segment_key(src), normalize_segment(src), ja, now) for src, ja in pairs.items()]
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+            if count > self.max_entries:
+                # 最終アクセスが古いものから削除
+                self._conn.execute(
+                    'DELETE FROM segments WHERE key IN '
+                    '(SELECT key FROM segments ORDER BY last_access LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+        return {'entries': count, 'max_entries': self.max_entries}
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_translation_memory() -> TranslationMemory:
+    """
+    プロセス内で共有する翻訳メモリを返す
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory
@@ -1,16 +1,67 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 import requests
-from bs4 import BeautifulSoup
 from config import OPENAI_API_KEY, AZURE_OPENAI_KEY, AZURE_OPENAI_BASE, DEPLOYMENT_NAME, API_VERSION
+from confluence.governor import get_governor
+from confluence.http_pool import get_session_registry
+from confluence.storage_format import apply_translations, extract_segments, placeholders_match, strip_placeholders
+from confluence.tokenizer import (PROMPT_OVERHEAD_TOKENS, count_tokens, get_expansion_ratio, output_tokens_for,
+                                  pack_blocks, tokenizer_name)
+from confluence.translation_memory import get_translation_memory, normalize_segment
 
-# トークン数の概算（英語1単語≒1トークン、1文字≒0.5トークン程度）
-def estimate_tokens(text):
-    return max(1, int(len(text) / 2))
+# ブロック翻訳の並列数・デプロイのTPM上限（0は無制限）
+# （429時の再試行・バックオフは confluence.governor の設定に従う）
+TRANSLATION_CONCURRENCY = int(os.getenv('TRANSLATION_CONCURRENCY', '4'))
+AZURE_OPENAI_TPM = int(os.getenv('AZURE_OPENAI_TPM', '0'))
+# 訳文が欠けた・不正だった段落のみを再送する回数と、JSONモード（response_format）を使うかどうか
+TRANSLATION_SEGMENT_RETRIES = int(os.getenv('TRANSLATION_SEGMENT_RETRIES', '2'))
+TRANSLATION_JSON_MODE = os.getenv('TRANSLATION_JSON_MODE', '1') == '1'
+# Azure OpenAI 呼び出しに使う共有セッションの名前
+AZURE_OPENAI_SESSION = 'azure_openai'
+
+
+class TokenBudget:
+    """
+    直近60秒間の消費トークン数を記録し、デプロイのTPM上限を超えないように送信を待たせる
+    """
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int) -> None:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    _, used = self._events.popleft()
+                    self._used -= used
+                # 上限なし・予算内・ウィンドウが空（1回で上限を超える大きさ）の場合は即送信
+                if not self.tokens_per_minute or not self._events or self._used + tokens <= self.tokens_per_minute:
+                    self._events.append((now, tokens))
+                    self._used += tokens
+                    return
+                self._cond.wait(timeout=60 - (now - self._events[0][0]))
+
+
+_token_budget = TokenBudget(AZURE_OPENAI_TPM)
 
 # HTMLをできるだけ大きなブロック単位で分割し、まとめて翻訳
 
-def translate_en_to_ja(text: str) -> str:
+def translate_en_to_ja(text: str, stats: Optional[Dict] = None,
+                       progress: Optional[Callable[[str, Dict], None]] = None) -> str:
     """
     Azure OpenAI APIを使って英語→日本語翻訳（大きなブロック単位で分割翻訳し品質向上）
+    翻訳メモリに存在する段落は再翻訳せず、新規・変更された段落のみAPIに送る。
+    stats に辞書を渡すと、翻訳メモリのヒット数・ミス数・失敗したブロック数・トークン使用量などを書き込む。
+    再試行しても翻訳できなかったブロックは原文のまま残し、'block_failed' で通知する。
+    progress を渡すと、段落一覧（'plan'）と各ブロックの翻訳完了（'block'）を呼び出し元スレッドで通知する。
     """
     if not AZURE_OPENAI_KEY or not AZURE_OPENAI_BASE or not DEPLOYMENT_NAME or not API_VERSION:
         print("[DEBUG] Azure OpenAIの設定が不足しています")
@@ -20,51 +71,235 @@ def translate_en_to_ja(text: str) -> str:
         "Content-Type": "application/json",
         "api-key": AZURE_OPENAI_KEY
     }
-    soup = BeautifulSoup(text, "html.parser")
-    translatable_tags = ["p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "td", "th", "span", "div"]
-    blocks = []
-    current_block = []
-    current_len = 0
-    max_tokens = 1800  # APIのmax_tokensより少し余裕を持たせる
-    # 1. 連続するテキストブロックをまとめる
-    for tag in soup.find_all(translatable_tags):
-        t = tag.get_text(strip=True)
-        if t:
-            t_len = estimate_tokens(t)
-            if current_len + t_len > max_tokens and current_block:
-                blocks.append(list(current_block))
-                current_block = []
-                current_len = 0
-            current_block.append(tag)
-            current_len += t_len
-    if current_block:
-        blocks.append(list(current_block))
-    # 2. まとめて翻訳
-    for block in blocks:
-        en_texts = [tag.get_text(strip=True) for tag in block]
-        joined = "\n".join(en_texts)
-        payload = {
-            "messages": [
-                {"role": "system", "content": "You are a professional translator. Translate the following English text to Japanese. Preserve line breaks."},
-                {"role": "user", "content": joined}
-            ],
-            "max_tokens": 2048,
-            "temperature": 0.3
-        }
-        try:
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            ja_joined = result["choices"][0]["message"]["content"].strip()
-            ja_texts = ja_joined.split("\n")
-            # 行数が一致しない場合は無理に詰め込む
-            for tag, ja in zip(block, ja_texts):
-                tag.clear()
-                tag.append(ja)
-        except Exception as e:
-            print(f"[翻訳APIエラー] {e}")
+    # ストレージ形式を1回走査して段落を取り出す（入れ子のブロック要素のテキストが親と重複することはない）
+    # リンク・画像・強調などのインライン要素はプレースホルダーにして訳文の中に残してもらう
+    parsed = extract_segments(text)
+    segments = [normalize_segment(segment.source) for segment in parsed]
+    # 1. 翻訳メモリにある段落はそのまま埋め込む
+    memory = get_translation_memory()
+    known = memory.lookup_many(segments)
+    replacements = {}
+    pending = {}
+    for seq, t in enumerate(segments):
+        if t in known:
+            replacements[seq] = known[t]
+        else:
+            # 同じ原文が複数箇所にある場合は1回だけ翻訳する
+            pending.setdefault(t, []).append(seq)
+    if stats is not None:
+        stats['segments'] = len(segments)
+        stats['tm_misses'] = sum(len(seqs) for seqs in pending.values())
+        stats['tm_hits'] = len(segments) - stats['tm_misses']
+    # 2. 未翻訳の段落を、訳文が max_tokens に収まる範囲でできるだけ大きなブロックにまとめる
+    blocks = pack_blocks(pending, item_overhead=SEGMENT_OVERHEAD_TOKENS)
+    if stats is not None:
+        stats['blocks'] = len(blocks)
+        stats['tokenizer'] = tokenizer_name()
+    if progress:
+        progress('plan', {
+            'blocks': len(blocks),
+            'segments': [{'seq': seq, 'en': parsed[seq].text, 'ja': _display(known.get(t))}
+                         for seq, t in enumerate(segments)]
+        })
+    # 3. ブロックを並列に翻訳し、文書順に結果を並べ直す
+    results = [None] * len(blocks)
+    usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'truncated': 0}
+    failed = 0
+    failed_segments = 0
+    if blocks:
+        with ThreadPoolExecutor(max_workers=min(TRANSLATION_CONCURRENCY, len(blocks))) as executor:
+            futures = {executor.submit(_translate_block, url, headers, block): i for i, block in enumerate(blocks)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index], block_usage = future.result()
+                except (requests.RequestException, KeyError, IndexError, TypeError, ValueError) as e:
+                    # 再試行はガバナーで済んでいるため、ここでは原文のまま残して失敗を記録する
+                    print(f"[翻訳APIエラー] block={index}: {e}")
+                    failed += 1
+                    if progress:
+                        progress('block_failed', {
+                            'index': index,
+                            'error': str(e),
+                            'seqs': [seq for en in blocks[index] for seq in pending[en]]
+                        })
+                    continue
+                for key in usage:
+                    usage[key] += block_usage[key]
+                if progress:
+                    pairs = list(zip(blocks[index], results[index]))
+                    progress('block', {
+                        'index': index,
+                        'segments': [{'seq': seq, 'ja': _display(ja)}
+                                     for en, ja in pairs if ja is not None for seq in pending[en]],
+                        'failed': [seq for en, ja in pairs if ja is None for seq in pending[en]]
+                    })
+    if stats is not None:
+        stats['failed_blocks'] = failed
+        stats['usage'] = usage
+        stats['expansion_ratio'] = round(get_expansion_ratio().value, 3)
+    if usage['requests']:
+        print(f"[DEBUG] 翻訳トークン使用量: {usage}")
+    # 4. 翻訳結果を段落ごとに埋め込む（文書の組み立て直しは最後に1回だけ行う）
+    for block, ja_texts in zip(blocks, results):
+        if ja_texts is None:
+            continue
+        translated = {}
+        for en, ja in zip(block, ja_texts):
+            # 再送しても訳文が得られなかった段落は原文のまま残す
+            if ja is None:
+                failed_segments += len(pending[en])
+                continue
+            translated[en] = ja
+            for seq in pending[en]:
+                replacements[seq] = ja
+        # 段落IDで対応を検証済みの訳文のみ翻訳メモリに保存
+        memory.store_many(translated)
+    if stats is not None:
+        stats['failed_segments'] = failed_segments
+    return apply_translations(text, parsed, replacements)
+
+def _display(ja: Optional[str]) -> Optional[str]:
+    """
+    途中経過として表示する訳文（プレースホルダーを取り除く）
+    """
+    return strip_placeholders(ja) if ja is not None else None
+
+BLOCK_SYSTEM_PROMPT = (
+    "You are a professional translator. Translate each English segment to Japanese. "
+    "The input is a JSON object {\"segments\": [{\"id\": <int>, \"text\": <English>}]}. "
+    "Reply with only a JSON object {\"translations\": [{\"id\": <int>, \"text\": <Japanese>}]} "
+    "containing exactly one entry for every input id. Never merge, split, reorder or omit segments. "
+    "Tags such as <g1>...</g1> and <x2/> are placeholders for links, images and formatting: keep every "
+    "placeholder exactly once and unchanged, wrapping the corresponding Japanese words."
+)
+# 段落ごとに {"id": n, "text": "..."} の構造で増えるトークン数の見込み
+SEGMENT_OVERHEAD_TOKENS = 10
+
+def _translate_block(url: str, headers: Dict, block: List[str]) -> Tuple[List[Optional[str]], Dict]:
+    """
+    1ブロック分の段落を段落ID付きのJSONで翻訳し、(段落ごとの訳文, トークン使用量) を返す（ワーカースレッドで実行）
+    訳文が欠けた・不正だった段落のみを TRANSLATION_SEGMENT_RETRIES 回まで再送し、それでも得られない段落はNoneにする
+    """
+    translations: List[Optional[str]] = [None] * len(block)
+    usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'truncated': 0}
+    remaining = list(range(len(block)))
+    for attempt in range(TRANSLATION_SEGMENT_RETRIES + 1):
+        if attempt:
+            print(f"[DEBUG] 訳文が得られなかった{len(remaining)}段落を再送します（{attempt}回目）")
+        got, request_usage = _request_segments(url, headers, {i: block[i] for i in remaining})
+        for key in usage:
+            usage[key] += request_usage[key]
+        for i, ja in got.items():
+            translations[i] = ja
+        remaining = [i for i in remaining if translations[i] is None]
+        if not remaining:
+            break
+    return translations, usage
+
+def _request_segments(url: str, headers: Dict, items: Dict[int, str]) -> Tuple[Dict[int, str], Dict]:
+    """
+    段落ID → 原文を1リクエストで翻訳し、検証を通った段落ID → 訳文と、トークン使用量を返す
+    訳文が max_tokens で途中で切れた場合は、段落を半分に分けて翻訳し直す
+    """
+    content = json.dumps({'segments': [{'id': i, 'text': text} for i, text in items.items()]}, ensure_ascii=False)
+    source_tokens = count_tokens(content)
+    payload = {
+        "messages": [
+            {"role": "system", "content": BLOCK_SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ],
+        "max_tokens": output_tokens_for(source_tokens),
+        "temperature": 0.3
+    }
+    if TRANSLATION_JSON_MODE:
+        payload["response_format"] = {"type": "json_object"}
+    # Azure OpenAIはプロンプト + max_tokens をレート制限の消費量として数える
+    result = _post_with_rate_limit(url, headers, payload,
+                                   PROMPT_OVERHEAD_TOKENS + source_tokens + payload["max_tokens"])
+    # choices が空・message がないなどの不正な応答は、このブロックの失敗として扱う（呼び出し側で原文のまま残す）
+    choices = result.get("choices") if isinstance(result, dict) else None
+    if not choices or not isinstance(choices[0], dict) or not isinstance(choices[0].get("message"), dict):
+        raise ValueError(f"翻訳APIの応答の形式が不正です: {str(result)[:200]}")
+    choice = choices[0]
+    reported = result.get("usage") or {}
+    usage = {
+        'requests': 1,
+        'prompt_tokens': reported.get('prompt_tokens', 0),
+        'completion_tokens': reported.get('completion_tokens', 0),
+        'truncated': 0
+    }
+    if choice.get("finish_reason") == "length":
+        usage['truncated'] = 1
+        if len(items) > 1:
+            print(f"[DEBUG] 訳文が max_tokens={payload['max_tokens']} で切れたため、段落を分割して再翻訳します")
+            ids = list(items)
+            half = len(ids) // 2
+            left, left_usage = _request_segments(url, headers, {i: items[i] for i in ids[:half]})
+            right, right_usage = _request_segments(url, headers, {i: items[i] for i in ids[half:]})
+            return {**left, **right}, {key: usage[key] + left_usage[key] + right_usage[key] for key in usage}
+    got = _parse_segments(choice["message"].get("content") or "", items)
+    if len(got) == len(items) and usage['completion_tokens']:
+        # 実測した訳文/原文の比で、次のブロックの大きさと max_tokens を調整する
+        get_expansion_ratio().update(source_tokens, usage['completion_tokens'])
+    return got, usage
+
+def _parse_segments(content: str, items: Dict[int, str]) -> Dict[int, str]:
+    """
+    モデルの応答から段落ID → 訳文を取り出す（未知のID・重複・空の訳文は不正として捨てる）
+    """
+    content = content.strip()
+    if content.startswith("```"):
+        # JSONモードを使わない場合にコードブロックで囲まれて返ることがある
+        content = content.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(content)
+    except ValueError:
+        print("[DEBUG] 翻訳結果がJSONとして解釈できませんでした")
+        return {}
+    entries = data.get("translations") if isinstance(data, dict) else data
+    got = {}
+    duplicated = set()
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
             continue
-    return str(soup)
+        seg_id = entry.get("id")
+        text = entry.get("text")
+        if isinstance(seg_id, str) and seg_id.isdigit():
+            seg_id = int(seg_id)
+        if seg_id not in items or not isinstance(text, str) or not text.strip():
+            continue
+        # プレースホルダーが欠けた・壊れた訳文はリンクなどが失われるため、不正として再送する
+        if not placeholders_match(items[seg_id], text):
+            continue
+        if seg_id in got:
+            duplicated.add(seg_id)
+        got[seg_id] = normalize_segment(text)
+    for seg_id in duplicated:
+        del got[seg_id]
+    return got
+
+def _post(url: str, headers: Dict, payload: Dict):
+    """
+    共有セッション（コネクションプール）とガバナー経由でAzure OpenAIにPOSTする
+    （chat completions は副作用がないため、冪等なリクエストとして5xx・接続エラーも再試行する）
+    """
+    registry = get_session_registry()
+    try:
+        return get_governor().request(registry.get(AZURE_OPENAI_SESSION), 'POST', url,
+                                      idempotent=True, headers=headers, json=payload)
+    except requests.ConnectionError:
+        registry.report_failure(AZURE_OPENAI_SESSION)
+        raise
+
+def _post_with_rate_limit(url: str, headers: Dict, payload: Dict, tokens: int) -> Dict:
+    """
+    TPM予算を確保してからPOSTする（429/503の再試行はガバナーがRetry-Afterに従って行う）
+    """
+    _token_budget.acquire(tokens)
+    response = _post(url, headers, payload)
+    response.raise_for_status()
+    return response.json()
 
 # Azure OpenAI APIによる翻訳（単文用）
 def translate_en_to_ja_azure(text: str) -> str:
@@ -83,7 +318,7 @@ def translate_en_to_ja_azure(text: str) -> str:
         "max_tokens": 2048,
         "temperature": 0.3
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _post(url, headers, payload)
     response.raise_for_status()
     result = response.json()
     return result["choices"][0]["message"]["content"].strip()
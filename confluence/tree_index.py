@@ -0,0 +1,478 @@
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Union
+
+from confluence.records import PageRecord
+from confluence.service import build_level_tree
+
+# ページツリーのインデックスのDB
+TREE_INDEX_PATH = os.getenv('TREE_INDEX_PATH', 'cache/tree_index.sqlite3')
+
+# 兄弟ページの並び順が不明なページは末尾に並べる
+_NO_POSITION = 2 ** 62
+# 一度の追加・削除でこの件数を超える場合は、1件ずつ区間を差し替えずにまとめて計算し直す
+_INCREMENTAL_LIMIT = 64
+
+
+class SpaceTree:
+    """
+    1スペース分のページツリー（配列で保持する親ポインタと、行きがけ順のEuler tourの区間）
+
+    - ページは配列の添字で表し、親・並び順・行きがけ順の位置・部分木の大きさ・深さを array に持つ
+    - 子孫は行きがけ順の配列の連続した区間 order[pre[x] + 1 : pre[x] + size[x]] になるため、
+      子孫の列挙・部分木の大きさ・深さ・祖先判定はツリーを辿らずに求められる
+    - 区間が計算済みの場合、ページの追加・移動・子のないページの削除はその部分木の区間だけを差し替えて更新する
+      （祖先の部分木の大きさと、差し込んだ位置より後ろの pre を更新する）。それ以外の更新や、
+      区間が未計算の間の更新では親ポインタのみ更新し、区間は次の問い合わせ時にまとめて計算し直す
+    """
+    def __init__(self, space_id: str):
+        self.space_id = space_id
+        self._ids: List[Optional[str]] = []
+        self._titles: List[Optional[str]] = []
+        self._index: Dict[str, int] = {}
+        self._parent = array('i')
+        self._position = array('q')
+        self._dead = 0
+        self._dirty = True
+        self._order = array('i')
+        self._pre = array('i')
+        self._size = array('i')
+        self._depth = array('i')
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, page_id: str) -> bool:
+        return page_id in self._index
+
+    def _node(self, page_id: str) -> int:
+        i = self._index.get(page_id)
+        if i is None:
+            # 親が先に分からない場合も、仮のノード（ルート扱い）を作っておく
+            i = len(self._ids)
+            self._index[page_id] = i
+            self._ids.append(page_id)
+            self._titles.append(None)
+            self._parent.append(-1)
+            self._position.append(_NO_POSITION)
+            self._pre.append(-1)
+            self._size.append(1)
+            self._depth.append(0)
+            if not self._dirty:
+                self._attach(i, array('i', [i]))
+        return i
+
+    def upsert(self, page_id: str, parent_id: Optional[str], title: Optional[str] = None,
+               position: Optional[int] = None) -> None:
+        """
+        ページを追加・更新する（parent_id が None の場合はルート。既存ページの親を変えると移動になる）
+        """
+        i = self._node(page_id)
+        parent = self._node(parent_id) if parent_id and parent_id != page_id else -1
+        if title is not None:
+            self._titles[i] = title
+        if self._parent[i] == parent and (position is None or self._position[i] == position):
+            return
+        if self._dirty or (parent >= 0 and self._pre[i] <= self._pre[parent] < self._pre[i] + self._size[i]):
+            # 区間が未計算の場合と、自分の子孫の下に移す（循環する）場合はまとめて計算し直す
+            self._parent[i] = parent
+            if position is not None:
+                self._position[i] = position
+            self._dirty = True
+            return
+        # 部分木の区間を取り出し、新しい親の下の並び順の位置に差し込む
+        block = self._detach(i)
+        self._parent[i] = parent
+        if position is not None:
+            self._position[i] = position
+        self._attach(i, block)
+
+    def upsert_many(self, rows: Iterable[tuple]) -> None:
+        """
+        (page_id, parent_id, title, position) の並びをまとめて追加・更新する
+        """
+        rows = list(rows)
+        if len(rows) > _INCREMENTAL_LIMIT:
+            self._dirty = True
+        for page_id, parent_id, title, position in rows:
+            self.upsert(page_id, parent_id, title, position)
+
+    def _detach(self, i: int) -> array:
+        """
+        ページ i の部分木の区間を行きがけ順の配列から取り除いて返す（祖先の部分木の大きさも減らす）
+        """
+        start, size = self._pre[i], self._size[i]
+        block = self._order[start:start + size]
+        del self._order[start:start + size]
+        parent = self._parent[i]
+        while parent >= 0:
+            self._size[parent] -= size
+            parent = self._parent[parent]
+        self._renumber(start)
+        return block
+
+    def _attach(self, i: int, block: array) -> None:
+        """
+        ページ i の部分木の区間 block を、親（self._parent[i]）の子の並び順の位置に差し込む
+        """
+        parent = self._parent[i]
+        if parent >= 0:
+            at, end = self._pre[parent] + 1, self._pre[parent] + self._size[parent]
+        else:
+            at, end = 0, len(self._order)
+        # 兄弟の部分木を飛ばしながら、並び順で自分より後になる最初の兄弟を探す
+        key = (self._position[i], self._ids[i])
+        while at < end:
+            sibling = self._order[at]
+            if (self._position[sibling], self._ids[sibling]) > key:
+                break
+            at += self._size[sibling]
+        self._order[at:at] = block
+        shift = (self._depth[parent] + 1 if parent >= 0 else 0) - self._depth[i]
+        if shift:
+            for j in block:
+                self._depth[j] += shift
+        while parent >= 0:
+            self._size[parent] += len(block)
+            parent = self._parent[parent]
+        self._renumber(at)
+
+    def _renumber(self, start: int) -> None:
+        # 行きがけ順の配列の start 以降に並ぶページの位置を更新する
+        order, pre = self._order, self._pre
+        for k in range(start, len(order)):
+            pre[order[k]] = k
+
+    def remove(self, page_id: str) -> None:
+        """
+        ページを削除する（Confluenceと同様に、子ページは削除したページの親の下に移る）
+        """
+        self.remove_many([page_id])
+
+    def remove_many(self, page_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        複数のページをまとめて削除する（子ページは削除されない最も近い祖先の下に移る）
+        親ポインタの走査は削除するページ数によらず1回（O(n + k)）で、区間は次の問い合わせ時に1回だけ計算し直す
+        戻り値: 親が変わった（残る）ページのID → 新しい親のID
+        """
+        removed = {self._index[page_id] for page_id in page_ids if page_id in self._index}
+        if not removed:
+            return {}
+        if not self._dirty and len(removed) <= _INCREMENTAL_LIMIT and all(self._size[i] == 1 for i in removed):
+            # 子のないページのみの削除は、区間を取り除くだけで他のページの親は変わらない
+            for i in removed:
+                self._detach(i)
+                del self._index[self._ids[i]]
+                self._ids[i] = None
+                self._titles[i] = None
+                self._parent[i] = -1
+                self._pre[i] = -1
+            self._dead += len(removed)
+            if self._dead > len(self._index):
+                # 削除済みの添字が増えたら、次の問い合わせ時に詰めて計算し直す
+                self._dirty = True
+            return {}
+        resolved: Dict[int, int] = {}
+
+        def surviving(i: int) -> int:
+            # 削除するページなら、削除されない最も近い祖先（なければ -1）に置き換える
+            chain = []
+            while i in removed and i not in resolved:
+                chain.append(i)
+                # 削除するページ同士の親子関係が循環している場合はルートにする
+                resolved[i] = -1
+                i = self._parent[i]
+            result = resolved.get(i, i)
+            for j in chain:
+                resolved[j] = result
+            return result
+
+        moved = {}
+        for j in range(len(self._parent)):
+            parent = self._parent[j]
+            if parent in removed and j not in removed:
+                parent = surviving(parent)
+                self._parent[j] = parent
+                moved[self._ids[j]] = self._ids[parent] if parent >= 0 else None
+        for i in removed:
+            del self._index[self._ids[i]]
+            self._ids[i] = None
+            self._titles[i] = None
+            self._parent[i] = -1
+        self._dead += len(removed)
+        self._dirty = True
+        return moved
+
+    def _compact(self) -> None:
+        # 削除済みの添字を詰める
+        alive = [i for i, page_id in enumerate(self._ids) if page_id is not None]
+        renumber = {old: new for new, old in enumerate(alive)}
+        self._ids = [self._ids[i] for i in alive]
+        self._titles = [self._titles[i] for i in alive]
+        self._parent = array('i', (renumber.get(self._parent[i], -1) for i in alive))
+        self._position = array('q', (self._position[i] for i in alive))
+        self._index = {page_id: i for i, page_id in enumerate(self._ids)}
+        self._dead = 0
+
+    def _rebuild(self) -> None:
+        """
+        親ポインタから行きがけ順・部分木の大きさ・深さを計算し直す（O(n)）
+        """
+        if self._dead:
+            self._compact()
+        n = len(self._ids)
+        children: List[List[int]] = [[] for _ in range(n)]
+        roots = []
+        for i in range(n):
+            parent = self._parent[i]
+            (children[parent] if parent >= 0 else roots).append(i)
+
+        def sort_key(i):
+            return self._position[i], self._ids[i]
+        for siblings in children:
+            if len(siblings) > 1:
+                siblings.sort(key=sort_key)
+        roots.sort(key=sort_key)
+
+        order = array('i')
+        pre = array('i', [-1]) * n
+        size = array('i', [1]) * n
+        depth = array('i', [0]) * n
+
+        def walk(root):
+            # 再帰を使わずに深さ優先で辿る（帰りがけで部分木の大きさを確定する）
+            stack = [(root, False)]
+            while stack:
+                i, done = stack.pop()
+                if done:
+                    size[i] = len(order) - pre[i]
+                    continue
+                pre[i] = len(order)
+                order.append(i)
+                stack.append((i, True))
+                for child in reversed(children[i]):
+                    if pre[child] < 0:
+                        depth[child] = depth[i] + 1
+                        stack.append((child, False))
+
+        for root in roots:
+            walk(root)
+        # 親子関係が循環しているページはルートからたどれないため、循環を切ってルートとして扱う
+        for i in range(n):
+            if pre[i] < 0:
+                self._parent[i] = -1
+                depth[i] = 0
+                walk(i)
+        self._order, self._pre, self._size, self._depth = order, pre, size, depth
+        self._dirty = False
+
+    def _get(self, page_id: str) -> int:
+        # 計算し直すと配列が作り直されるため、呼び出し側は _get の後で配列を読むこと
+        if self._dirty:
+            self._rebuild()
+        return self._index[page_id]
+
+    def descendants(self, page_id: str) -> List[str]:
+        """
+        子孫ページのIDを行きがけ順で返す（存在しないページは KeyError）
+        """
+        i = self._get(page_id)
+        start = self._pre[i] + 1
+        return [self._ids[j] for j in self._order[start:start + self._size[i] - 1]]
+
+    def ancestors(self, page_id: str) -> List[str]:
+        """
+        祖先ページのIDをルートから順に返す
+        """
+        i = self._get(page_id)
+        chain = []
+        parent = self._parent[i]
+        while parent >= 0:
+            chain.append(self._ids[parent])
+            parent = self._parent[parent]
+        chain.reverse()
+        return chain
+
+    def depth(self, page_id: str) -> int:
+        i = self._get(page_id)
+        return self._depth[i]
+
+    def subtree_size(self, page_id: str) -> int:
+        """
+        ページ自身を含む部分木のページ数
+        """
+        i = self._get(page_id)
+        return self._size[i]
+
+    def is_ancestor(self, ancestor_id: str, page_id: str) -> bool:
+        a = self._get(ancestor_id)
+        b = self._get(page_id)
+        return a != b and self._pre[a] < self._pre[b] < self._pre[a] + self._size[a]
+
+    def parent(self, page_id: str) -> Optional[str]:
+        i = self._get(page_id)
+        parent = self._parent[i]
+        return self._ids[parent] if parent >= 0 else None
+
+    def title(self, page_id: str) -> Optional[str]:
+        i = self._get(page_id)
+        return self._titles[i]
+
+    def flat_list(self, page_id: str) -> List[Dict]:
+        """
+        子孫ページを crawl_descendants と同じ形式（level は page_id からの深さ）で行きがけ順に返す
+        """
+        i = self._get(page_id)
+        base = self._depth[i]
+        start = self._pre[i] + 1
+        items = []
+        for j in self._order[start:start + self._size[i] - 1]:
+            position = self._position[j]
+            items.append({
+                'id': self._ids[j],
+                'title': self._titles[j],
+                'spaceId': self.space_id,
+                'childPosition': position if position != _NO_POSITION else None,
+                'parent_id': self._ids[self._parent[j]],
+                'level': self._depth[j] - base
+            })
+        return items
+
+
+class TreeIndex:
+    """
+    スペースごとのページツリーを保持するインデックス（SQLiteに親子関係を保存し、スペース単位でメモリに読み込む）
+    子孫ページの取得結果・スペース同期の結果から差分で更新し、ツリー表示・祖先・深さをAPIを呼ばずに返す
+    """
+    def __init__(self, db_path: str = TREE_INDEX_PATH):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._trees: Dict[str, SpaceTree] = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                space_id TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                parent_id TEXT,
+                title TEXT,
+                position INTEGER,
+                PRIMARY KEY (space_id, page_id)
+            );
+            CREATE INDEX IF NOT EXISTS nodes_page ON nodes (page_id);
+        ''')
+        self._conn.commit()
+
+    def tree(self, space_id: str) -> SpaceTree:
+        """
+        スペースのツリーを返す（初回はDBから読み込む）。返したツリーを読む間は他のスレッドの更新と競合しないよう、
+        問い合わせは view() などのメソッドを通して行う
+        """
+        with self._lock:
+            tree = self._trees.get(space_id)
+            if tree is None:
+                tree = SpaceTree(space_id)
+                for page_id, parent_id, title, position in self._conn.execute(
+                    'SELECT page_id, parent_id, title, position FROM nodes WHERE space_id = ?', (space_id,)
+                ):
+                    tree.upsert(page_id, parent_id, title, position)
+                self._trees[space_id] = tree
+            return tree
+
+    def space_of(self, page_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT space_id FROM nodes WHERE page_id = ? LIMIT 1', (page_id,)).fetchone()
+            return row[0] if row else None
+
+    def upsert_pages(self, space_id: str, pages: Iterable[Union[PageRecord, Dict]]) -> None:
+        """
+        ページ（PageRecord、または id / parentId / title / position を持つv2 APIのページデータ）を追加・更新する
+        """
+        records = (page if isinstance(page, PageRecord) else PageRecord.from_v2(page) for page in pages)
+        rows = [(space_id, page.id, page.parent_id, page.title, page.position) for page in records if page.id]
+        with self._lock:
+            tree = self.tree(space_id)
+            # 親が未登録の場合はツリーに仮のノード（ルート扱い）ができるため、DBにも同じ行を保存して読み込み直しても残るようにする
+            upserted = {row[1] for row in rows}
+            placeholders = {row[2] for row in rows if row[2] and row[2] not in tree and row[2] not in upserted}
+            tree.upsert_many(row[1:] for row in rows)
+            self._conn.executemany('INSERT OR IGNORE INTO nodes (space_id, page_id) VALUES (?, ?)',
+                                   [(space_id, page_id) for page_id in placeholders])
+            self._conn.executemany(
+                'INSERT INTO nodes (space_id, page_id, parent_id, title, position) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(space_id, page_id) DO UPDATE SET parent_id = excluded.parent_id, '
+                'title = COALESCE(excluded.title, title), position = COALESCE(excluded.position, position)',
+                rows
+            )
+            self._conn.commit()
+
+    def remove_pages(self, space_id: str, page_ids: Iterable[str]) -> None:
+        with self._lock:
+            tree = self.tree(space_id)
+            page_ids = [page_id for page_id in page_ids if page_id in tree]
+            # 子ページの付け替えはツリー上でまとめて求め、DBには親が変わったページだけを書く
+            moved = tree.remove_many(page_ids)
+            self._conn.executemany('UPDATE nodes SET parent_id = ? WHERE space_id = ? AND page_id = ?',
+                                   [(parent_id, space_id, page_id) for page_id, parent_id in moved.items()])
+            self._conn.executemany('DELETE FROM nodes WHERE space_id = ? AND page_id = ?',
+                                   [(space_id, page_id) for page_id in page_ids])
+            self._conn.commit()
+
+    def replace_subtree(self, space_id: str, root_id: str, descendants: List[PageRecord]) -> None:
+        """
+        子孫ページを取得し直した結果で root_id の部分木を置き換える
+        （以前は子孫だったが今回含まれないページは削除する。他の場所に移動していれば、そちらの取得時に追加される）
+        """
+        with self._lock:
+            tree = self.tree(space_id)
+            if root_id not in tree:
+                self.upsert_pages(space_id, [PageRecord(root_id)])
+            current = {page.id for page in descendants}
+            removed = [page_id for page_id in tree.descendants(root_id) if page_id not in current]
+            self.upsert_pages(space_id, descendants)
+            self.remove_pages(space_id, removed)
+
+    def view(self, page_id: str) -> Optional[Dict]:
+        """
+        ページの祖先・深さ・部分木の大きさと、子孫のツリー・フラットリストを返す（未登録のページはNone）
+        """
+        space_id = self.space_of(page_id)
+        if space_id is None:
+            return None
+        with self._lock:
+            tree = self.tree(space_id)
+            if page_id not in tree:
+                return None
+            result = build_level_tree(tree.flat_list(page_id), page_id)
+            result.update({
+                'space_id': space_id,
+                'title': tree.title(page_id),
+                'depth': tree.depth(page_id),
+                'subtree_size': tree.subtree_size(page_id),
+                'ancestors': [{'id': ancestor, 'title': tree.title(ancestor)} for ancestor in tree.ancestors(page_id)]
+            })
+            return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pages = self._conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+            spaces = self._conn.execute('SELECT COUNT(DISTINCT space_id) FROM nodes').fetchone()[0]
+            return {'spaces': spaces, 'pages': pages, 'loaded_spaces': len(self._trees)}
+
+
+_tree_index = None
+_tree_index_lock = threading.Lock()
+
+
+def get_tree_index() -> TreeIndex:
+    """
+    プロセス内で共有するツリーインデックスを返す
+    """
+    global _tree_index
+    with _tree_index_lock:
+        if _tree_index is None:
+            _tree_index = TreeIndex()
+        return _tree_index
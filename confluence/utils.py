@@ -35,4 +35,11 @@ def extract_page_id_from_url(page_input: str) -> Optional[str]:
         print(f"[DEBUG] 末尾数字抽出: {match.group(1)}")
         return match.group(1)
     print("[DEBUG] ID抽出失敗")
-    return None
\ No newline at end of file
+    return None
+
+
+def cql_quote(value: str) -> str:
+    """
+    CQLの文字列リテラルとして使えるように、値をダブルクォートで囲んでエスケープする
+    """
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
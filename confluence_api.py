@@ -2,9 +2,14 @@ import requests
 import json
 import base64
 import warnings
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 import os
+import urllib.parse
+from collections import deque
 from datetime import datetime
+from confluence.fields import v1_expand
+from confluence.pagination import V2_MAX_LIMIT, iter_cursor_results, next_cursor_url
+from confluence.utils import cql_quote
 
 # SSL証明書検証を無効化している警告を抑制
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
@@ -37,13 +42,29 @@ class ConfluenceAPI:
             'Accept': 'application/json'
         })
     
-    def get_space_content(self, space_key: str, limit: int = 25) -> Dict:
+    def _expand(self, fields: Optional[Iterable[str]], default: str) -> Dict:
+        """
+        取得するフィールドの集合を最小限のexpandパラメーターに変換
+        
+        Args:
+            fields: 取得するフィールドの集合（Noneの場合は従来どおり default を使う）
+            default: 既定のexpand
+            
+        Returns:
+            expandパラメーターの辞書（不要な場合は空）
+        """
+        expand = default if fields is None else v1_expand(fields)
+        return {'expand': expand} if expand else {}
+    
+    def get_space_content(self, space_key: str, limit: int = 25,
+                          fields: Optional[Iterable[str]] = None) -> Dict:
         """
         指定されたスペースのコンテンツを取得
         
         Args:
             space_key: スペースキー
             limit: 取得するコンテンツの最大数
+            fields: 取得するフィールドの集合（例: confluence.fields.TREE_FIELDS。省略時は本文・バージョン付き）
             
         Returns:
             APIレスポンスの辞書
@@ -52,27 +73,26 @@ class ConfluenceAPI:
         params = {
             'spaceKey': space_key,
             'limit': limit,
-            'expand': 'body.storage,version'
+            **self._expand(fields, 'body.storage,version')
         }
         
         response = self.session.get(url, params=params, verify=False)
         response.raise_for_status()
         return response.json()
     
-    def get_page_content(self, page_id: str) -> Dict:
+    def get_page_content(self, page_id: str, fields: Optional[Iterable[str]] = None) -> Dict:
         """
         指定されたページの詳細を取得
         
         Args:
             page_id: ページID
+            fields: 取得するフィールドの集合（省略時は本文・バージョン・子ページ付き）
             
         Returns:
             APIレスポンスの辞書
         """
         url = f"{self.base_url}/rest/api/content/{page_id}"
-        params = {
-            'expand': 'body.storage,version,children.page'
-        }
+        params = self._expand(fields, 'body.storage,version,children.page')
         
         response = self.session.get(url, params=params, verify=False)
         response.raise_for_status()
@@ -104,13 +124,15 @@ class ConfluenceAPI:
         response.raise_for_status()
         return response.json()
     
-    def get_page_children(self, page_id: str, limit: int = 25) -> Dict:
+    def get_page_children(self, page_id: str, limit: int = 25,
+                          fields: Optional[Iterable[str]] = None) -> Dict:
         """
         指定されたページの子ページを取得
         
         Args:
             page_id: ページID
             limit: 取得する子ページの最大数
+            fields: 取得するフィールドの集合（省略時は本文・バージョン付き）
             
         Returns:
             APIレスポンスの辞書
@@ -118,7 +140,7 @@ class ConfluenceAPI:
         url = f"{self.base_url}/rest/api/content/{page_id}/child/page"
         params = {
             'limit': limit,
-            'expand': 'body.storage,version'
+            **self._expand(fields, 'body.storage,version')
         }
         
         response = self.session.get(url, params=params, verify=False)
@@ -189,12 +211,10 @@ class ConfluenceAPI:
 
     def search_pages_v2(self, query: str, limit: int = 25) -> dict:
         """
-        ページをキーワードで検索（v2 API）
+        ページをキーワードで検索
+        （v2 APIには全文検索がないため、エスケープしたCQLでv1の検索APIを呼ぶ）
         """
-        url = f"{self.base_url}/wiki/api/v2/pages?limit={limit}&q={query}"
-        resp = self.session.get(url, verify=False)
-        resp.raise_for_status()
-        return resp.json()
+        return self.search_content(query, cql=f"type = page AND text ~ {cql_quote(query)}", limit=limit)
 
     def get_page_children_v2(self, page_id: str, limit: int = 10) -> dict:
         """
@@ -209,20 +229,19 @@ class ConfluenceAPI:
         """
         スペースID内の全ページをページネーションで取得（v2 API）
         """
-        all_pages = []
-        start = 0
-        limit = 50
-        while True:
-            url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}&start={start}"
+        return list(self.iter_all_pages_in_space_v2(space_id))
+
+    def iter_all_pages_in_space_v2(self, space_id: str, limit: int = V2_MAX_LIMIT):
+        """
+        スペースID内の全ページを1件ずつ返す遅延ジェネレーター（v2 API）
+        v2 APIはカーソル方式のため _links.next を辿り、次ページは先読みする
+        """
+        def fetch_json(url):
             resp = self.session.get(url, verify=False)
             resp.raise_for_status()
-            data = resp.json()
-            results = data.get('results', [])
-            all_pages.extend(results)
-            if not data.get('_links', {}).get('next'):
-                break
-            start += limit
-        return all_pages
+            return resp.json()
+        url = f"{self.base_url}/wiki/api/v2/spaces/{space_id}/pages?limit={limit}"
+        return iter_cursor_results(fetch_json, url, lambda data: next_cursor_url(self.base_url, data))
 
     def build_page_tree(self, pages: list) -> list:
         """
@@ -241,21 +260,34 @@ class ConfluenceAPI:
                 tree.append(page)
         return tree
 
-    def get_descendants_by_ancestor_v1(self, ancestor_id: str, limit: int = 50) -> list:
+    def get_descendants_by_ancestor_v1(self, ancestor_id: str, limit: int = 50,
+                                       fields: Optional[Iterable[str]] = None) -> list:
         """
         v1 APIのCQL検索でancestor=ページIDの全ての子孫ページを取得（孫ページ以降も含む）
+        ツリー表示のみなら fields=TREE_FIELDS を渡すと本文を取得しない
+        """
+        all_results = list(self.iter_descendants_by_ancestor_v1(ancestor_id, limit=limit, fields=fields))
+        print(f"Debug: v1 descendants API 完了 - 総結果数: {len(all_results)}")
+        return all_results
+
+    def iter_descendants_by_ancestor_v1(self, ancestor_id: str, limit: int = 50,
+                                        fields: Optional[Iterable[str]] = None):
+        """
+        v1 APIのCQL検索でancestor=ページIDの子孫ページを1件ずつ返すジェネレーター
+        （途中でループを抜ければ、以降のページは取得しない）
         """
-        all_results = []
         start = 0
+        yielded = 0
+        expand = self._expand(fields, 'body.storage,version,ancestors').get('expand')
+        expand_param = f"&expand={expand}" if expand else ''
         
         print(f"Debug: v1 descendants API 開始 - ancestor_id: {ancestor_id}")
         
         while True:
             # URLエンコードしてCQLクエリを安全に送信
-            import urllib.parse
             cql_query = f"ancestor={ancestor_id}"
             encoded_cql = urllib.parse.quote(cql_query)
-            url = f"{self.base_url}/rest/api/content?cql={encoded_cql}&limit={limit}&start={start}&expand=body.storage,version,ancestors"
+            url = f"{self.base_url}/rest/api/content?cql={encoded_cql}&limit={limit}&start={start}{expand_param}"
             print(f"Debug: リクエスト送信 - URL: {url}")
             
             resp = self.session.get(url, verify=False)
@@ -263,62 +295,65 @@ class ConfluenceAPI:
             
             if resp.status_code != 200:
                 print(f"Debug: エラーレスポンス - {resp.text}")
-                # 404エラーの場合、別のアプローチを試す
-                if resp.status_code == 404:
+                # 404エラーの場合、別のアプローチを試す（まだ1件も返していない場合のみ）
+                if resp.status_code == 404 and yielded == 0:
                     print("Debug: 404エラー - 別のアプローチを試します")
-                    return self.get_descendants_alternative(ancestor_id, limit)
+                    yield from self.iter_descendants_alternative(ancestor_id, limit)
+                    return
                 resp.raise_for_status()
             
             data = resp.json()
             results = data.get('results', [])
-            all_results.extend(results)
+            yield from results
+            yielded += len(results)
             
-            print(f"Debug: 取得した結果数: {len(results)}, 累計: {len(all_results)}")
+            print(f"Debug: 取得した結果数: {len(results)}, 累計: {yielded}")
             
             # 次のページがあるかチェック
-            if not data.get('_links', {}).get('next'):
+            if not results or not data.get('_links', {}).get('next'):
                 print("Debug: 次のページなし - 終了")
                 break
-            start += limit
-        
-        print(f"Debug: v1 descendants API 完了 - 総結果数: {len(all_results)}")
-        return all_results
+            start += len(results)
 
     def get_descendants_alternative(self, ancestor_id: str, limit: int = 50) -> list:
         """
         代替方法: v2 APIを使用して階層的に子ページを取得
         """
+        all_results = list(self.iter_descendants_alternative(ancestor_id, limit=limit))
+        print(f"Debug: 代替方法完了 - 総結果数: {len(all_results)}")
+        return all_results
+
+    def iter_descendants_alternative(self, ancestor_id: str, limit: int = 50, max_depth: Optional[int] = None):
+        """
+        代替方法: v2 APIで子ページを幅優先に辿り、子孫ページを1件ずつ返すジェネレーター
+        （明示的なキューで辿るため深い階層でも再帰しない。取得済みIDは再訪しないので循環しても止まる）
+        """
         print(f"Debug: 代替方法開始 - ancestor_id: {ancestor_id}")
         
-        all_results = []
-        to_process = [ancestor_id]
-        processed = set()
+        to_process = deque([(ancestor_id, 0)])
+        processed = {ancestor_id}
         
         while to_process:
-            current_id = to_process.pop(0)
-            if current_id in processed:
+            current_id, depth = to_process.popleft()
+            if max_depth is not None and depth >= max_depth:
                 continue
-                
-            processed.add(current_id)
             print(f"Debug: 処理中 - page_id: {current_id}")
             
             try:
                 # v2 APIで子ページを取得
-                children = self.get_children_v2(current_id, limit=limit)
-                all_results.extend(children)
-                
-                # 子ページのIDを次の処理対象に追加
+                children = self.iter_children_v2(current_id, limit=limit)
                 for child in children:
                     child_id = child.get('id')
-                    if child_id and child_id not in processed:
-                        to_process.append(child_id)
+                    if not child_id or child_id in processed:
+                        continue
+                    processed.add(child_id)
+                    yield child
+                    # 子ページのIDを次の処理対象に追加
+                    to_process.append((child_id, depth + 1))
                         
-            except Exception as e:
+            except RuntimeError as e:
                 print(f"Debug: 子ページ取得エラー - page_id: {current_id}, error: {e}")
                 continue
-        
-        print(f"Debug: 代替方法完了 - 総結果数: {len(all_results)}")
-        return all_results
 
     def build_descendants_tree(self, descendants: list, ancestor_id: str) -> dict:
         """
@@ -331,12 +366,14 @@ class ConfluenceAPI:
             if page_id:
                 # v2 APIの場合はparentIdを使用
                 parent_id = page.get('parentId')
-                # レベルは親ページの数で計算（簡易版）
-                level = 1  # デフォルトレベル
                 
-                # v2 APIの場合は、URLを手動で構築（スペースキーをECL2SOPに固定）
-                page_url = f"{self.base_url}/wiki/spaces/ECL2SOP/pages/{page_id}"
-                print(f"Debug: ページURL生成 - ID: {page_id}, URL: {page_url}")
+                # v2 APIの場合は _links.webui（スペースキーを含む相対パス）からURLを構築
+                # （webuiがなければスペースキーに依存しないpageIdでのURL）
+                webui = page.get('_links', {}).get('webui')
+                if webui:
+                    page_url = f"{self.base_url}/wiki{webui}"
+                else:
+                    page_url = f"{self.base_url}/wiki/pages/viewpage.action?pageId={page_id}"
                 
                 page_dict[page_id] = {
                     'id': page_id,
@@ -345,11 +382,27 @@ class ConfluenceAPI:
                     'status': page.get('status'),
                     'spaceId': page.get('spaceId'),
                     'parent_id': parent_id,
-                    'level': level,
+                    'level': None,
                     'url': page_url,
                     'children': []
                 }
         
+        # レベルは ancestor_id からの深さ（親をたどって求め、求めた深さは途中のページにも記録する）
+        if ancestor_id in page_dict:
+            page_dict[ancestor_id]['level'] = 0
+        for page_id in page_dict:
+            chain = []
+            current = page_id
+            while (current in page_dict and current != ancestor_id and current not in chain
+                   and page_dict[current]['level'] is None):
+                chain.append(current)
+                current = page_dict[current]['parent_id']
+            known = page_dict[current]['level'] if current in page_dict and current not in chain else None
+            level = known or 0
+            for node_id in reversed(chain):
+                level += 1
+                page_dict[node_id]['level'] = level
+        
         # 階層構造を構築
         tree = []
         for page_id, page_info in page_dict.items():
@@ -374,14 +427,21 @@ class ConfluenceAPI:
         """
         v2 APIで指定ページIDの子ページ一覧を取得（ネットワークエラー詳細出力付き）
         """
-        all_results = []
+        all_results = list(self.iter_children_v2(ancestor_id, limit=limit, cursor=cursor))
+        print(f"Debug: v2 children API 完了 - 総結果数: {len(all_results)}")
+        return all_results
+
+    def iter_children_v2(self, ancestor_id: str, limit: int = 50, cursor: str = None):
+        """
+        v2 APIで指定ページIDの子ページを1件ずつ返すジェネレーター（_links.next のカーソルを辿る）
+        """
         base_url = f"{self.base_url}/wiki/api/v2/pages/{ancestor_id}/children?limit={limit}"
         url = base_url if not cursor else f"{base_url}&cursor={cursor}"
         headers = {'Accept': 'application/json'}
         
         print(f"Debug: v2 children API 開始 - URL: {url}")
         
-        while True:
+        while url:
             try:
                 print(f"Debug: リクエスト送信 - URL: {url}")
                 resp = self.session.get(url, headers=headers, verify=False, auth=(self.username, self.api_token))
@@ -392,34 +452,27 @@ class ConfluenceAPI:
                     resp.raise_for_status()
                 
                 data = resp.json()
-                print(f"Debug: レスポンスデータ: {data}")
-                
-                results = data.get('results', [])
-                all_results.extend(results)
-                print(f"Debug: 取得した結果数: {len(results)}, 累計: {len(all_results)}")
-                
-                next_link = data.get('_links', {}).get('next')
-                if not next_link:
-                    print("Debug: 次のページなし - 終了")
-                    break
-                
-                # next_linkは絶対パスまたは相対パス
-                if next_link.startswith('http'):
-                    url = next_link
-                elif next_link.startswith('/'):
-                    url = self.base_url + next_link
-                else:
-                    url = base_url + '&cursor=' + next_link
-                print(f"Debug: 次のURL: {url}")
                 
             except Exception as e:
                 import traceback
                 error_details = traceback.format_exc()
                 print(f"Debug: 例外発生 - {error_details}")
                 raise RuntimeError(f"v2 children API error: {e} (url={url}, details={error_details})")
-        
-        print(f"Debug: v2 children API 完了 - 総結果数: {len(all_results)}")
-        return all_results
+            
+            results = data.get('results', [])
+            print(f"Debug: 取得した結果数: {len(results)}")
+            yield from results
+            
+            # next_linkは絶対パスまたは相対パス
+            next_link = data.get('_links', {}).get('next')
+            if not next_link:
+                print("Debug: 次のページなし - 終了")
+                break
+            if next_link.startswith('http') or next_link.startswith('/'):
+                url = next_cursor_url(self.base_url, data)
+            else:
+                url = base_url + '&cursor=' + next_link
+            print(f"Debug: 次のURL: {url}")
 
 def main():
     """
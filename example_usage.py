@@ -3,9 +3,11 @@
 Confluence APIの使用例
 """
 
-import json
 import os
 from confluence_api import ConfluenceAPI
+from confluence.api_client import ConfluenceAPI as ConfluenceClient
+from confluence.exporter import SpaceExporter
+from confluence.fields import TREE_FIELDS
 
 # 環境変数を読み込み（dotenvが利用可能な場合）
 try:
@@ -128,8 +130,8 @@ def example_get_page_hierarchy():
     space_key = os.getenv('CONFLUENCE_SPACE_KEY', 'DEMO')
     
     try:
-        # スペースのコンテンツを取得
-        content = confluence.get_space_content(space_key, limit=20)
+        # スペースのコンテンツを取得（階層表示には本文が不要なため、タイトルと祖先のみ取得）
+        content = confluence.get_space_content(space_key, limit=20, fields=TREE_FIELDS)
         
         # トップレベルのページを取得
         top_level_pages = [item for item in content.get('results', []) 
@@ -141,13 +143,13 @@ def example_get_page_hierarchy():
             print(f"\n📄 {page.get('title')}")
             
             # 子ページを取得
-            children = confluence.get_page_children(page.get('id'), limit=10)
+            children = confluence.get_page_children(page.get('id'), limit=10, fields=TREE_FIELDS)
             
             for child in children.get('results', []):
                 print(f"  └─ 📄 {child.get('title')}")
                 
                 # 孫ページを取得
-                grandchildren = confluence.get_page_children(child.get('id'), limit=5)
+                grandchildren = confluence.get_page_children(child.get('id'), limit=5, fields=TREE_FIELDS)
                 for grandchild in grandchildren.get('results', []):
                     print(f"    └─ 📄 {grandchild.get('title')}")
         
@@ -156,7 +158,8 @@ def example_get_page_hierarchy():
 
 def example_export_page_content():
     """
-    ページコンテンツをエクスポートする例
+    スペース内の全ページをNDJSON形式でエクスポートする例
+    （中断しても再実行すればチェックポイントから再開します）
     """
     print("\n=== ページコンテンツのエクスポート ===")
     
@@ -165,7 +168,7 @@ def example_export_page_content():
     username = os.getenv('CONFLUENCE_USERNAME', '')
     api_token = os.getenv('CONFLUENCE_API_TOKEN', '')
     
-    confluence = ConfluenceAPI(
+    confluence = ConfluenceClient(
         base_url=base_url,
         username=username,
         api_token=api_token
@@ -174,38 +177,10 @@ def example_export_page_content():
     space_key = os.getenv('CONFLUENCE_SPACE_KEY', 'DEMO')
     
     try:
-        # スペースのコンテンツを取得
-        content = confluence.get_space_content(space_key, limit=5)
-        
-        export_data = []
-        
-        for page in content.get('results', []):
-            if page.get('type') == 'page':
-                # ページの詳細を取得
-                page_detail = confluence.get_page_content(page.get('id'))
-                extracted = confluence.extract_page_content(page_detail)
-                
-                # エクスポート用データを作成
-                export_item = {
-                    'title': extracted['title'],
-                    'id': extracted['id'],
-                    'space_key': extracted['space_key'],
-                    'content': extracted['content'],
-                    'version': extracted['version'],
-                    'created': extracted['created'],
-                    'updated': extracted['updated'],
-                    'url': extracted['url']
-                }
-                
-                export_data.append(export_item)
-                
-                print(f"📄 {extracted['title']} - エクスポート完了")
-        
-        # JSONファイルに保存
-        with open('confluence_export.json', 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
+        exporter = SpaceExporter(confluence, space_key, 'confluence_export.ndjson.gz', compression='gzip')
+        result = exporter.run()
         
-        print(f"\n✅ {len(export_data)}ページを confluence_export.json にエクスポートしました")
+        print(f"\n✅ {result['exported']}ページを {result['output_path']} にエクスポートしました")
         
     except Exception as e:
         print(f"エラー: {e}")
@@ -0,0 +1,125 @@
+"""
+バックグラウンドジョブキュー（confluence.jobs）のタスクの取得・再開のテスト
+（ワーカースレッドは起動せず、取得・処理のメソッドを直接呼んで順序を固定する）
+"""
+import sqlite3
+import time
+
+from confluence import jobs
+from confluence.jobs import JobQueue
+
+
+def make_queue(db_path, processed=None, pages=('1', '2', '3')):
+    def process_page(page_id):
+        if processed is not None:
+            processed.append(page_id)
+        return 'translated'
+    return JobQueue(lambda kind, target: list(pages), process_page, db_path=str(db_path), workers=1)
+
+
+def test_job_runs_to_completion(tmp_path):
+    processed = []
+    queue = make_queue(tmp_path / 'jobs.db', processed)
+    job_id = queue.submit('tree', '100')
+    job = queue._claim_listing()
+    assert job['id'] == job_id
+    queue._list(job)
+    while True:
+        task = queue._claim_page()
+        if task is None:
+            break
+        queue._process(task)
+    assert processed == ['1', '2', '3']
+    result = queue.get(job_id)
+    assert result['status'] == 'completed'
+    assert result['progress']['translated'] == 3
+    assert result['progress']['percent'] == 100.0
+
+
+def test_recently_viewed_pages_first(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    queue.submit('tree', '100')
+    queue._list(queue._claim_listing())
+    queue.record_view('3')
+    queue.record_view('3')
+    # 閲覧はメモリに溜め、タスクの取得時にまとめてDBへ書き込む
+    with sqlite3.connect(str(tmp_path / 'jobs.db')) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM page_views').fetchone()[0] == 0
+    assert queue._claim_page()['page_id'] == '3'
+    assert queue._claim_page()['page_id'] == '1'
+    with sqlite3.connect(str(tmp_path / 'jobs.db')) as conn:
+        assert conn.execute('SELECT page_id, views FROM page_views').fetchall() == [('3', 2)]
+
+
+def test_two_queues_never_claim_the_same_task(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    first = make_queue(db_path)
+    second = make_queue(db_path)
+    first.submit('tree', '100')
+    # ジョブの分解も1つのキューだけが取得する
+    job = first._claim_listing()
+    assert job is not None
+    assert second._claim_listing() is None
+    first._list(job)
+    claimed = []
+    for queue in (first, second, first, second):
+        task = queue._claim_page()
+        if task is not None:
+            claimed.append(task['page_id'])
+    assert sorted(claimed) == ['1', '2', '3']
+
+
+def test_restart_does_not_requeue_live_tasks(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    first = make_queue(db_path)
+    first.submit('tree', '100')
+    first._list(first._claim_listing())
+    task = first._claim_page()
+    # 別のプロセス（再起動後など）が同じDBを開いても、期限内の実行中タスクは取り直さない
+    second = make_queue(db_path)
+    claimed = {second._claim_page()['page_id'], second._claim_page()['page_id']}
+    assert task['page_id'] not in claimed
+    assert second._claim_page() is None
+
+
+def test_expired_lease_is_reclaimed(tmp_path, monkeypatch):
+    db_path = tmp_path / 'jobs.db'
+    processed = []
+    first = make_queue(db_path, pages=('1',))
+    first.submit('tree', '100')
+    first._list(first._claim_listing())
+    monkeypatch.setattr(jobs, 'JOBS_LEASE_SECONDS', 0.05)
+    stalled = first._claim_page()
+    assert stalled['page_id'] == '1'
+    time.sleep(0.1)
+    # 期限が延長されなかった（止まったプロセスの）タスクは他のキューが取り直す
+    second = make_queue(db_path, processed, pages=('1',))
+    task = second._claim_page()
+    assert task['page_id'] == '1'
+    monkeypatch.setattr(jobs, 'JOBS_LEASE_SECONDS', 300)
+    second._process(task)
+    # 期限切れになったキューの結果は記録しない
+    first._process(stalled)
+    with sqlite3.connect(str(db_path)) as conn:
+        owner = conn.execute("SELECT owner, status FROM job_pages WHERE page_id = '1'").fetchone()
+    assert owner == (second.owner, 'translated')
+    assert processed == ['1']
+
+
+def test_tasks_without_lease_from_older_databases_are_resumed(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    # 期限の列がない以前の形式のDBで、実行中のまま止まったタスク
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.executescript('''
+            CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, target TEXT NOT NULL, status TEXT NOT NULL,
+                               total INTEGER, error TEXT, created REAL NOT NULL, started REAL, finished REAL);
+            CREATE TABLE job_pages (job_id TEXT NOT NULL, page_id TEXT NOT NULL, status TEXT NOT NULL,
+                                    PRIMARY KEY (job_id, page_id));
+            INSERT INTO jobs (id, kind, target, status, total, created) VALUES ('old', 'tree', '100', 'running', 1, 0);
+            INSERT INTO job_pages VALUES ('old', '1', 'running');
+        ''')
+    processed = []
+    queue = make_queue(db_path, processed)
+    queue._process(queue._claim_page())
+    assert processed == ['1']
+    assert queue.get('old')['status'] == 'completed'
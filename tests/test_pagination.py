@@ -0,0 +1,119 @@
+"""
+v2 APIのカーソルによるページング（confluence.pagination・ConfluenceAPI）のテスト
+"""
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from confluence.api_client import ConfluenceAPI
+from confluence.pagination import iter_cursor_pages, iter_cursor_results, next_cursor_url
+
+BASE_URL = 'https://example.atlassian.net'
+
+
+def make_pages(total, page_size, path='/wiki/api/v2/spaces/1/pages'):
+    """
+    cursor=0, page_size, ... の各ページを返す擬似APIのレスポンス（_links.next は相対パス）
+    """
+    responses = {}
+    for start in range(0, total, page_size):
+        data = {'results': [{'id': str(i)} for i in range(start, min(start + page_size, total))]}
+        if start + page_size < total:
+            data['_links'] = {'next': f'{path}?limit={page_size}&cursor={start + page_size}'}
+        responses[start] = data
+    return responses
+
+
+class FakeFetch:
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        with self._lock:
+            self.urls.append(url)
+        cursor = parse_qs(urlparse(url).query).get('cursor', ['0'])[0]
+        return self.responses[int(cursor)]
+
+
+def resolve(data):
+    return next_cursor_url(BASE_URL, data)
+
+
+def test_next_cursor_url():
+    assert next_cursor_url(BASE_URL, {}) is None
+    assert next_cursor_url(BASE_URL, {'_links': {'next': ''}}) is None
+    assert next_cursor_url(BASE_URL + '/', {'_links': {'next': '/wiki/api/v2/pages?cursor=abc'}}) == \
+        BASE_URL + '/wiki/api/v2/pages?cursor=abc'
+    absolute = 'https://other.example.com/wiki/api/v2/pages?cursor=abc'
+    assert next_cursor_url(BASE_URL, {'_links': {'next': absolute}}) == absolute
+
+
+def test_iter_cursor_pages_follows_cursor_in_order():
+    for prefetch in (False, True):
+        fetch = FakeFetch(make_pages(7, 3))
+        batches = list(iter_cursor_pages(fetch, BASE_URL + '/wiki/api/v2/spaces/1/pages?limit=3', resolve,
+                                         prefetch=prefetch))
+        assert [[page['id'] for page in results] for results, _ in batches] == \
+            [['0', '1', '2'], ['3', '4', '5'], ['6']]
+        # 各バッチと一緒に次ページのURLを返す（最後はNone）。チェックポイントからの再開に使う
+        assert [next_url for _, next_url in batches] == [
+            BASE_URL + '/wiki/api/v2/spaces/1/pages?limit=3&cursor=3',
+            BASE_URL + '/wiki/api/v2/spaces/1/pages?limit=3&cursor=6',
+            None
+        ]
+        assert len(fetch.urls) == 3
+
+
+def test_iter_cursor_results_is_lazy_without_prefetch():
+    fetch = FakeFetch(make_pages(10, 2))
+    results = iter_cursor_results(fetch, BASE_URL + '/wiki/api/v2/spaces/1/pages?limit=2', resolve, prefetch=False)
+    assert [next(results)['id'] for _ in range(3)] == ['0', '1', '2']
+    # 3件目を返すまでに取得したのは2ページ分のみ
+    assert len(fetch.urls) == 2
+
+
+def test_empty_result():
+    fetch = FakeFetch({0: {'results': []}})
+    assert list(iter_cursor_results(fetch, BASE_URL + '/wiki/api/v2/spaces/1/pages', resolve)) == []
+
+
+class FakeGovernor:
+    """
+    ConfluenceAPI の送信を擬似APIのレスポンスに差し替える（URLのパスごとにページを返す）
+    """
+    def __init__(self, routes):
+        self.routes = routes
+        self.urls = []
+
+    def request(self, session, method, url, **kwargs):
+        self.urls.append(url)
+        parsed = urlparse(url)
+        cursor = int(parse_qs(parsed.query).get('cursor', ['0'])[0])
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.routes[parsed.path][cursor]).encode('utf-8')
+        response.url = url
+        return response
+
+
+def test_api_client_follows_cursors():
+    children_path = '/wiki/api/v2/pages/100/children'
+    space_path = '/wiki/api/v2/spaces/1/pages'
+    governor = FakeGovernor({
+        children_path: make_pages(5, 2, children_path),
+        space_path: make_pages(600, 250, space_path)
+    })
+    api = ConfluenceAPI(BASE_URL, 'user', 'token', governor=governor)
+
+    assert [page['id'] for page in api.get_all_children_v2('100', limit=2)] == ['0', '1', '2', '3', '4']
+    assert len(api.get_all_pages_in_space_v2('1')) == 600
+
+    # 途中のカーソルから再開すると、それ以降のページのみ取得する
+    start_url = BASE_URL + space_path + '?limit=250&cursor=250'
+    batches = list(api.iter_space_page_batches_v2('1', start_url=start_url))
+    assert [len(results) for results, _ in batches] == [250, 100]
+    assert batches[-1][1] is None
@@ -0,0 +1,134 @@
+"""
+ストレージ形式の段落抽出（confluence.storage_format）のテスト
+"""
+from confluence.storage_format import apply_translations, extract_segments
+
+
+def texts(xhtml):
+    return [segment.text for segment in extract_segments(xhtml)]
+
+
+def translate_all(xhtml):
+    segments = extract_segments(xhtml)
+    return apply_translations(xhtml, segments, {i: f'T{i}' for i in range(len(segments))})
+
+
+def test_paragraphs_with_inline_elements():
+    xhtml = '<p>Hello <strong>world</strong>.</p><p>Second</p>'
+    segments = extract_segments(xhtml)
+    assert [segment.text for segment in segments] == ['Hello world.', 'Second']
+    # 翻訳APIにはインライン要素をプレースホルダーにした原文を送り、訳文のプレースホルダーを元のタグに戻す
+    assert [segment.source for segment in segments] == ['Hello <g1>world</g1>.', 'Second']
+    assert apply_translations(xhtml, segments, {0: '<g1>世界</g1>こんにちは。', 1: '2番目'}) == \
+        '<p><strong>世界</strong>こんにちは。</p><p>2番目</p>'
+
+
+def test_nested_macros_do_not_duplicate_text():
+    xhtml = (
+        '<ac:structured-macro ac:name="info">'
+        '<ac:parameter ac:name="title">Note title</ac:parameter>'
+        '<ac:rich-text-body><p>Restart the <em>service</em>.</p>'
+        '<ac:structured-macro ac:name="expand"><ac:rich-text-body><p>Inner step</p></ac:rich-text-body>'
+        '</ac:structured-macro></ac:rich-text-body></ac:structured-macro>'
+    )
+    # マクロのパラメーターは翻訳せず、入れ子のマクロの段落は親の段落に含めない
+    assert texts(xhtml) == ['Restart the service.', 'Inner step']
+    assert translate_all(xhtml) == (
+        '<ac:structured-macro ac:name="info">'
+        '<ac:parameter ac:name="title">Note title</ac:parameter>'
+        '<ac:rich-text-body><p>T0<em></em></p>'
+        '<ac:structured-macro ac:name="expand"><ac:rich-text-body><p>T1</p></ac:rich-text-body>'
+        '</ac:structured-macro></ac:rich-text-body></ac:structured-macro>'
+    )
+
+
+def test_opaque_elements_are_left_untouched():
+    xhtml = (
+        '<p>Run:</p>'
+        '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">bash</ac:parameter>'
+        '<ac:plain-text-body><![CDATA[systemctl restart nginx]]></ac:plain-text-body></ac:structured-macro>'
+        '<pre>raw <b>x</b> <pre>nested</pre> still raw</pre><p>After</p>'
+    )
+    assert texts(xhtml) == ['Run:', 'After']
+    assert translate_all(xhtml) == xhtml.replace('<p>Run:</p>', '<p>T0</p>').replace('<p>After</p>', '<p>T1</p>')
+
+
+def test_links_inside_a_balanced_inline_run():
+    xhtml = (
+        '<p>See <ac:link><ri:page ri:content-title="Runbook" />'
+        '<ac:plain-text-link-body><![CDATA[the runbook]]></ac:plain-text-link-body></ac:link>'
+        ' and <a href="https://example.com/docs">docs</a> now.</p>'
+    )
+    segments = extract_segments(xhtml)
+    # リンク文字列は段落のテキストに含めるが、翻訳APIにはリンク全体を1つのプレースホルダーで送る
+    assert [segment.text for segment in segments] == ['See the runbook and docs now.']
+    assert [segment.source for segment in segments] == ['See <x1/> and <g2>docs</g2> now.']
+    link = ('<ac:link><ri:page ri:content-title="Runbook" />'
+            '<ac:plain-text-link-body><![CDATA[the runbook]]></ac:plain-text-link-body></ac:link>')
+    # プレースホルダーの順序が入れ替わってもリンクは残る
+    assert apply_translations(xhtml, segments, {0: '<x1/>と<g2>ドキュメント</g2>を今すぐ参照してください。'}) == (
+        f'<p>{link}と<a href="https://example.com/docs">ドキュメント</a>を今すぐ参照してください。</p>'
+    )
+
+
+def test_images_survive_translation():
+    image = '<ac:image ac:height="250"><ri:attachment ri:filename="diagram.png" /></ac:image>'
+    xhtml = f'<p>The flow is shown below.<br />{image}</p>'
+    segments = extract_segments(xhtml)
+    assert [segment.source for segment in segments] == ['The flow is shown below.<x1/><x2/>']
+    assert apply_translations(xhtml, segments, {0: '流れを以下に示します。<x1/><x2/>'}) == \
+        f'<p>流れを以下に示します。<br />{image}</p>'
+
+
+def test_translation_missing_placeholders_keeps_markup():
+    xhtml = '<p>Open <a href="https://example.com">the docs</a> and <ac:image><ri:url ri:value="x.png" /></ac:image></p>'
+    # プレースホルダーが欠けた訳文でも、リンク・画像のタグは消さずにテキスト部分のみを置き換える
+    assert translate_all(xhtml) == \
+        '<p>T0<a href="https://example.com"></a> <ac:image><ri:url ri:value="x.png" /></ac:image></p>'
+
+
+def test_link_only_paragraph_is_not_translated():
+    xhtml = '<p><ac:link><ri:page ri:content-title="Runbook" /></ac:link></p>'
+    assert texts(xhtml) == []
+    assert translate_all(xhtml) == xhtml
+
+
+def test_unbalanced_inline_run_keeps_tags():
+    xhtml = '<p>Start <strong>bold</p><p>end</strong> tail</p>'
+    assert texts(xhtml) == ['Start bold', 'end tail']
+    # タグが揃っていない段落はテキスト部分のみを置き換え、タグは残す
+    assert translate_all(xhtml) == '<p>T0<strong></p><p>T1</strong></p>'
+
+
+def test_entities_are_unescaped_and_translations_escaped():
+    xhtml = '<p>A &amp; B &lt;tag&gt;</p>'
+    segments = extract_segments(xhtml)
+    assert [segment.text for segment in segments] == ['A & B <tag>']
+    assert apply_translations(xhtml, segments, {0: 'A と B <tag>'}) == '<p>A と B &lt;tag&gt;</p>'
+
+
+def test_tables_and_nested_lists():
+    xhtml = (
+        '<table><tbody><tr><th>Name</th><td>Value <code>x</code></td></tr></tbody></table>'
+        '<ul><li>One<ul><li>Nested</li></ul></li></ul>'
+    )
+    assert texts(xhtml) == ['Name', 'Value x', 'One', 'Nested']
+    assert translate_all(xhtml) == (
+        '<table><tbody><tr><th>T0</th><td>T1<code></code></td></tr></tbody></table>'
+        '<ul><li>T2<ul><li>T3</li></ul></li></ul>'
+    )
+
+
+def test_untranslated_segments_round_trip_unchanged():
+    xhtml = (
+        '<h1>Title</h1>\n<p>  Leading and trailing spaces  </p>'
+        '<ac:structured-macro ac:name="note"><ac:rich-text-body><p>Body</p></ac:rich-text-body></ac:structured-macro>'
+    )
+    segments = extract_segments(xhtml)
+    assert [segment.text for segment in segments] == ['Title', 'Leading and trailing spaces', 'Body']
+    # 訳文のない段落は原文のまま、一部だけ訳した場合もそれ以外の部分は変わらない
+    assert apply_translations(xhtml, segments, {}) == xhtml
+    assert apply_translations(xhtml, segments, {1: '前後の空白'}) == (
+        '<h1>Title</h1>\n<p>  前後の空白  </p>'
+        '<ac:structured-macro ac:name="note"><ac:rich-text-body><p>Body</p></ac:rich-text-body></ac:structured-macro>'
+    )
@@ -0,0 +1,65 @@
+"""
+ページツリーのインデックス（confluence.tree_index）のテスト
+"""
+import random
+
+from confluence.records import PageRecord
+from confluence.tree_index import _NO_POSITION, SpaceTree, TreeIndex
+
+
+def snapshot(tree):
+    return {page_id: (tree.parent(page_id), tree.descendants(page_id), tree.depth(page_id), tree.subtree_size(page_id))
+            for page_id in list(tree._index)}
+
+
+def rebuilt(tree):
+    # 同じ親子関係・並び順から作り直したツリー（区間はまとめて計算される）
+    other = SpaceTree(tree.space_id)
+    for page_id, i in tree._index.items():
+        parent = tree._parent[i]
+        position = tree._position[i]
+        other.upsert(page_id, tree._ids[parent] if parent >= 0 else None, None,
+                     None if position == _NO_POSITION else position)
+    return other
+
+
+def test_incremental_updates_match_a_full_rebuild():
+    rng = random.Random(0)
+    for _ in range(50):
+        tree = SpaceTree('s')
+        for k in range(20):
+            tree.upsert(str(k), str(rng.randrange(k)) if k else None, None, rng.randrange(5))
+        tree.depth('0')
+        for _ in range(30):
+            page_ids = list(tree._index)
+            if rng.random() < 0.7 or not page_ids:
+                # 追加・移動（未登録の親は仮のノードになる。自分の子孫の下への移動も含む）
+                tree.upsert(str(rng.randrange(40)), rng.choice(page_ids + [None, 'missing']), None,
+                            rng.choice([None, rng.randrange(5)]))
+            else:
+                tree.remove_many(rng.sample(page_ids, 1))
+            assert snapshot(tree) == snapshot(rebuilt(tree))
+
+
+def test_leaf_insert_keeps_the_tour_without_rebuilding():
+    tree = SpaceTree('s')
+    tree.upsert('root', None)
+    tree.upsert('b', 'root', position=2)
+    tree.depth('root')
+    tree.upsert('a', 'root', position=1)
+    tree.upsert('c', 'b', position=1)
+    assert not tree._dirty
+    assert tree.descendants('root') == ['a', 'b', 'c']
+    tree.upsert('b', 'a')
+    assert not tree._dirty
+    assert tree.descendants('a') == ['b', 'c']
+    assert tree.depth('c') == 3
+
+
+def test_placeholder_parents_survive_reload(tmp_path):
+    db_path = str(tmp_path / 'tree.db')
+    TreeIndex(db_path).upsert_pages('S', [PageRecord('child', parent_id='parent', title='Child')])
+    # 親がまだ取得されていなくても、読み込み直した後も子ページは親の下にある
+    view = TreeIndex(db_path).view('parent')
+    assert [page['id'] for page in view['flat_list']] == ['child']
+    assert view['space_id'] == 'S'